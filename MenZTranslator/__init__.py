@@ -3,15 +3,37 @@ MenZ Translation Server Package
 リアルタイム翻訳専用AI WebSocketサーバー
 """
 
+import importlib
+from typing import Any
+
+from .config import Config
+
 __version__ = "0.1.0"
 __author__ = "MenZ Translation Team"
 
-from .translator import NLLBTranslator
-from .websocket_server import TranslationWebSocketServer
-from .config import Config
+# torch / transformers 等を読み込むモジュールは最初に使われた時点で読み込む
+_LAZY_IMPORTS = {
+    "NLLBTranslator": ".translator",
+    "TranslationWebSocketServer": ".websocket_server",
+    "TranslationGateway": ".gateway"
+}
 
 __all__ = [
     "NLLBTranslator",
     "TranslationWebSocketServer",
+    "TranslationGateway",
     "Config"
-] 
\ No newline at end of file
+]
+
+
+def __getattr__(name: str) -> Any:
+    module_name = _LAZY_IMPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
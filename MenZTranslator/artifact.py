@@ -0,0 +1,82 @@
+"""
+モデル成果物モジュール
+起動を速くするため、変換済みの重み・高速トークナイザー・言語コード表をローカルに書き出す
+"""
+
+import json
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+import torch
+import transformers
+from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+
+from .languages import LanguageRegistry
+
+
+# 成果物ディレクトリの目印となるマニフェスト
+MANIFEST_FILE = "menz_artifact.json"
+LANGUAGES_FILE = "languages.json"
+
+DTYPES = {
+    'float32': torch.float32,
+    'float16': torch.float16,
+    'bfloat16': torch.bfloat16
+}
+
+
+def is_artifact(path: str) -> bool:
+    """prepare_artifact() で作成したディレクトリか"""
+    return os.path.isfile(os.path.join(path, MANIFEST_FILE))
+
+
+def read_manifest(path: str) -> Dict:
+    with open(os.path.join(path, MANIFEST_FILE), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def prepare_artifact(model_name: str, output_dir: str, dtype: str = 'float32') -> Dict:
+    """モデルを指定の精度に変換し、起動用の成果物を書き出す
+
+    - model.safetensors: 変換済みの重み（読み込み時にmmapされる）
+    - tokenizer.json: 高速トークナイザー
+    - languages.json: 言語コードとトークンIDの対応表
+    """
+    if dtype not in DTYPES:
+        raise ValueError(f"dtype は {', '.join(DTYPES)} のいずれかを指定してください: {dtype}")
+
+    start_time = time.time()
+    os.makedirs(output_dir, exist_ok=True)
+
+    logging.info(f"成果物を作成中: {model_name} -> {output_dir} ({dtype})")
+    tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=True)
+    if not tokenizer.is_fast:
+        logging.warning("高速トークナイザーを作成できませんでした。通常のトークナイザーを保存します")
+    model = AutoModelForSeq2SeqLM.from_pretrained(model_name, torch_dtype=DTYPES[dtype], low_cpu_mem_usage=True)
+
+    model.save_pretrained(output_dir, safe_serialization=True)
+    tokenizer.save_pretrained(output_dir)
+    LanguageRegistry.from_tokenizer(tokenizer).save(os.path.join(output_dir, LANGUAGES_FILE))
+
+    manifest = {
+        "source_model": model_name,
+        "dtype": dtype,
+        "fast_tokenizer": tokenizer.is_fast,
+        "transformers_version": transformers.__version__,
+        "torch_version": torch.__version__,
+        "created_at": time.strftime('%Y-%m-%dT%H:%M:%S')
+    }
+    with open(os.path.join(output_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    logging.info(f"成果物の作成が完了しました ({time.time() - start_time:.2f}秒)")
+    return manifest
+
+
+def artifact_dtype(path: str) -> Optional[torch.dtype]:
+    """成果物の重みの精度（成果物でない場合はNone）"""
+    if not is_artifact(path):
+        return None
+    return DTYPES.get(read_manifest(path).get("dtype"))
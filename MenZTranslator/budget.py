@@ -0,0 +1,169 @@
+"""
+メモリ予算管理モジュール
+バッチの推論に必要なメモリを見積もり、予算内に収まるようにバッチを分割する
+"""
+
+import logging
+import os
+import threading
+from typing import Dict, Tuple
+
+import torch
+
+
+# OOM発生時に予算を縮小する倍率と下限
+BACKOFF_FACTOR = 0.5
+MIN_SCALE = 1 / 16
+# この回数だけ連続で成功したら予算を少しずつ戻す
+RECOVERY_STREAK = 20
+RECOVERY_FACTOR = 1.25
+
+
+def is_out_of_memory(error: BaseException) -> bool:
+    """メモリ不足による例外か"""
+    if isinstance(error, MemoryError):
+        return True
+    oom_error = getattr(torch.cuda, 'OutOfMemoryError', None)
+    if oom_error is not None and isinstance(error, oom_error):
+        return True
+    message = str(error).lower()
+    return isinstance(error, RuntimeError) and ('out of memory' in message or "can't allocate memory" in message)
+
+
+def available_memory(device: torch.device) -> int:
+    """デバイスで現在利用可能なメモリ量（バイト）"""
+    if device.type == 'cuda':
+        free, _ = torch.cuda.mem_get_info(device)
+        return free
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        # 取得できない環境では 4GB とみなす
+        return 4 * 1024 ** 3
+
+
+class MemoryBudget:
+    """生成時のアクティベーション（KVキャッシュ・ロジット等）のメモリ予算
+
+    1行（テキスト×翻訳先言語）あたりのメモリを入力トークン数・ビーム数・max_length から見積もり、
+    予算内に収まる行数ずつデコードする。OOMが発生した場合は予算を縮小して再試行し、
+    成功が続いた場合は少しずつ元に戻す。
+    """
+
+    def __init__(self, model_config, device: torch.device, budget_bytes: int, dtype_bytes: int = 4):
+        self.device = device
+        self.budget_bytes = budget_bytes
+        self.dtype_bytes = dtype_bytes
+        self.d_model = model_config.d_model
+        self.decoder_layers = model_config.decoder_layers
+        self.ffn_dim = max(model_config.encoder_ffn_dim, model_config.decoder_ffn_dim)
+        self.vocab_size = model_config.vocab_size
+        self.scale = 1.0
+        self._streak = 0
+        self._lock = threading.Lock()
+        self.stats = {
+            'batches': 0,
+            'split_batches': 0,
+            'clamped_max_length': 0,
+            'oom_backoffs': 0,
+            'last_batch_peak_mb': 0.0,
+            'max_batch_peak_mb': 0.0
+        }
+
+    @classmethod
+    def for_model(cls, model, device: torch.device, budget_mb: int = 0, fp16: bool = False) -> "MemoryBudget":
+        """モデルの構成から予算を作成（budget_mb が0の場合はモデル読み込み後の空きメモリから決める）"""
+        if budget_mb > 0:
+            budget_bytes = budget_mb * 1024 * 1024
+        else:
+            # GPUは空きメモリの80%、CPUは他のプロセスと共有するため50%
+            ratio = 0.8 if device.type == 'cuda' else 0.5
+            budget_bytes = int(available_memory(device) * ratio)
+        budget = cls(model.config, device, budget_bytes, dtype_bytes=2 if fp16 else 4)
+        logging.info(f"アクティベーションのメモリ予算: {budget_bytes / 1024 / 1024:.0f}MB")
+        return budget
+
+    def estimate(self, rows: int, input_tokens: int, num_beams: int, max_length: int) -> int:
+        """rows 行のデコードに必要なメモリ量（バイト）の見積もり"""
+        sequences = rows * max(1, num_beams)
+        width = self.d_model * self.dtype_bytes
+        # デコーダーの自己注意KVキャッシュとエンコーダー出力への交差注意KVキャッシュ
+        kv_cache = 2 * self.decoder_layers * sequences * (max_length + input_tokens) * width
+        # 展開したエンコーダー出力と1ステップ分のFFN中間表現
+        encoder_states = sequences * input_tokens * width
+        ffn = sequences * self.ffn_dim * self.dtype_bytes
+        # ロジットとビームサーチのスコア（FP32）
+        logits = 2 * sequences * self.vocab_size * 4
+        return kv_cache + encoder_states + ffn + logits
+
+    @property
+    def effective_budget(self) -> int:
+        return int(self.budget_bytes * self.scale)
+
+    def plan(self, rows: int, input_tokens: int, num_beams: int, max_length: int) -> Tuple[int, int]:
+        """予算内に収まる (1回にデコードする行数, max_length) を決める"""
+        budget = self.effective_budget
+        per_row = self.estimate(1, input_tokens, num_beams, max_length)
+        chunk_rows = max(1, min(rows, budget // per_row)) if per_row else rows
+
+        if per_row > budget:
+            # 1行でも収まらない場合は max_length を縮める（入力長を下回らない範囲で）
+            fitted = max_length
+            while fitted > input_tokens and self.estimate(1, input_tokens, num_beams, fitted) > budget:
+                fitted = max(input_tokens, fitted * 3 // 4)
+            if fitted < max_length:
+                with self._lock:
+                    self.stats['clamped_max_length'] += 1
+                logging.warning(f"メモリ予算に収まらないため max_length を {max_length} から {fitted} に縮めます")
+                max_length = fitted
+
+        if chunk_rows < rows:
+            with self._lock:
+                self.stats['split_batches'] += 1
+        return chunk_rows, max_length
+
+    def start_batch(self):
+        """バッチのピークメモリ計測を開始"""
+        if self.device.type == 'cuda':
+            torch.cuda.reset_peak_memory_stats(self.device)
+            return torch.cuda.memory_allocated(self.device)
+        return 0
+
+    def finish_batch(self, baseline: int, estimated_bytes: int):
+        """バッチのピークメモリを記録（CPUでは見積もり値）"""
+        if self.device.type == 'cuda':
+            peak = torch.cuda.max_memory_allocated(self.device) - baseline
+        else:
+            peak = estimated_bytes
+        peak_mb = round(peak / 1024 / 1024, 1)
+
+        with self._lock:
+            self.stats['batches'] += 1
+            self.stats['last_batch_peak_mb'] = peak_mb
+            self.stats['max_batch_peak_mb'] = max(self.stats['max_batch_peak_mb'], peak_mb)
+            # 成功が続いたら縮小した予算を戻す
+            if self.scale < 1.0:
+                self._streak += 1
+                if self._streak >= RECOVERY_STREAK:
+                    self.scale = min(1.0, self.scale * RECOVERY_FACTOR)
+                    self._streak = 0
+
+    def back_off(self) -> bool:
+        """OOM発生時に予算を縮小（これ以上縮小できない場合は False）"""
+        with self._lock:
+            self._streak = 0
+            if self.scale <= MIN_SCALE:
+                return False
+            self.scale = max(MIN_SCALE, self.scale * BACKOFF_FACTOR)
+            self.stats['oom_backoffs'] += 1
+        logging.warning(f"メモリ不足を検出しました。メモリ予算を {self.effective_budget / 1024 / 1024:.0f}MB に縮小します")
+        if self.device.type == 'cuda':
+            torch.cuda.empty_cache()
+        return True
+
+    def get_stats(self) -> Dict:
+        return {
+            "budget_mb": round(self.budget_bytes / 1024 / 1024, 1),
+            "effective_budget_mb": round(self.effective_budget / 1024 / 1024, 1),
+            **self.stats
+        }
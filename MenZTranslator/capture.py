@@ -0,0 +1,138 @@
+"""
+トラフィック記録モジュール
+受信した翻訳リクエストの到着時刻・長さ・言語ペア等を追記専用のJSONLファイルに記録する（replay.py で再生）
+"""
+
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from .config import Config
+
+
+# 記録ファイルの形式のバージョン（ヘッダー行に記録）
+CAPTURE_VERSION = 1
+
+# 記録するメッセージタイプ
+CAPTURED_TYPES = ('translation', 'prefetch')
+
+
+class TrafficRecorder:
+    """翻訳リクエストの記録（書き込みは別スレッドで行う）
+
+    原文は既定では記録せず、文字数とハッシュのみを記録する。ハッシュが同じリクエストは
+    再生時も同じテキストになるため、キャッシュ・翻訳メモリのヒット率も再現される。
+    """
+
+    def __init__(self, path: str, include_text: bool = False, hash_salt: str = '', max_bytes: int = 0):
+        self.path = path
+        self.include_text = include_text
+        self.hash_salt = hash_salt
+        self.max_bytes = max_bytes
+        self.stats = {
+            'recorded': 0,
+            'dropped': 0
+        }
+        self._queue: "queue.SimpleQueue[Optional[str]]" = queue.SimpleQueue()
+        self._full = False
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._file = open(path, 'a', encoding='utf-8')
+        self._size = self._file.tell()
+        self._write_line({
+            "capture": "menz-traffic",
+            "version": CAPTURE_VERSION,
+            "started_at": round(time.time(), 3),
+            "include_text": include_text
+        })
+        self._thread = threading.Thread(target=self._writer, name="traffic-capture", daemon=True)
+        self._thread.start()
+        logging.info(f"トラフィックの記録を開始しました: {path}")
+
+    @classmethod
+    def from_config(cls, config: Config) -> Optional["TrafficRecorder"]:
+        """設定から作成（無効の場合はNone）"""
+        if not config.capture_enabled:
+            return None
+        return cls(config.capture_file, config.capture_include_text, config.capture_hash_salt,
+                   config.capture_max_file_mb * 1024 * 1024)
+
+    def _hash(self, text: str) -> str:
+        return hashlib.sha1(f"{self.hash_salt}{text}".encode('utf-8')).hexdigest()[:16]
+
+    def _text_fields(self, text: str) -> Dict[str, Any]:
+        fields = {"chars": len(text), "text_hash": self._hash(text)}
+        if self.include_text:
+            fields["text"] = text
+        return fields
+
+    def record(self, message_type: str, data: Dict, client_id: str):
+        """受信したメッセージを記録（イベントループからはキューに積むだけ）"""
+        if self._full:
+            self.stats['dropped'] += 1
+            return
+
+        entry: Dict[str, Any] = {
+            "ts": round(time.time(), 3),
+            "type": message_type,
+            "client": self._hash(client_id)[:8],
+            "source_lang": data.get('source_lang'),
+            "target_lang": data.get('target_lang'),
+            "target_langs": data.get('target_langs'),
+            "priority": data.get('priority'),
+            "max_length": data.get('max_length'),
+            "decoding": data.get('decoding')
+        }
+        if message_type == 'prefetch':
+            texts = data.get('texts')
+            entry["texts"] = [self._text_fields(text) for text in texts if isinstance(text, str)] \
+                if isinstance(texts, list) else []
+        else:
+            text = data.get('text')
+            entry.update(self._text_fields(text if isinstance(text, str) else ''))
+            if data.get('stream_key'):
+                entry["stream"] = self._hash(str(data['stream_key']))[:8]
+                entry["incremental"] = bool(data.get('incremental', False))
+                entry["final"] = bool(data.get('final', False))
+
+        # 未指定の項目は記録しない
+        line = json.dumps({k: v for k, v in entry.items() if v is not None}, ensure_ascii=False, separators=(',', ':'))
+        self._queue.put(line)
+
+    def _write_line(self, data: Dict):
+        line = json.dumps(data, ensure_ascii=False, separators=(',', ':')) + '\n'
+        self._file.write(line)
+        self._size += len(line.encode('utf-8'))
+
+    def _writer(self):
+        while True:
+            line = self._queue.get()
+            if line is None:
+                break
+            encoded = line + '\n'
+            if self.max_bytes and self._size + len(encoded.encode('utf-8')) > self.max_bytes:
+                if not self._full:
+                    logging.warning(f"トラフィック記録ファイルが上限に達したため記録を停止します: {self.path}")
+                self._full = True
+                self.stats['dropped'] += 1
+                continue
+            self._file.write(encoded)
+            self._size += len(encoded.encode('utf-8'))
+            self.stats['recorded'] += 1
+            # キューが空になったらまとめて書き出す
+            if self._queue.empty():
+                self._file.flush()
+
+    def close(self):
+        """キューに残った記録を書き出して閉じる"""
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+        self._file.close()
+
+    def get_stats(self) -> Dict:
+        return {"file": self.path, "full": self._full, **self.stats}
@@ -4,7 +4,7 @@
 
 import os
 import configparser
-from typing import Any
+from typing import Any, Dict, List, Optional, Tuple
 
 
 class Config:
@@ -13,6 +13,8 @@ class Config:
     def __init__(self, config_file: str = "config/translator.ini"):
         self.config_path = config_file
         self.config = configparser.ConfigParser()
+        # コマンドライン引数による上書き（再読み込み時に引き継ぐ）
+        self._overrides: Dict[Tuple[str, str], str] = {}
         
         if not os.path.exists(config_file):
             self._create_default_config()
@@ -24,7 +26,11 @@ class Config:
         self.config['SERVER'] = {
             'host': '127.0.0.1',
             'port': '8765',
-            'max_connections': '50'
+            'max_connections': '50',
+            'max_inflight_per_connection': '16',  # 1接続で同時に処理するメッセージ数の上限
+            'max_inflight_per_gateway': '1024',  # ゲートウェイからの接続の上限（[GATEWAY] backend_max_inflight より大きくする）
+            'ordered_delivery': 'false',  # 応答を受信順に送信するか（クライアントから変更可能）
+            'admin_token': ''  # 管理コマンド（reload 等）の認証トークン（空の場合は管理コマンドを無効化）
         }
         
         self.config['TRANSLATION'] = {
@@ -32,14 +38,109 @@ class Config:
             'device': 'auto',  # auto, cpu, cuda, mps
             'gpu_id': '0',  # GPU ID (0, 1, 2, ...) for multi-GPU systems
             'max_length': '256',
-            'use_fp16': 'false'  # FP16（半精度）を使用するかどうか
+            'max_length_limit': '512',  # クライアントが指定できる max_length の上限
+            'use_fp16': 'false',  # FP16（半精度）を使用するかどうか
+            'protect_markup': 'true',  # タグ・URL・絵文字をモデルに渡さない
+            'triage': 'true'  # 数値・記号・URL・翻訳先言語のテキストはモデルに渡さない
+        }
+        
+        self.config['DECODING'] = {
+            'mode': 'beam',  # beam: ビームサーチ, assisted: ドラフトモデルによる投機的デコード
+            'num_beams': '4',
+            'assistant_model': '',  # assisted で使用するドラフトモデル（例: facebook/nllb-200-distilled-600M）
+            'static_kv_cache': 'false'  # KVキャッシュを事前確保する（対応モデルのみ）
+        }
+        
+        self.config['SCHEDULING'] = {
+            'quantum': '64',  # 1巡で各クライアントに割り当てる推論コスト（推定トークン数）
+            'default_weight': '1.0'
+            # client.<名前> = APIキー, 重み（API キーを送信したクライアントの割り当てを増減する）
+        }
+        
+        self.config['CACHE'] = {
+            'encoder_cache_mb': '256',  # エンコーダー出力キャッシュの上限（0で無効）
+            'result_cache_entries': '10000',  # 翻訳結果キャッシュの件数上限（0で無効、prefetch も無効）
+            'prefetch_max_texts': '200',  # 1回の prefetch で指定できるテキスト数
+            'prefetch_max_queued': '2000'  # 待機できる事前翻訳の最大数（超えた分は破棄）
+        }
+        
+        self.config['MEMORY'] = {
+            'enabled': 'false',
+            'files': '',  # 翻訳メモリ（.tsv / .jsonl、カンマ区切りで複数指定可）
+            'glossary_files': ''  # 用語集（.tsv / .jsonl、カンマ区切りで複数指定可）
+        }
+        
+        self.config['ROUTING'] = {
+            'enabled': 'false',
+            'memory_budget_mb': '8192',  # 読み込み済みモデルの合計メモリ上限
+            'short_max_chars': '80',  # これ以下の文字数は short
+            'long_min_chars': '400',  # これ以上の文字数は long
+            # rule.<名前> = 言語ペア, 入力長クラス(short/medium/long/*), モデル名（上から順に評価）
+            'rule.short': '*->*, short, facebook/nllb-200-distilled-600M'
+        }
+        
+        self.config['GATEWAY'] = {
+            'backends': '',  # ws://host:port をカンマ区切りで指定
+            'local_workers': '0',  # 同一ホストで起動する翻訳サーバーの数
+            'local_worker_base_port': '55101',
+            'virtual_nodes': '64',
+            'health_check_interval': '5',
+            'health_check_timeout': '3',
+            'backend_max_inflight': '256'  # 1台の翻訳サーバーに同時に転送するリクエスト数の上限
+        }
+        
+        self.config['PERFORMANCE'] = {
+            'intra_op_threads': '0',  # 演算内の並列スレッド数（0: CPUアフィニティのCPU数 / PyTorchの既定値）
+            'inter_op_threads': '0',  # 演算間の並列スレッド数（0: PyTorchの既定値）
+            'cpu_affinity': '',  # 使用するCPU（例: 0-7,16-23）
+            'numa_node': '-1',  # 使用するNUMAノード（-1で指定なし、cpu_affinityより優先）
+            'worker_cpu_sets': '',  # ローカル翻訳サーバーごとのCPU（; 区切り、numa でNUMAノードに順に割り当て）
+            'activation_budget_mb': '0'  # 生成時に使用するメモリの上限（0: 空きメモリから自動設定）
+        }
+        
+        self.config['VOCABULARY'] = {
+            'prune': 'false',  # デコーダーの出力語彙を翻訳先言語の文字のトークンに削減する
+            'languages': 'jpn_Jpan, eng_Latn',  # 翻訳先として使用する言語
+            'cache_dir': 'cache/vocab'  # 語彙の対応表のキャッシュ
+        }
+        
+        self.config['IDLE'] = {
+            'timeout': '0',  # この秒数リクエストがない場合にモデルをディスクに退避する（0で無効）
+            'check_interval': '30',
+            'offload_dir': 'cache/offload'  # 退避した重みの保存先
+        }
+        
+        self.config['CAPTURE'] = {
+            'enabled': 'false',  # 翻訳リクエストの到着パターンを記録する（replay.py で再生）
+            'file': 'logs/traffic.jsonl',
+            'include_text': 'false',  # 原文を記録する（false の場合は文字数とハッシュのみ）
+            'hash_salt': '',  # 原文のハッシュに加える文字列
+            'max_file_mb': '512'  # これを超えると記録を停止する（0で無制限）
+        }
+        
+        self.config['WATCHDOG'] = {
+            'job_timeout': '120',  # 1つの翻訳ジョブの推論時間の上限（秒、0で無効）
+            'exit_on_stall': 'false',  # 上限を超えた場合にプロセスを終了する（ゲートウェイのローカル翻訳サーバーでは常に有効）
+            'quarantine_after': '2',  # 停止・クラッシュをこの回数起こした入力を隔離する（0で無効）
+            'quarantine_ttl': '3600',  # 隔離する秒数
+            'restart_backoff_max': '30'  # ローカル翻訳サーバーの再起動までの待ち時間の上限（秒）
+        }
+        
+        self.config['PROFILING'] = {
+            'output_dir': 'logs/profiles',  # 管理コマンド "profile"・SIGUSR1 で計測した結果の保存先
+            'default_duration': '10',  # 計測時間（秒）
+            'max_duration': '120',
+            'sample_interval_ms': '5',  # スタック・イベントループ遅延の計測間隔
+            'torch_trace': 'true'  # 推論を torch.profiler で計測する
         }
         
         self.config['LOGGING'] = {
             'level': 'INFO',
             'file': 'logs/translator.log',
             'max_file_size': '10485760',  # 10MB
-            'backup_count': '5'
+            'backup_count': '5',
+            'text_sample_rate': '1.0',  # 翻訳テキストをログに出力する割合（0.0〜1.0）
+            'text_max_chars': '200'  # ログに出力する翻訳テキストの最大文字数（0で無制限）
         }
         
         # ディレクトリ作成
@@ -65,6 +166,24 @@ class Config:
         """設定値を浮動小数として取得"""
         return self.config.getfloat(section, key, fallback=fallback)
     
+    def override(self, section: str, key: str, value: Any):
+        """設定値を上書き（ファイルには保存しない）"""
+        if not self.config.has_section(section):
+            self.config.add_section(section)
+        self.config.set(section, key, str(value))
+        self._overrides[(section, key)] = str(value)
+    
+    def reloaded(self) -> "Config":
+        """設定ファイルを読み直した新しい設定（上書きした値は引き継ぐ）"""
+        config = Config(self.config_path)
+        for (section, key), value in self._overrides.items():
+            config.override(section, key, value)
+        return config
+    
+    def getlist(self, section: str, key: str, fallback: str = '') -> List[str]:
+        """カンマ区切りの設定値をリストとして取得"""
+        return [item.strip() for item in self.get(section, key, fallback).split(',') if item.strip()]
+    
     @property
     def server_host(self) -> str:
         return self.get('SERVER', 'host', '127.0.0.1')
@@ -77,6 +196,22 @@ class Config:
     def max_connections(self) -> int:
         return self.getint('SERVER', 'max_connections', 50)
     
+    @property
+    def max_inflight_per_connection(self) -> int:
+        return self.getint('SERVER', 'max_inflight_per_connection', 16)
+    
+    @property
+    def max_inflight_per_gateway(self) -> int:
+        return self.getint('SERVER', 'max_inflight_per_gateway', 1024)
+    
+    @property
+    def ordered_delivery(self) -> bool:
+        return self.getboolean('SERVER', 'ordered_delivery', False)
+    
+    @property
+    def admin_token(self) -> str:
+        return self.get('SERVER', 'admin_token', '').strip()
+    
     @property
     def model_name(self) -> str:
         return self.get('TRANSLATION', 'model_name', 'facebook/nllb-200-distilled-1.3B')
@@ -93,14 +228,267 @@ class Config:
     def max_length(self) -> int:
         return self.getint('TRANSLATION', 'max_length', 256)
     
+    @property
+    def max_length_limit(self) -> int:
+        return self.getint('TRANSLATION', 'max_length_limit', 512)
+    
+    @property
+    def triage(self) -> bool:
+        return self.getboolean('TRANSLATION', 'triage', True)
+    
     @property
     def use_fp16(self) -> bool:
         return self.getboolean('TRANSLATION', 'use_fp16', False)
     
+    @property
+    def protect_markup(self) -> bool:
+        return self.getboolean('TRANSLATION', 'protect_markup', True)
+    
+    @property
+    def decoding(self) -> str:
+        return self.get('DECODING', 'mode', 'beam')
+    
+    @property
+    def num_beams(self) -> int:
+        return self.getint('DECODING', 'num_beams', 4)
+    
+    @property
+    def assistant_model(self) -> Optional[str]:
+        return self.get('DECODING', 'assistant_model', '') or None
+    
+    @property
+    def static_kv_cache(self) -> bool:
+        return self.getboolean('DECODING', 'static_kv_cache', False)
+    
+    @property
+    def scheduling_quantum(self) -> int:
+        return self.getint('SCHEDULING', 'quantum', 64)
+    
+    @property
+    def scheduling_default_weight(self) -> float:
+        return self.getfloat('SCHEDULING', 'default_weight', 1.0)
+    
+    @property
+    def scheduling_clients(self) -> Dict[str, Tuple[str, float]]:
+        """API キー → (名前, 重み)"""
+        if not self.config.has_section('SCHEDULING'):
+            return {}
+        clients = {}
+        for key, value in self.config.items('SCHEDULING'):
+            if not key.startswith('client.'):
+                continue
+            api_key, _, weight = value.rpartition(',')
+            clients[api_key.strip()] = (key[len('client.'):], float(weight))
+        return clients
+    
+    @property
+    def encoder_cache_mb(self) -> int:
+        return self.getint('CACHE', 'encoder_cache_mb', 256)
+    
+    @property
+    def result_cache_entries(self) -> int:
+        return self.getint('CACHE', 'result_cache_entries', 10000)
+    
+    @property
+    def prefetch_max_texts(self) -> int:
+        return self.getint('CACHE', 'prefetch_max_texts', 200)
+    
+    @property
+    def prefetch_max_queued(self) -> int:
+        return self.getint('CACHE', 'prefetch_max_queued', 2000)
+    
+    @property
+    def intra_op_threads(self) -> int:
+        return self.getint('PERFORMANCE', 'intra_op_threads', 0)
+    
+    @property
+    def inter_op_threads(self) -> int:
+        return self.getint('PERFORMANCE', 'inter_op_threads', 0)
+    
+    @property
+    def cpu_affinity(self) -> str:
+        return self.get('PERFORMANCE', 'cpu_affinity', '').strip()
+    
+    @property
+    def numa_node(self) -> int:
+        return self.getint('PERFORMANCE', 'numa_node', -1)
+    
+    @property
+    def worker_cpu_sets(self) -> List[str]:
+        return [item.strip() for item in self.get('PERFORMANCE', 'worker_cpu_sets', '').split(';') if item.strip()]
+    
+    @property
+    def activation_budget_mb(self) -> int:
+        return self.getint('PERFORMANCE', 'activation_budget_mb', 0)
+    
+    @property
+    def vocabulary_prune(self) -> bool:
+        return self.getboolean('VOCABULARY', 'prune', False)
+    
+    @property
+    def vocabulary_languages(self) -> List[str]:
+        return [code.strip() for code in self.get('VOCABULARY', 'languages', 'jpn_Jpan, eng_Latn').split(',') if code.strip()]
+    
+    @property
+    def vocabulary_cache_dir(self) -> str:
+        return self.get('VOCABULARY', 'cache_dir', 'cache/vocab')
+    
+    @property
+    def idle_timeout(self) -> float:
+        return self.getfloat('IDLE', 'timeout', 0.0)
+    
+    @property
+    def idle_check_interval(self) -> float:
+        return self.getfloat('IDLE', 'check_interval', 30.0)
+    
+    @property
+    def idle_offload_dir(self) -> str:
+        return self.get('IDLE', 'offload_dir', 'cache/offload')
+    
+    @property
+    def capture_enabled(self) -> bool:
+        return self.getboolean('CAPTURE', 'enabled', False)
+    
+    @property
+    def capture_file(self) -> str:
+        return self.get('CAPTURE', 'file', 'logs/traffic.jsonl')
+    
+    @property
+    def capture_include_text(self) -> bool:
+        return self.getboolean('CAPTURE', 'include_text', False)
+    
+    @property
+    def capture_hash_salt(self) -> str:
+        return self.get('CAPTURE', 'hash_salt', '')
+    
+    @property
+    def capture_max_file_mb(self) -> int:
+        return self.getint('CAPTURE', 'max_file_mb', 512)
+    
+    @property
+    def watchdog_job_timeout(self) -> float:
+        return self.getfloat('WATCHDOG', 'job_timeout', 120.0)
+    
+    @property
+    def watchdog_exit_on_stall(self) -> bool:
+        return self.getboolean('WATCHDOG', 'exit_on_stall', False)
+    
+    @property
+    def quarantine_after(self) -> int:
+        return self.getint('WATCHDOG', 'quarantine_after', 2)
+    
+    @property
+    def quarantine_ttl(self) -> float:
+        return self.getfloat('WATCHDOG', 'quarantine_ttl', 3600.0)
+    
+    @property
+    def worker_restart_backoff_max(self) -> float:
+        return self.getfloat('WATCHDOG', 'restart_backoff_max', 30.0)
+    
+    @property
+    def profiling_output_dir(self) -> str:
+        return self.get('PROFILING', 'output_dir', 'logs/profiles')
+    
+    @property
+    def profiling_default_duration(self) -> float:
+        return self.getfloat('PROFILING', 'default_duration', 10.0)
+    
+    @property
+    def profiling_max_duration(self) -> float:
+        return self.getfloat('PROFILING', 'max_duration', 120.0)
+    
+    @property
+    def profiling_sample_interval_ms(self) -> float:
+        return self.getfloat('PROFILING', 'sample_interval_ms', 5.0)
+    
+    @property
+    def profiling_torch_trace(self) -> bool:
+        return self.getboolean('PROFILING', 'torch_trace', True)
+    
     @property
     def log_level(self) -> str:
         return self.get('LOGGING', 'level', 'INFO')
     
     @property
     def log_file(self) -> str:
-        return self.get('LOGGING', 'file', 'logs/translator.log') 
\ No newline at end of file
+        return self.get('LOGGING', 'file', 'logs/translator.log')
+    
+    @property
+    def log_max_file_size(self) -> int:
+        return self.getint('LOGGING', 'max_file_size', 10485760)
+    
+    @property
+    def log_backup_count(self) -> int:
+        return self.getint('LOGGING', 'backup_count', 5)
+    
+    @property
+    def log_text_sample_rate(self) -> float:
+        return self.getfloat('LOGGING', 'text_sample_rate', 1.0)
+    
+    @property
+    def log_text_max_chars(self) -> int:
+        return self.getint('LOGGING', 'text_max_chars', 200)
+    
+    @property
+    def memory_enabled(self) -> bool:
+        return self.getboolean('MEMORY', 'enabled', False)
+    
+    @property
+    def memory_files(self) -> List[str]:
+        return self.getlist('MEMORY', 'files')
+    
+    @property
+    def glossary_files(self) -> List[str]:
+        return self.getlist('MEMORY', 'glossary_files')
+    
+    @property
+    def gateway_backends(self) -> List[str]:
+        return self.getlist('GATEWAY', 'backends')
+    
+    @property
+    def gateway_local_workers(self) -> int:
+        return self.getint('GATEWAY', 'local_workers', 0)
+    
+    @property
+    def gateway_local_worker_base_port(self) -> int:
+        return self.getint('GATEWAY', 'local_worker_base_port', 55101)
+    
+    @property
+    def gateway_virtual_nodes(self) -> int:
+        return self.getint('GATEWAY', 'virtual_nodes', 64)
+    
+    @property
+    def gateway_health_interval(self) -> float:
+        return self.getfloat('GATEWAY', 'health_check_interval', 5.0)
+    
+    @property
+    def gateway_health_timeout(self) -> float:
+        return self.getfloat('GATEWAY', 'health_check_timeout', 3.0)
+    
+    @property
+    def gateway_backend_max_inflight(self) -> int:
+        return self.getint('GATEWAY', 'backend_max_inflight', 256)
+    
+    @property
+    def routing_enabled(self) -> bool:
+        return self.getboolean('ROUTING', 'enabled', False)
+    
+    @property
+    def routing_memory_budget_mb(self) -> int:
+        return self.getint('ROUTING', 'memory_budget_mb', 8192)
+    
+    @property
+    def routing_short_max_chars(self) -> int:
+        return self.getint('ROUTING', 'short_max_chars', 80)
+    
+    @property
+    def routing_long_min_chars(self) -> int:
+        return self.getint('ROUTING', 'long_min_chars', 400)
+    
+    @property
+    def routing_rules(self) -> List[Tuple[str, str]]:
+        """(ルール名, 値) のリスト（設定ファイルの記載順）"""
+        if not self.config.has_section('ROUTING'):
+            return []
+        return [(key[len('rule.'):], value) for key, value in self.config.items('ROUTING')
+                if key.startswith('rule.')]
@@ -0,0 +1,456 @@
+"""
+翻訳ディスパッチャーモジュール
+"""
+
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple, Union
+
+from .scheduler import FairScheduler
+
+
+# 優先度（値が小さいほど先に処理）
+PRIORITY_LEVELS = {
+    'high': 0,
+    'normal': 1,
+    'low': 2,
+    # 事前翻訳（他のジョブがない時のみ処理される）
+    'prefetch': 3
+}
+
+
+class TranslationJob:
+    """翻訳ジョブ"""
+
+    def __init__(self,
+                 request_id: str,
+                 client_id: str,
+                 text: str,
+                 source_lang: str,
+                 target_lang: str,
+                 max_length: int,
+                 priority: str = 'normal',
+                 stream_key: Optional[str] = None,
+                 incremental: bool = False,
+                 final: bool = False,
+                 target_langs: Optional[List[str]] = None,
+                 decoding: Optional[str] = None,
+                 websocket: Any = None,
+                 sequence: Optional[int] = None,
+                 api_key: Optional[str] = None,
+                 cache_keys: Optional[Dict[str, Hashable]] = None,
+                 prefetch: bool = False,
+                 fingerprint: Optional[str] = None,
+                 glossary: Optional[Dict[str, str]] = None):
+        self.request_id = request_id
+        self.client_id = client_id
+        self.text = text
+        self.source_lang = source_lang
+        self.target_lang = target_lang
+        self.max_length = max_length
+        self.priority = priority if priority in PRIORITY_LEVELS else 'normal'
+        self.stream_key = stream_key
+        # インクリメンタル翻訳（stream_key 必須）と発話終了フラグ
+        self.incremental = incremental and stream_key is not None
+        self.final = final
+        # 複数言語への同時翻訳（指定時は target_lang より優先）
+        self.target_langs = target_langs
+        # デコード方式（未指定の場合は翻訳エンジンの既定値）
+        self.decoding = decoding
+        self.websocket = websocket
+        # 接続内でのメッセージの受信順（応答の順序制御に使用）
+        self.sequence = sequence
+        # 公平スケジューリングの単位（API キーがない場合は接続ごと）
+        self.fair_key = api_key or f"client:{client_id}"
+        # 結果キャッシュに登録するキー（リクエストされた翻訳先言語 → キー）
+        self.cache_keys = cache_keys
+        # 結果をキャッシュに登録するだけの事前翻訳（クライアントには応答しない）
+        self.prefetch = prefetch
+        if prefetch:
+            self.priority = 'prefetch'
+        # 入力のハッシュ（推論が停止した場合に隔離の対象にする）
+        self.fingerprint = fingerprint
+        # 用語集のセンチネル → 訳語（text 中の [N] を翻訳後に訳語に戻す）
+        self.glossary = glossary
+
+        self.enqueued_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+        # pending, running, completed, superseded, cancelled, error
+        self.status = 'pending'
+        self.result: Union[str, Dict[str, str], None] = None
+        self.error: Optional[str] = None
+        # エラーの種類（protocol.ERROR_CODES）
+        self.error_code: Optional[str] = None
+        self.superseded_by: Optional[str] = None
+
+    @property
+    def cost(self) -> int:
+        """推論コストの推定値（トークン数 × 翻訳先言語数、トークン数は文字数から概算）"""
+        return max(1, len(self.text) // 4) * len(self.target_langs or [self.target_lang])
+
+    @property
+    def processing_time_ms(self) -> float:
+        """推論にかかった時間（ミリ秒）"""
+        if self.started_at is None or self.finished_at is None:
+            return 0.0
+        return (self.finished_at - self.started_at) * 1000
+
+
+class TranslationDispatcher:
+    """翻訳ジョブの優先度キューと逐次実行を管理するクラス
+
+    stream_key 付きのジョブは「最新のみ有効」として扱われ、同じキーの新しいジョブが
+    投入されると、キュー内の古いジョブは実行されずに破棄される。実行中のジョブは
+    中断できないため、結果のみ破棄する。
+
+    同じ優先度のジョブは、クライアント（API キーまたは接続）ごとに推論コストが
+    重みに比例するよう順番に処理される。
+
+    job_timeout を超えたジョブはエラー（timeout）として応答し、on_stalled を呼び出す。
+    推論スレッドは中断できないため、そのジョブが終わるまで次のジョブは処理しない。
+    """
+
+    def __init__(self,
+                 translator,
+                 on_finished: Callable[[TranslationJob], Awaitable[None]],
+                 router=None,
+                 quantum: int = 64,
+                 weights: Optional[Dict[str, float]] = None,
+                 default_weight: float = 1.0,
+                 names: Optional[Dict[str, str]] = None,
+                 idle_timeout: float = 0,
+                 idle_check_interval: float = 30,
+                 job_timeout: float = 0,
+                 on_started: Optional[Callable[[TranslationJob], Awaitable[None]]] = None,
+                 on_stalled: Optional[Callable[[TranslationJob], Awaitable[None]]] = None):
+        self.translator = translator
+        # 言語ペア・入力長によるモデル選択（未設定の場合は常に translator を使用）
+        self.router = router
+        self.on_finished = on_finished
+        # クライアント間の公平スケジューリング（優先度ごとの Deficit Round Robin）
+        self._scheduler_options = {
+            'quantum': quantum,
+            'weights': weights,
+            'default_weight': default_weight,
+            'names': names
+        }
+        self._queue: Optional[FairScheduler] = None
+        self._streams: Dict[Tuple[str, str], TranslationJob] = {}
+        # クライアントごとの未完了のジョブ（切断時にすべて取り消す）
+        self._client_jobs: Dict[str, Set[TranslationJob]] = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="translator")
+        self._worker_task: Optional[asyncio.Task] = None
+        # 一定時間使われていない翻訳エンジンのモデルを退避（0で無効）
+        self.idle_timeout = idle_timeout
+        self.idle_check_interval = idle_check_interval
+        self._idle_task: Optional[asyncio.Task] = None
+        # 推論の監視（0で無効）
+        self.job_timeout = job_timeout
+        self.on_started = on_started
+        self.on_stalled = on_stalled
+        # 推論が job_timeout を超えたまま終わっていない
+        self.stalled = False
+        self.stats = {
+            'submitted': 0,
+            'completed': 0,
+            'superseded': 0,
+            'cancelled': 0,
+            'errors': 0,
+            'timeouts': 0
+        }
+
+    def start(self):
+        """ワーカーを開始（イベントループ内で呼び出す）"""
+        if self._worker_task is None:
+            self._queue = FairScheduler(is_stale=lambda job: job.status != 'pending', **self._scheduler_options)
+            self._worker_task = asyncio.create_task(self._worker())
+        if self.idle_timeout > 0 and self._idle_task is None:
+            self._idle_task = asyncio.create_task(self._idle_monitor())
+
+    async def stop(self):
+        """ワーカーを停止"""
+        if self._idle_task:
+            self._idle_task.cancel()
+            self._idle_task = None
+        if self._worker_task:
+            self._worker_task.cancel()
+            try:
+                await self._worker_task
+            except asyncio.CancelledError:
+                pass
+            self._worker_task = None
+        self._executor.shutdown(wait=False)
+
+    async def swap_translator(self, translator, router=None) -> Tuple[Any, Any]:
+        """翻訳エンジンを切り替え、切り替え前の (translator, router) を返す
+
+        切り替えはワーカースレッド上でジョブの合間に行うため、実行中のジョブは
+        切り替え前のエンジンで完了し、戻った時点で旧エンジンを使うジョブは残っていない。
+        """
+        previous = (self.translator, self.router)
+
+        def swap():
+            self.translator = translator
+            self.router = router
+
+        await asyncio.get_running_loop().run_in_executor(self._executor, swap)
+        return previous
+
+    def wake(self):
+        """退避中の既定の翻訳エンジンを、最初のリクエストを待たずに読み戻し始める"""
+        if getattr(self.translator, 'offloaded', False):
+            asyncio.create_task(self._run_exclusive(self.translator.rehydrate, "モデルの読み戻し"))
+
+    async def run_in_worker(self, func: Callable[[], Any]) -> Any:
+        """翻訳ジョブと同じワーカースレッドで実行し、結果を返す（実行中のジョブとは重ならない）"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func)
+
+    async def _run_exclusive(self, func: Callable[[], None], label: str):
+        """ワーカースレッドで実行し、失敗した場合はログに出力する"""
+        try:
+            await self.run_in_worker(func)
+        except Exception as e:
+            logging.error(f"{label}に失敗しました: {e}")
+
+    async def _idle_monitor(self):
+        """一定時間使われていない翻訳エンジンのモデルを退避"""
+        while True:
+            await asyncio.sleep(self.idle_check_interval)
+            if self.queued:
+                continue
+            now = time.time()
+            for translator in self._loaded_translators():
+                if not translator.offloaded and now - translator.last_used >= self.idle_timeout:
+                    await self._run_exclusive(translator.offload, "モデルの退避")
+
+    @property
+    def queued(self) -> int:
+        """キュー内の待機ジョブ数（破棄済みを含む）"""
+        return self._queue.qsize() if self._queue else 0
+
+    def weight_for(self, key: str) -> float:
+        """クライアントの重み"""
+        weights = self._scheduler_options['weights'] or {}
+        return weights.get(key, self._scheduler_options['default_weight'])
+
+    def client_stats(self):
+        """クライアントごとのキューの状態"""
+        return self._queue.get_stats() if self._queue else {}
+
+    async def submit(self, job: TranslationJob):
+        """ジョブを投入"""
+        self.stats['submitted'] += 1
+
+        if job.stream_key:
+            key = (job.client_id, job.stream_key)
+            previous = self._streams.get(key)
+            self._streams[key] = job
+            if previous is not None and previous.status in ('pending', 'running'):
+                await self._supersede(previous, job)
+
+        self._client_jobs.setdefault(job.client_id, set()).add(job)
+        self._queue.put(PRIORITY_LEVELS[job.priority], job.fair_key, job)
+
+    async def cancel_client(self, client_id: str):
+        """切断されたクライアントの未処理ジョブを取り消す
+
+        キュー内のジョブは取り消し済みとして、取り出し時に実行せずに破棄される。
+        実行中のジョブは結果のみ破棄する。取り消したジョブも完了コールバックに通知する
+        （事前翻訳の登録などの後始末のため）。
+        """
+        cancelled = self._mark_cancelled(self._client_jobs.pop(client_id, ()))
+        for key in [k for k in self._streams if k[0] == client_id]:
+            del self._streams[key]
+        for translator in self._loaded_translators():
+            translator.incremental.discard_matching(lambda key: key[0] == client_id)
+        if self.router is not None:
+            self.router.release_matching(lambda key: key[0] == client_id)
+        if self._queue:
+            self._queue.forget(f"client:{client_id}")
+        for job in cancelled:
+            await self._notify(job)
+
+    async def cancel(self, client_id: str, request_ids) -> int:
+        """クライアントの指定したリクエストのジョブを取り消し、取り消した件数を返す
+
+        ゲートウェイは転送元のクライアントが切断されたときに、そのクライアントの
+        リクエストをこれで取り消す（実行中のジョブは結果のみ破棄する）。
+        """
+        request_ids = set(request_ids)
+        jobs = self._client_jobs.get(client_id, set())
+        cancelled = self._mark_cancelled([job for job in jobs if job.request_id in request_ids])
+        jobs.difference_update(cancelled)
+        if not jobs:
+            self._client_jobs.pop(client_id, None)
+        for job in cancelled:
+            if job.stream_key and self._streams.get((client_id, job.stream_key)) is job:
+                del self._streams[(client_id, job.stream_key)]
+            await self._notify(job)
+        return len(cancelled)
+
+    def _mark_cancelled(self, jobs) -> list:
+        """未完了のジョブを取り消し済みにして、取り消したジョブの一覧を返す"""
+        cancelled = []
+        for job in jobs:
+            if job.status in ('pending', 'running'):
+                job.status = 'cancelled'
+                self.stats['cancelled'] += 1
+                cancelled.append(job)
+        return cancelled
+
+    async def _supersede(self, old: TranslationJob, new: TranslationJob):
+        """古いジョブを新しいジョブで置き換える"""
+        # 実行中のジョブは完了後に結果を破棄する
+        old.status = 'superseded'
+        old.superseded_by = new.request_id
+        self.stats['superseded'] += 1
+        self._client_jobs.get(old.client_id, set()).discard(old)
+        logging.debug(f"ジョブ置換 [{old.client_id}] stream_key={old.stream_key}: {old.request_id} -> {new.request_id}")
+        await self._notify(old)
+
+    async def _worker(self):
+        """キューからジョブを取り出して逐次実行"""
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._queue.get()
+            try:
+                if job.status != 'pending':
+                    # 置換・取り消し済みのジョブは実行しない
+                    continue
+
+                job.status = 'running'
+                job.started_at = time.time()
+                if self.on_started is not None:
+                    await self.on_started(job)
+                future = loop.run_in_executor(self._executor, self._execute, job)
+                try:
+                    if self.job_timeout > 0:
+                        result = await asyncio.wait_for(asyncio.shield(future), self.job_timeout)
+                    else:
+                        result = await future
+                except asyncio.TimeoutError:
+                    await self._handle_stall(job, future)
+                    continue
+                except Exception as e:
+                    job.finished_at = time.time()
+                    if job.status == 'running':
+                        job.status = 'error'
+                        job.error = str(e)
+                        # 言語コードなどの検証エラーはリクエストの誤り
+                        job.error_code = 'invalid_request' if isinstance(e, ValueError) else 'inference_failed'
+                        self.stats['errors'] += 1
+                        await self._notify(job)
+                    continue
+
+                job.finished_at = time.time()
+                if job.status != 'running':
+                    # 実行中に置換・取り消しされた
+                    continue
+
+                job.status = 'completed'
+                job.result = result
+                self.stats['completed'] += 1
+                await self._notify(job)
+            finally:
+                jobs = self._client_jobs.get(job.client_id)
+                if jobs is not None:
+                    jobs.discard(job)
+                    if not jobs:
+                        del self._client_jobs[job.client_id]
+                if job.stream_key and job.status not in ('pending', 'running'):
+                    key = (job.client_id, job.stream_key)
+                    if self._streams.get(key) is job:
+                        del self._streams[key]
+                    if job.final and job.status in ('completed', 'error') and self.router is not None:
+                        # 発話の終了でモデルの固定を解除
+                        self.router.release(key)
+
+    async def _handle_stall(self, job: TranslationJob, future: "asyncio.Future"):
+        """job_timeout を超えたジョブをエラーとして応答し、推論スレッドが戻るまで待つ"""
+        self.stalled = True
+        self.stats['timeouts'] += 1
+        logging.error(f"推論が {self.job_timeout:g}秒を超えました ({job.request_id}, {len(job.text)}文字)")
+        if job.status == 'running':
+            job.status = 'error'
+            job.error = f"推論が {self.job_timeout:g}秒以内に完了しませんでした"
+            job.error_code = 'timeout'
+            await self._notify(job)
+        if self.on_stalled is not None:
+            await self.on_stalled(job)
+
+        # 推論スレッドは中断できないため、戻ってから次のジョブを処理する
+        try:
+            await future
+        except Exception:
+            pass
+        job.finished_at = time.time()
+        self.stalled = False
+        logging.info(f"停止していた推論が終了しました ({job.request_id}, {job.finished_at - job.started_at:.1f}秒)")
+
+    def _execute(self, job: TranslationJob) -> Union[str, Dict[str, str]]:
+        """翻訳を実行（ワーカースレッド上で呼ばれる）"""
+        translator = self._translator_for(job)
+        
+        if job.target_langs:
+            return translator.translate_multi(
+                job.text,
+                job.source_lang,
+                job.target_langs,
+                job.max_length,
+                job.decoding
+            )
+
+        if job.incremental:
+            key = (job.client_id, job.stream_key)
+            try:
+                return translator.translate_incremental(
+                    key,
+                    job.text,
+                    job.source_lang,
+                    job.target_lang,
+                    job.max_length,
+                    job.decoding
+                )
+            finally:
+                if job.final:
+                    translator.incremental.discard(key)
+
+        return translator.translate(
+            job.text,
+            job.source_lang,
+            job.target_lang,
+            job.max_length,
+            job.decoding
+        )
+
+    def _translator_for(self, job: TranslationJob):
+        """ジョブを処理する翻訳エンジンを選択"""
+        if self.router is None:
+            return self.translator
+
+        languages = self.translator.languages
+        target_lang = job.target_langs[0] if job.target_langs else job.target_lang
+        return self.router.select(
+            job.text,
+            languages.resolve(job.source_lang) or job.source_lang,
+            languages.resolve(target_lang) or target_lang,
+            # 同じ発話の更新は最初に選んだモデルで翻訳する
+            stream_key=(job.client_id, job.stream_key) if job.stream_key else None
+        )
+
+    def _loaded_translators(self) -> List[Any]:
+        """読み込み済みの翻訳エンジン"""
+        if self.router is None:
+            return [self.translator]
+        return self.router.pool.translators
+
+    async def _notify(self, job: TranslationJob):
+        """完了コールバックを呼び出す"""
+        try:
+            await self.on_finished(job)
+        except Exception as e:
+            logging.error(f"ジョブ完了通知エラー ({job.request_id}): {e}")
@@ -0,0 +1,71 @@
+"""
+エンコーダー出力キャッシュモジュール
+同じトークン列に対するエンコーダーの計算を省略する
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+
+class EncoderOutputCache:
+    """トークン列をキーとしたエンコーダー出力のLRUキャッシュ（メモリ量で上限を設定）"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0
+        }
+
+    @staticmethod
+    def _size(tensor) -> int:
+        return tensor.numel() * tensor.element_size()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """キャッシュされたエンコーダー出力を取得"""
+        with self._lock:
+            tensor = self._entries.get(key)
+            if tensor is None:
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return tensor
+
+    def put(self, key: Hashable, tensor):
+        """エンコーダー出力を登録（上限を超えた分は古いものから破棄）"""
+        size = self._size(tensor)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= self._size(previous)
+            self._entries[key] = tensor
+            self._bytes += size
+
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= self._size(evicted)
+                self.stats['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def get_stats(self) -> Dict:
+        lookups = self.stats['hits'] + self.stats['misses']
+        return {
+            "entries": len(self._entries),
+            "memory_mb": round(self._bytes / 1024 / 1024, 2),
+            "max_memory_mb": round(self.max_bytes / 1024 / 1024, 2),
+            "hit_rate": round(self.stats['hits'] / lookups, 3) if lookups else None,
+            **self.stats
+        }
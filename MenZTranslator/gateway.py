@@ -0,0 +1,731 @@
+"""
+ゲートウェイモジュール
+クライアントのWebSocket接続を受け付け、翻訳ジョブを複数の翻訳サーバー（バックエンド）に振り分ける
+"""
+
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import signal
+import sys
+import time
+import uuid
+from collections import deque
+from pathlib import Path
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+import websockets
+from websockets.exceptions import ConnectionClosed
+
+from .config import Config
+from .protocol import GATEWAY_KEY_PREFIX, encode, error_response, is_admin
+from .performance import numa_nodes
+from .capture import CAPTURED_TYPES, TrafficRecorder
+from .supervisor import EXIT_STALLED, PoisonQuarantine, WorkerProcess, input_fingerprint
+
+
+# ローカル翻訳サーバーのプロセスを確認する間隔（秒）
+SUPERVISE_INTERVAL = 1.0
+
+
+def _hash(key: str) -> int:
+    return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+
+
+class ConsistentHashRing:
+    """コンシステントハッシュリング（仮想ノード付き）"""
+
+    def __init__(self, nodes: List[str], virtual_nodes: int = 64):
+        self._ring: List[Tuple[int, str]] = sorted(
+            (_hash(f"{node}#{i}"), node) for node in nodes for i in range(virtual_nodes)
+        )
+        self._keys = [h for h, _ in self._ring]
+        self._node_count = len(set(nodes))
+
+    def nodes_for(self, key: str) -> List[str]:
+        """キーに対応するノードを優先順に返す（先頭が担当ノード、以降はフェイルオーバー先）"""
+        if not self._ring:
+            return []
+        start = bisect.bisect(self._keys, _hash(key)) % len(self._ring)
+        ordered: List[str] = []
+        for i in range(len(self._ring)):
+            node = self._ring[(start + i) % len(self._ring)][1]
+            if node not in ordered:
+                ordered.append(node)
+                if len(ordered) == self._node_count:
+                    break
+        return ordered
+
+
+class _PendingRequest:
+    """バックエンドに転送中のリクエスト"""
+
+    def __init__(self, websocket, client_id: str, request: Dict, route_key: str):
+        self.websocket = websocket
+        self.client_id = client_id
+        self.request_id = request['request_id']
+        self.stream_key = request.get('stream_key')
+        self.request = request
+        self.route_key = route_key
+        # 隔離の判定に使用する入力のハッシュ（翻訳リクエストのみ）
+        self.fingerprint = input_fingerprint(request) if request.get('type', 'translation') == 'translation' else None
+        self.attempts = 0
+        self.start_time = time.time()
+        # クライアントが切断された（応答は破棄し、再送しない）
+        self.abandoned = False
+
+
+class Backend:
+    """翻訳サーバー（バックエンド）への接続"""
+
+    def __init__(self, url: str, gateway: "TranslationGateway"):
+        self.url = url
+        self.gateway = gateway
+        self.websocket = None
+        self.healthy = False
+        self.pending: Dict[str, _PendingRequest] = {}
+        # 同時に転送するリクエスト数の上限（翻訳サーバーの接続の上限を超えないようにする）
+        self.max_inflight = gateway.config.gateway_backend_max_inflight
+        # 上限に達したために転送を待っているリクエスト（バックエンド用の request_id, リクエスト, 転送するメッセージ）
+        self.waiting: Deque[Tuple[str, _PendingRequest, Dict]] = deque()
+        # 推論を実行中のリクエスト（翻訳サーバーからの開始通知で更新）
+        self.running: Optional[str] = None
+        self.stats = {
+            'routed': 0,
+            'failures': 0,
+            'waited': 0
+        }
+        self._reader_task: Optional[asyncio.Task] = None
+
+    async def connect(self) -> bool:
+        """接続（既に接続済みの場合は何もしない）"""
+        if self.websocket is not None:
+            return True
+        try:
+            self.websocket = await websockets.connect(self.url, max_size=1024*1024, ping_interval=None)
+            # 翻訳サーバーの上限は session の応答で反映する
+            self.max_inflight = self.gateway.config.gateway_backend_max_inflight
+            # 停止・クラッシュ時に実行中だったリクエストを特定できるよう、推論の開始を通知させる
+            # （admin_token はクライアントごとのキーを受け付けさせるためのゲートウェイの認証）
+            session = {"type": "session", "notify_start": True}
+            if self.gateway.config.admin_token:
+                session["admin_token"] = self.gateway.config.admin_token
+            await self.websocket.send(encode(session))
+            self.healthy = True
+            self._reader_task = asyncio.create_task(self._reader())
+            logging.info(f"バックエンドに接続しました: {self.url}")
+            return True
+        except Exception as e:
+            self.healthy = False
+            logging.warning(f"バックエンド接続エラー ({self.url}): {e}")
+            return False
+
+    async def check_health(self, timeout: float) -> bool:
+        """WebSocketのpingで死活確認"""
+        if not await self.connect():
+            return False
+        try:
+            pong_waiter = await self.websocket.ping()
+            await asyncio.wait_for(pong_waiter, timeout=timeout)
+            self.healthy = True
+        except Exception as e:
+            logging.warning(f"バックエンドのヘルスチェックに失敗しました ({self.url}): {e}")
+            await self.mark_down()
+        return self.healthy
+
+    async def send(self, backend_request_id: str, pending: _PendingRequest, message: Dict):
+        """リクエストを転送（転送中のリクエストが上限に達している場合は、応答が返るまで待たせる）"""
+        if len(self.pending) >= self.max_inflight:
+            self.waiting.append((backend_request_id, pending, message))
+            self.stats['waited'] += 1
+            return
+        await self._transmit(backend_request_id, pending, message)
+
+    async def _transmit(self, backend_request_id: str, pending: _PendingRequest, message: Dict):
+        self.pending[backend_request_id] = pending
+        self.stats['routed'] += 1
+        try:
+            await self.websocket.send(encode(message))
+        except Exception:
+            self.pending.pop(backend_request_id, None)
+            await self.mark_down()
+            raise
+
+    async def cancel(self, backend_request_ids: List[str]):
+        """転送済みのリクエストの取り消しを翻訳サーバーに送信（キュー内のジョブは推論せずに破棄される）"""
+        if self.websocket is None:
+            return
+        try:
+            await self.websocket.send(encode({"type": "cancel", "request_ids": backend_request_ids}))
+        except Exception as e:
+            logging.warning(f"バックエンドへの取り消しの送信に失敗しました ({self.url}): {e}")
+
+    async def _send_waiting(self):
+        """待たせているリクエストを上限まで転送"""
+        while self.waiting and len(self.pending) < self.max_inflight and self.websocket is not None:
+            backend_request_id, pending, message = self.waiting.popleft()
+            if pending.abandoned:
+                continue
+            try:
+                await self._transmit(backend_request_id, pending, message)
+            except Exception as e:
+                # 残りは mark_down で再送済み
+                logging.warning(f"バックエンドへの転送に失敗しました ({self.url}): {e}")
+                await self.gateway.route(pending)
+                return
+
+    async def mark_down(self):
+        """バックエンドを停止扱いにし、転送中のリクエストを他のバックエンドに再送
+
+        推論を実行中だったリクエストは停止の原因の可能性があるため、隔離の判定を経てから再送する。
+        """
+        if self.websocket is None and not self.pending and not self.waiting:
+            self.healthy = False
+            return
+
+        self.healthy = False
+        self.stats['failures'] += 1
+        websocket, self.websocket = self.websocket, None
+        if websocket is not None:
+            try:
+                await websocket.close()
+            except Exception:
+                pass
+
+        orphaned, self.pending = self.pending, {}
+        waiting, self.waiting = self.waiting, deque()
+        running, self.running = self.running, None
+        for backend_request_id, pending in orphaned.items():
+            if backend_request_id == running:
+                await self.gateway.handle_crashed(pending, self.url)
+            elif not pending.abandoned:
+                await self.gateway.route(pending)
+        for _, pending, _ in waiting:
+            if not pending.abandoned:
+                await self.gateway.route(pending)
+
+    async def close(self):
+        """接続を閉じる"""
+        websocket, self.websocket = self.websocket, None
+        self.healthy = False
+        if self._reader_task:
+            self._reader_task.cancel()
+        if websocket is not None:
+            await websocket.close()
+
+    async def _reader(self):
+        """バックエンドからのレスポンスをクライアントに転送"""
+        websocket = self.websocket
+        try:
+            async for message in websocket:
+                data = json.loads(message)
+                if data.get('type') == 'session' and isinstance(data.get('max_inflight'), int):
+                    # 翻訳サーバーの上限を超えて転送しない
+                    self.max_inflight = min(self.gateway.config.gateway_backend_max_inflight, data['max_inflight'])
+                    await self._send_waiting()
+                    continue
+                backend_request_id = data.get('request_id')
+                if backend_request_id is None:
+                    continue
+                if data.get('status') == 'running':
+                    self.running = backend_request_id
+                    continue
+                if backend_request_id == self.running and data.get('status') not in ('superseded', 'cancelled'):
+                    # 置換・取り消しされたジョブは推論の実行が続いている
+                    self.running = None
+
+                # 置換・取り消しの通知（superseded / cancelled）の後も同じリクエストの完了通知は来ないため、いずれの場合も取り出す
+                pending = self.pending.pop(backend_request_id, None)
+                if pending is None:
+                    continue
+                await self._send_waiting()
+                if data.get('code') == 'timeout':
+                    # 推論を停止させた入力（翻訳サーバーはこの後終了して再起動される）
+                    self.gateway.quarantine.strike(pending.fingerprint)
+                if pending.abandoned:
+                    continue
+
+                data['request_id'] = pending.request_id
+                if pending.stream_key is not None:
+                    data['stream_key'] = pending.stream_key
+                await self.gateway.send_response(pending.websocket, data)
+        except ConnectionClosed:
+            logging.warning(f"バックエンドとの接続が切断されました: {self.url}")
+        except Exception as e:
+            logging.error(f"バックエンド受信エラー ({self.url}): {e}")
+        finally:
+            if self.websocket is websocket:
+                await self.mark_down()
+
+
+class TranslationGateway:
+    """翻訳ゲートウェイ
+
+    モデルを持たない軽量なフロントエンドとして、クライアント接続を終端し、
+    翻訳ジョブを言語ペアのコンシステントハッシュで翻訳サーバーに振り分ける。
+    同じ言語ペアは同じバックエンドに集まるため、各サーバーのキャッシュが効きやすい。
+    """
+
+    def __init__(self, config: Config):
+        self.config = config
+        self.connected_clients: Set = set()
+        # session メッセージで設定された API キー（client_id → キー）
+        self.client_api_keys: Dict[str, str] = {}
+        # 公平スケジューリングで個別に扱う API キー（登録済みのキーのみ）
+        self.scheduling_keys = frozenset(config.scheduling_clients)
+        self.server = None
+        # ローカル翻訳サーバー（URL → プロセス）
+        self.workers: Dict[str, WorkerProcess] = {}
+        self._health_task: Optional[asyncio.Task] = None
+        self._supervise_task: Optional[asyncio.Task] = None
+        self._languages: Optional[Dict] = None
+        # 翻訳リクエストの到着パターンの記録（設定で有効な場合のみ）
+        self.capture = TrafficRecorder.from_config(config)
+        # 翻訳サーバーの停止・クラッシュを繰り返した入力の隔離
+        self.quarantine = PoisonQuarantine(config.quarantine_after, config.quarantine_ttl)
+
+        urls = list(config.gateway_backends)
+        urls.extend(self._spawn_local_workers())
+        if not urls:
+            raise ValueError("[GATEWAY] backends にバックエンドが設定されていません")
+
+        self.backends: Dict[str, Backend] = {url: Backend(url, self) for url in urls}
+        self.ring = ConsistentHashRing(urls, config.gateway_virtual_nodes)
+        self.stats = {
+            'requests': 0,
+            'failovers': 0,
+            'unavailable': 0,
+            'crashed_requests': 0
+        }
+
+    def _spawn_local_workers(self) -> List[str]:
+        """同一ホストに翻訳サーバーのプロセスを起動（終了した場合は _supervise_loop が再起動する）"""
+        urls = []
+        main_script = Path(__file__).resolve().parent.parent / "main.py"
+        cpu_sets = self.config.worker_cpu_sets
+        nodes = sorted(numa_nodes()) if cpu_sets == ['numa'] else []
+        for i in range(self.config.gateway_local_workers):
+            port = self.config.gateway_local_worker_base_port + i
+            command = [
+                sys.executable, str(main_script),
+                "--mode", "server",
+                "--config", self.config.config_path,
+                "--host", "127.0.0.1",
+                "--port", str(port),
+                # 推論が停止した場合は終了させて再起動する
+                "--exit-on-stall"
+            ]
+            if self.capture:
+                # トラフィックはゲートウェイで記録する
+                command.append("--no-capture")
+            # ワーカーごとにCPU・NUMAノードを割り当てる
+            pinning = []
+            if nodes:
+                pinning = ["--numa-node", str(nodes[i % len(nodes)])]
+            elif cpu_sets and cpu_sets != ['numa']:
+                pinning = ["--cpu-affinity", cpu_sets[i % len(cpu_sets)]]
+            url = f"ws://127.0.0.1:{port}"
+            worker = WorkerProcess(command + pinning, url, self.config.worker_restart_backoff_max)
+            worker.start()
+            self.workers[url] = worker
+            urls.append(url)
+            logging.info(f"ローカル翻訳サーバーを起動しました: pid={worker.pid}, port={port}"
+                         + (f", {' '.join(pinning)}" if pinning else ""))
+        return urls
+
+    async def start_server(self, stop_event: asyncio.Event):
+        """ゲートウェイを開始"""
+        try:
+            self._health_task = asyncio.create_task(self._health_loop())
+            if self.workers:
+                self._supervise_task = asyncio.create_task(self._supervise_loop())
+
+            self.server = await websockets.serve(
+                lambda websocket: self.handle_client(websocket, stop_event),
+                self.config.server_host,
+                self.config.server_port,
+                max_size=1024*1024,  # 1MB
+                ping_interval=30,
+                ping_timeout=10
+            )
+
+            logging.info(f"ゲートウェイが起動しました: ws://{self.config.server_host}:{self.config.server_port} "
+                         f"(バックエンド {len(self.backends)} 台)")
+
+            await stop_event.wait()
+
+        except Exception as e:
+            logging.error(f"ゲートウェイ起動エラー: {e}")
+            raise
+        finally:
+            if self.server:
+                self.server.close()
+                await self.server.wait_closed()
+                logging.info("ゲートウェイが停止しました")
+
+    async def _health_loop(self):
+        """バックエンドの定期ヘルスチェック"""
+        while True:
+            await asyncio.gather(*(
+                backend.check_health(self.config.gateway_health_timeout)
+                for backend in self.backends.values()
+            ))
+            await asyncio.sleep(self.config.gateway_health_interval)
+
+    async def _supervise_loop(self):
+        """ローカル翻訳サーバーの監視（終了したプロセスの再起動、応答しなくなったプロセスの強制終了）"""
+        # ヘルスチェックに1回失敗してから、再接続のヘルスチェックにも失敗するまでの時間
+        grace = self.config.gateway_health_interval + self.config.gateway_health_timeout
+        while True:
+            await asyncio.sleep(SUPERVISE_INTERVAL)
+            now = time.time()
+            for url, worker in self.workers.items():
+                backend = self.backends[url]
+                exit_code = worker.check()
+                if exit_code is not None:
+                    reason = "推論の停止" if exit_code == EXIT_STALLED else f"終了コード {exit_code}"
+                    logging.error(f"ローカル翻訳サーバーが終了しました ({url}, {reason})。再起動します")
+                    await backend.mark_down()
+                elif worker.restart_due():
+                    worker.start()
+                    logging.info(f"ローカル翻訳サーバーを再起動しました: pid={worker.pid}, {url}")
+                elif worker.running:
+                    if backend.healthy:
+                        worker.connected = True
+                        worker.unresponsive_since = None
+                    elif worker.connected:
+                        # 起動後に接続できていたサーバーが応答しない
+                        worker.unresponsive_since = worker.unresponsive_since or now
+                        if now - worker.unresponsive_since >= grace:
+                            logging.error(f"ローカル翻訳サーバーが応答しないため強制終了します ({url}, pid={worker.pid})")
+                            worker.kill()
+
+    async def handle_crashed(self, pending: _PendingRequest, url: str):
+        """推論の実行中に翻訳サーバーが停止したリクエスト（停止を繰り返した入力は隔離し、それ以外は1回だけ再送）"""
+        self.stats['crashed_requests'] += 1
+        if self.quarantine.strike(pending.fingerprint) and not pending.abandoned:
+            await self.send_error(pending.websocket, "この入力は翻訳サーバーの停止を繰り返したため受け付けられません",
+                                  pending.request_id, code='quarantined')
+            return
+        if pending.abandoned:
+            return
+        if pending.attempts > 1:
+            await self.send_error(pending.websocket, "翻訳中に翻訳サーバーが停止しました",
+                                  pending.request_id, code='worker_crashed')
+            return
+        logging.warning(f"翻訳中に停止した翻訳サーバーのリクエストを再送します ({url}, {pending.request_id})")
+        await self.route(pending)
+
+    async def handle_client(self, websocket, stop_event: asyncio.Event):
+        """クライアント接続の処理"""
+        client_id = str(uuid.uuid4())[:8]
+
+        try:
+            self.connected_clients.add(websocket)
+            client_info = f"{websocket.remote_address[0]}:{websocket.remote_address[1]}"
+            logging.info(f"クライアント接続: {client_id} ({client_info})")
+
+            await self.send_response(websocket, {
+                "type": "connection",
+                "client_id": client_id,
+                "server_info": {
+                    "model": self.config.model_name,
+                    "device": "gateway",
+                    "status": "ready"
+                }
+            })
+
+            async for message in websocket:
+                await self.handle_message(websocket, message, client_id)
+
+        except ConnectionClosed:
+            logging.info(f"クライアント切断: {client_id}")
+        except Exception as e:
+            logging.error(f"クライアント処理エラー ({client_id}): {e}")
+        finally:
+            self.connected_clients.discard(websocket)
+            self.client_api_keys.pop(client_id, None)
+            await self.cancel_requests(client_id, abandon=True)
+
+    async def cancel_requests(self, client_id: str, request_ids: Optional[Set[str]] = None,
+                              abandon: bool = False) -> int:
+        """クライアントのリクエストを取り消し、取り消したリクエスト数を返す（request_ids 省略時はすべて）
+
+        転送待ちのリクエストはその場で破棄し、転送済みのリクエストは翻訳サーバーに cancel を送って
+        推論を実行させない。abandon の場合（クライアントの切断時）は応答を転送しない。
+        """
+        def matches(pending: _PendingRequest) -> bool:
+            return pending.client_id == client_id and (request_ids is None or pending.request_id in request_ids)
+
+        cancelled = 0
+        for backend in self.backends.values():
+            # 転送済みのリクエストは翻訳サーバーの処理枠を使っているため、応答が返るまで数に含める
+            sent = [(backend_request_id, pending) for backend_request_id, pending in backend.pending.items()
+                    if matches(pending) and not pending.abandoned]
+            waiting = [item for item in backend.waiting if matches(item[1])]
+            if waiting:
+                backend.waiting = deque(item for item in backend.waiting if not matches(item[1]))
+            if abandon:
+                for _, pending in sent:
+                    pending.abandoned = True
+            else:
+                for _, pending, _ in waiting:
+                    await self.send_response(pending.websocket, {"request_id": pending.request_id,
+                                                                 "status": "cancelled"})
+            if sent:
+                await backend.cancel([backend_request_id for backend_request_id, _ in sent])
+            cancelled += len(sent) + len(waiting)
+        return cancelled
+
+    async def handle_message(self, websocket, message: str, client_id: str):
+        """メッセージの処理"""
+        try:
+            data = json.loads(message)
+            message_type = data.get('type', 'translation')
+            if self.capture and message_type in CAPTURED_TYPES:
+                self.capture.record(message_type, data, client_id)
+
+            if message_type == 'ping':
+                await self.send_response(websocket, {
+                    "type": "pong",
+                    "timestamp": time.time(),
+                    "server_status": "running"
+                })
+            elif message_type == 'stats':
+                await self.send_response(websocket, self.get_stats())
+            elif message_type == 'languages':
+                await self.handle_languages_request(websocket)
+            elif message_type == 'session':
+                await self.handle_session_request(websocket, data, client_id)
+            elif message_type == 'reload':
+                if not is_admin(data, self.config.admin_token):
+                    await self.send_error(websocket, "管理コマンドの認証に失敗しました")
+                    return
+                await self.send_response(websocket, {"type": "reload", **await self.reload(), "status": "completed"})
+            elif message_type == 'cancel':
+                request_ids = data.get('request_ids')
+                if not isinstance(request_ids, list) or not all(isinstance(r, str) for r in request_ids):
+                    await self.send_error(websocket, "request_ids には request_id の配列を指定してください",
+                                          code='invalid_request')
+                    return
+                cancelled = await self.cancel_requests(client_id, set(request_ids))
+                await self.send_response(websocket, {"type": "cancel", "cancelled": cancelled, "status": "completed"})
+            elif message_type == 'profile':
+                await self.send_error(websocket, "ゲートウェイでは profile を使用できません。翻訳サーバーに直接送信してください")
+            elif 'request_id' in data:
+                # 翻訳リクエストなど request_id を持つメッセージはバックエンドに転送
+                if not data['request_id']:
+                    await self.send_error(websocket, "request_id が必要です")
+                    return
+                self.stats['requests'] += 1
+                pending = _PendingRequest(websocket, client_id, data, self._route_key(data))
+                if self.quarantine.is_quarantined(pending.fingerprint):
+                    await self.send_error(websocket, "この入力は翻訳サーバーの停止を繰り返したため受け付けられません",
+                                          pending.request_id, code='quarantined')
+                    return
+                await self.route(pending)
+            else:
+                await self.send_error(websocket, f"ゲートウェイでは request_id のないメッセージタイプ '{message_type}' は転送できません")
+
+        except json.JSONDecodeError:
+            await self.send_error(websocket, "無効なJSONフォーマット")
+        except Exception as e:
+            logging.error(f"メッセージ処理エラー: {e}")
+            await self.send_error(websocket, str(e))
+
+    async def handle_languages_request(self, websocket):
+        """対応言語一覧（いずれかのバックエンドから取得してキャッシュ）"""
+        if self._languages is None:
+            for backend in self.backends.values():
+                if not backend.healthy:
+                    continue
+                try:
+                    async with websockets.connect(backend.url, max_size=4*1024*1024) as connection:
+                        await connection.send(json.dumps({"type": "languages"}))
+                        while True:
+                            data = json.loads(await asyncio.wait_for(connection.recv(), timeout=10))
+                            if data.get('type') == 'languages':
+                                self._languages = data
+                                break
+                    break
+                except Exception as e:
+                    logging.warning(f"言語一覧の取得に失敗しました ({backend.url}): {e}")
+
+        if self._languages is None:
+            await self.send_error(websocket, "利用可能な翻訳サーバーがありません")
+            return
+        await self.send_response(websocket, self._languages)
+
+    async def handle_session_request(self, websocket, data: Dict, client_id: str):
+        """接続の設定（API キー）。応答の順序は常に完了順"""
+        api_key = data.get('api_key')
+        if api_key is not None:
+            if not isinstance(api_key, str):
+                await self.send_error(websocket, "api_key は文字列で指定してください")
+                return
+            if api_key and api_key not in self.scheduling_keys:
+                await self.send_error(websocket, "登録されていない api_key です（[SCHEDULING] client.<名前> に登録してください）")
+                return
+            if api_key:
+                self.client_api_keys[client_id] = api_key
+            else:
+                self.client_api_keys.pop(client_id, None)
+
+        if data.get('ordered'):
+            await self.send_error(websocket, "ゲートウェイ経由の場合、応答は常に完了した順に返ります")
+            return
+
+        clients = self.config.scheduling_clients
+        api_key = self.client_api_keys.get(client_id)
+        await self.send_response(websocket, {
+            "type": "session",
+            "client_id": client_id,
+            "ordered": False,
+            "weight": clients[api_key][1] if api_key in clients else self.config.scheduling_default_weight
+        })
+
+    @staticmethod
+    def _route_key(data: Dict) -> str:
+        """振り分けキー（言語ペア）"""
+        source_lang = data.get('source_lang', 'eng_Latn')
+        targets = data.get('target_langs') or [data.get('target_lang', 'jpn_Jpan')]
+        return f"{source_lang}->{','.join(sorted(map(str, targets)))}"
+
+    async def route(self, pending: _PendingRequest):
+        """担当バックエンドに転送（停止中の場合はリング上の次のバックエンドへ）"""
+        pending.attempts += 1
+        candidates = self.ring.nodes_for(pending.route_key)
+        for index, url in enumerate(candidates):
+            backend = self.backends[url]
+            if not backend.healthy or backend.websocket is None:
+                continue
+
+            # クライアント間で request_id / stream_key が衝突しないように書き換える
+            backend_request_id = f"{pending.client_id}:{pending.request_id}:{pending.attempts}"
+            message = dict(pending.request, request_id=backend_request_id)
+            # 翻訳サーバーからはすべてゲートウェイの接続に見えるため、公平スケジューリングの単位を明示する
+            # （登録されていないキーはクライアントごとのキーに置き換える）
+            api_key = pending.request.get('api_key') or self.client_api_keys.get(pending.client_id)
+            message['api_key'] = api_key if api_key in self.scheduling_keys \
+                else f"{GATEWAY_KEY_PREFIX}{pending.client_id}"
+            if pending.stream_key is not None:
+                message['stream_key'] = f"{pending.client_id}:{pending.stream_key}"
+            try:
+                await backend.send(backend_request_id, pending, message)
+            except Exception as e:
+                logging.warning(f"バックエンドへの転送に失敗しました ({url}): {e}")
+                continue
+
+            if index > 0 or pending.attempts > 1:
+                self.stats['failovers'] += 1
+            return
+
+        self.stats['unavailable'] += 1
+        await self.send_error(pending.websocket, "利用可能な翻訳サーバーがありません", pending.request_id,
+                              code='unavailable')
+
+    async def reload(self) -> Dict:
+        """翻訳サーバーを1台ずつリロード（admin_token 未設定の場合はローカル翻訳サーバーに SIGHUP を送信）"""
+        results: Dict[str, str] = {}
+        if self.config.admin_token:
+            # 1台ずつ完了を待つことで、同時に2つのモデルを読み込むサーバーを1台に抑える
+            for url in self.backends:
+                results[url] = await self._reload_backend(url)
+        elif hasattr(signal, 'SIGHUP'):
+            for worker in self.workers.values():
+                if worker.running:
+                    worker.process.send_signal(signal.SIGHUP)
+                    results[f"pid:{worker.pid}"] = "signaled"
+        logging.info(f"翻訳サーバーのリロード結果: {results}")
+        return {"backends": results}
+
+    async def _reload_backend(self, url: str) -> str:
+        """管理コマンドで翻訳サーバーをリロードし、結果のステータスを返す"""
+        try:
+            async with websockets.connect(url, max_size=1024*1024) as connection:
+                await connection.send(encode({"type": "reload", "admin_token": self.config.admin_token}))
+                while True:
+                    # 接続時の connection メッセージなどは読み飛ばす
+                    data = json.loads(await connection.recv())
+                    if data.get('type') == 'reload':
+                        return data.get('status', 'completed')
+                    if data.get('status') == 'error':
+                        logging.warning(f"翻訳サーバーのリロードに失敗しました ({url}): {data.get('error')}")
+                        return 'error'
+        except Exception as e:
+            logging.warning(f"翻訳サーバーのリロードに失敗しました ({url}): {e}")
+            return 'error'
+
+    def get_stats(self) -> Dict:
+        """ゲートウェイの統計情報"""
+        return {
+            "type": "stats",
+            "mode": "gateway",
+            "connected_clients": len(self.connected_clients),
+            "active_requests": sum(len(b.pending) + len(b.waiting) for b in self.backends.values()),
+            "gateway": dict(self.stats),
+            "quarantine": self.quarantine.get_stats(),
+            "workers": [worker.get_stats() for worker in self.workers.values()],
+            "capture": self.capture.get_stats() if self.capture else None,
+            "backends": [
+                {
+                    "url": backend.url,
+                    "healthy": backend.healthy,
+                    "inflight": len(backend.pending),
+                    "waiting": len(backend.waiting),
+                    "max_inflight": backend.max_inflight,
+                    **backend.stats
+                }
+                for backend in self.backends.values()
+            ]
+        }
+
+    async def send_response(self, websocket, data: Dict):
+        """レスポンス送信"""
+        try:
+            await websocket.send(encode(data))
+        except Exception as e:
+            logging.error(f"レスポンス送信エラー: {e}")
+
+    async def send_error(self, websocket, error_message: str, request_id: Optional[str] = None,
+                         code: Optional[str] = None):
+        """エラーレスポンス送信"""
+        await self.send_response(websocket, error_response(error_message, request_id, code))
+
+    async def shutdown(self):
+        """ゲートウェイのシャットダウン"""
+        try:
+            if self._health_task:
+                self._health_task.cancel()
+            if self._supervise_task:
+                # 終了させるプロセスを再起動しないよう、先に監視を止める
+                self._supervise_task.cancel()
+
+            for client in self.connected_clients.copy():
+                try:
+                    await client.close()
+                except Exception as e:
+                    logging.warning(f"クライアント切断エラー: {e}")
+            self.connected_clients.clear()
+
+            for backend in self.backends.values():
+                await backend.close()
+
+            if self.capture:
+                self.capture.close()
+
+            for worker in self.workers.values():
+                worker.terminate()
+            for worker in self.workers.values():
+                worker.wait()
+
+            if self.server:
+                self.server.close()
+                await self.server.wait_closed()
+
+            logging.info("ゲートウェイのシャットダウンが完了しました")
+
+        except Exception as e:
+            logging.error(f"シャットダウンエラー: {e}")
@@ -0,0 +1,131 @@
+"""
+インクリメンタル翻訳モジュール
+音声認識の途中結果のように先頭部分が共通のテキストに対して、
+確定済みの文の翻訳を再利用し、変化した末尾のみを翻訳する
+"""
+
+import re
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable, List, Optional, Tuple
+
+
+# 文末記号（後続の空白までを含めて1文とする）
+_SENTENCE_PATTERN = re.compile(r'.+?(?:[。！？!?]+[」』）)"\']*|[.…]+[)"\']*(?=\s|$))\s*|.+$', re.S)
+
+# 単語間に空白を入れない言語のスクリプト
+_NO_SPACE_SCRIPTS = ('Jpan', 'Hans', 'Hant', 'Thai', 'Laoo', 'Khmr', 'Mymr')
+
+
+def split_sentences(text: str) -> List[str]:
+    """テキストを文単位に分割（各要素は末尾の空白を含む）"""
+    return [m.group(0) for m in _SENTENCE_PATTERN.finditer(text) if m.group(0).strip()]
+
+
+def join_translations(parts: List[str], target_lang: str) -> str:
+    """文ごとの翻訳結果を連結"""
+    separator = '' if target_lang.endswith(_NO_SPACE_SCRIPTS) else ' '
+    return separator.join(p for p in parts if p)
+
+
+class _StreamState:
+    """ストリームごとの確定済み文の翻訳結果"""
+
+    def __init__(self, source_lang: str, target_lang: str):
+        self.source_lang = source_lang
+        self.target_lang = target_lang
+        self.segments: List[Tuple[str, str]] = []  # (原文, 翻訳)
+        self.last_tail: Optional[Tuple[str, str]] = None  # 前回の末尾の (原文, 翻訳)
+
+
+class IncrementalTranslationCache:
+    """ストリームごとに確定済みの文の翻訳をキャッシュするクラス
+
+    入力を文単位に分割し、最後の文以外を確定済みとみなす。確定済みの文が
+    前回と一致する限り翻訳を再利用するため、モデルに渡るのは変化した文と
+    末尾の未確定部分のみとなり、発話が長くなっても1回の更新コストはほぼ一定になる。
+    """
+
+    def __init__(self, max_streams: int = 256):
+        self.max_streams = max_streams
+        self._streams: "OrderedDict[Hashable, _StreamState]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {
+            'reused_segments': 0,
+            'translated_segments': 0
+        }
+
+    def translate(self,
+                  translate_fn: Callable[[str], str],
+                  stream_key: Hashable,
+                  text: str,
+                  source_lang: str,
+                  target_lang: str) -> str:
+        """確定済みの文を再利用しながら翻訳"""
+        sentences = split_sentences(text)
+        if not sentences:
+            return ""
+
+        state = self._get_state(stream_key, source_lang, target_lang)
+        stable, tail = sentences[:-1], sentences[-1]
+
+        parts = []
+        for i, sentence in enumerate(stable):
+            key = sentence.strip()
+            if i < len(state.segments) and state.segments[i][0] == key:
+                parts.append(state.segments[i][1])
+                self.stats['reused_segments'] += 1
+                continue
+
+            # 以降の確定済み文は無効
+            del state.segments[i:]
+            translation = self._translate_segment(translate_fn, state, key)
+            state.segments.append((key, translation))
+            parts.append(translation)
+
+        del state.segments[len(stable):]
+
+        # 末尾の未確定部分（前回と同じ場合のみ再利用）
+        key = tail.strip()
+        translation = self._translate_segment(translate_fn, state, key)
+        state.last_tail = (key, translation)
+        parts.append(translation)
+
+        return join_translations(parts, target_lang)
+
+    def _translate_segment(self, translate_fn: Callable[[str], str], state: _StreamState, segment: str) -> str:
+        """1文を翻訳（直前の末尾と同じ文なら翻訳を再利用）"""
+        if state.last_tail is not None and state.last_tail[0] == segment:
+            self.stats['reused_segments'] += 1
+            return state.last_tail[1]
+        self.stats['translated_segments'] += 1
+        return translate_fn(segment)
+
+    def discard(self, stream_key: Hashable):
+        """ストリームの状態を破棄"""
+        with self._lock:
+            self._streams.pop(stream_key, None)
+
+    def discard_matching(self, predicate: Callable[[Hashable], bool]):
+        """条件に一致するストリームの状態を破棄"""
+        with self._lock:
+            for key in [k for k in self._streams if predicate(k)]:
+                del self._streams[key]
+
+    @property
+    def active_streams(self) -> int:
+        return len(self._streams)
+
+    def _get_state(self, stream_key: Hashable, source_lang: str, target_lang: str) -> _StreamState:
+        """ストリーム状態を取得（言語ペアが変わった場合は作り直す）"""
+        with self._lock:
+            state: Optional[_StreamState] = self._streams.get(stream_key)
+            if state is None or state.source_lang != source_lang or state.target_lang != target_lang:
+                state = _StreamState(source_lang, target_lang)
+                self._streams[stream_key] = state
+            self._streams.move_to_end(stream_key)
+
+            while len(self._streams) > self.max_streams:
+                self._streams.popitem(last=False)
+
+            return state
@@ -0,0 +1,229 @@
+"""
+言語コード管理モジュール
+ISO-639-1 / BCP-47 / NLLB の言語コードを、トークナイザーの言語トークンIDに対応付ける
+"""
+
+import json
+import re
+from types import MappingProxyType
+from typing import Dict, Iterable, Mapping, Optional, Tuple
+
+
+# NLLBの標準言語コード形式: xxx_Xxxx
+NLLB_CODE_PATTERN = re.compile(r'^[a-z]{3}_[A-Z][a-z]{3}$')
+
+# ISO-639-1 / BCP-47（langdetectの出力を含む）→ NLLBコード
+ISO_TO_NLLB: Mapping[str, str] = MappingProxyType({
+    'en': 'eng_Latn',
+    'ja': 'jpn_Jpan',
+    'zh-cn': 'zho_Hans',
+    'zh-tw': 'zho_Hant',
+    'ko': 'kor_Hang',
+    'fr': 'fra_Latn',
+    'de': 'deu_Latn',
+    'es': 'spa_Latn',
+    'it': 'ita_Latn',
+    'ru': 'rus_Cyrl',
+    'ar': 'arb_Arab',
+    'hi': 'hin_Deva',
+    'th': 'tha_Thai',
+    'vi': 'vie_Latn',
+    'pt': 'por_Latn',
+    'nl': 'nld_Latn',
+    'tr': 'tur_Latn',
+    'pl': 'pol_Latn',
+    'sv': 'swe_Latn',
+    'da': 'dan_Latn',
+    'no': 'nob_Latn',
+    'fi': 'fin_Latn',
+    'he': 'heb_Hebr',
+    'cs': 'ces_Latn',
+    'hu': 'hun_Latn',
+    'ro': 'ron_Latn',
+    'bg': 'bul_Cyrl',
+    'hr': 'hrv_Latn',
+    'sk': 'slk_Latn',
+    'sl': 'slv_Latn',
+    'et': 'est_Latn',
+    'lv': 'lvs_Latn',
+    'lt': 'lit_Latn',
+    'uk': 'ukr_Cyrl',
+    'el': 'ell_Grek',
+    'ca': 'cat_Latn',
+    'eu': 'eus_Latn',
+    'gl': 'glg_Latn',
+    'cy': 'cym_Latn',
+    'ga': 'gle_Latn',
+    'mt': 'mlt_Latn',
+    'is': 'isl_Latn',
+    'mk': 'mkd_Cyrl',
+    'sq': 'als_Latn',
+    'af': 'afr_Latn',
+    'sw': 'swh_Latn',
+    'zu': 'zul_Latn',
+    'xh': 'xho_Latn',
+    'id': 'ind_Latn',
+    'ms': 'zsm_Latn',
+    'tl': 'tgl_Latn',
+    'bn': 'ben_Beng',
+    'ur': 'urd_Arab',
+    'fa': 'pes_Arab',
+    'ta': 'tam_Taml',
+    'te': 'tel_Telu',
+    'kn': 'kan_Knda',
+    'ml': 'mal_Mlym',
+    'gu': 'guj_Gujr',
+    'pa': 'pan_Guru',
+    'ne': 'npi_Deva',
+    'si': 'sin_Sinh',
+    'my': 'mya_Mymr',
+    'km': 'khm_Khmr',
+    'lo': 'lao_Laoo',
+    'ka': 'kat_Geor',
+    'hy': 'hye_Armn',
+    'az': 'azj_Latn',
+    'kk': 'kaz_Cyrl',
+    'ky': 'kir_Cyrl',
+    'uz': 'uzn_Latn',
+    'tg': 'tgk_Cyrl',
+    'mn': 'khk_Cyrl',
+    'zh': 'zho_Hans',
+    'zh-hans': 'zho_Hans',
+    'zh-hant': 'zho_Hant',
+    'zh-hk': 'zho_Hant',
+    'pt-br': 'por_Latn',
+    'pt-pt': 'por_Latn',
+    'nb': 'nob_Latn',
+    'nn': 'nno_Latn',
+})
+
+# 主要言語の表示名
+LANGUAGE_NAMES: Mapping[str, str] = MappingProxyType({
+    'jpn_Jpan': '日本語',
+    'eng_Latn': '英語',
+    'zho_Hans': '中国語（簡体字）',
+    'zho_Hant': '中国語（繁体字）',
+    'kor_Hang': '韓国語',
+    'fra_Latn': 'フランス語',
+    'deu_Latn': 'ドイツ語',
+    'spa_Latn': 'スペイン語',
+    'ita_Latn': 'イタリア語',
+    'rus_Cyrl': 'ロシア語',
+    'arb_Arab': 'アラビア語',
+    'hin_Deva': 'ヒンディー語',
+    'tha_Thai': 'タイ語',
+    'vie_Latn': 'ベトナム語',
+})
+
+
+def _normalize(code: str) -> str:
+    """大文字小文字・区切り文字の違いを吸収"""
+    return code.strip().lower().replace('_', '-')
+
+
+class LanguageRegistry:
+    """言語コードとトークンIDの不変な対応表
+
+    トークナイザーが実際に持つ言語トークンから一度だけ構築し、
+    ISO-639-1 / BCP-47 / NLLB のいずれの形式でも辞書引き1回で解決できるようにする。
+    """
+
+    def __init__(self, token_ids: Mapping[str, int]):
+        self._token_ids: Mapping[str, int] = MappingProxyType(dict(token_ids))
+
+        aliases: Dict[str, str] = {}
+        for alias, code in ISO_TO_NLLB.items():
+            if code in self._token_ids:
+                aliases[alias] = code
+                aliases[_normalize(alias)] = code
+        for code in self._token_ids:
+            aliases[code] = code
+            aliases[_normalize(code)] = code
+        self._aliases: Mapping[str, str] = MappingProxyType(aliases)
+
+    @classmethod
+    def from_tokenizer(cls, tokenizer) -> "LanguageRegistry":
+        """トークナイザーの言語特殊トークンから構築（同じトークナイザーは再利用）"""
+        cache_key = (getattr(tokenizer, 'name_or_path', None), len(tokenizer))
+        registry = _REGISTRY_CACHE.get(cache_key)
+        if registry is None:
+            registry = cls(dict(cls._language_tokens(tokenizer)))
+            _REGISTRY_CACHE[cache_key] = registry
+        return registry
+
+    @classmethod
+    def load(cls, path: str) -> "LanguageRegistry":
+        """save() で保存した対応表から構築"""
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f)["token_ids"])
+
+    def save(self, path: str):
+        """言語コードとトークンIDの対応表をJSONで保存"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"token_ids": dict(sorted(self._token_ids.items()))}, f, ensure_ascii=False, indent=1)
+
+    @staticmethod
+    def _language_tokens(tokenizer) -> Iterable[Tuple[str, int]]:
+        """トークナイザーから (言語コード, トークンID) を列挙"""
+        lang_code_to_id = getattr(tokenizer, 'lang_code_to_id', None)
+        if lang_code_to_id:
+            return lang_code_to_id.items()
+
+        codes = [t for t in getattr(tokenizer, 'additional_special_tokens', []) if NLLB_CODE_PATTERN.match(t)]
+        return zip(codes, tokenizer.convert_tokens_to_ids(codes))
+
+    def resolve(self, code: str) -> Optional[str]:
+        """任意形式の言語コードをNLLBコードに変換（未対応の場合はNone）"""
+        resolved = self._aliases.get(code)
+        if resolved is not None:
+            return resolved
+
+        normalized = _normalize(code)
+        resolved = self._aliases.get(normalized)
+        if resolved is not None:
+            return resolved
+
+        # BCP-47: 言語-スクリプト（zh-Hant 等）、言語-地域（en-US 等）
+        language, _, rest = normalized.partition('-')
+        base = self._aliases.get(language)
+        if base is None:
+            return None
+        subtag = rest.split('-')[0]
+        if len(subtag) == 4:
+            scripted = f"{base[:3]}_{subtag.capitalize()}"
+            if scripted in self._token_ids:
+                return scripted
+        return base
+
+    def token_id(self, code: str) -> Optional[int]:
+        """言語コードに対応するトークンID（forced_bos_token_id）を取得"""
+        resolved = self.resolve(code)
+        return self._token_ids[resolved] if resolved is not None else None
+
+    def __contains__(self, code: str) -> bool:
+        return self.resolve(code) is not None
+
+    def __len__(self) -> int:
+        return len(self._token_ids)
+
+    @property
+    def codes(self) -> Tuple[str, ...]:
+        """対応しているNLLBコード一覧"""
+        return tuple(sorted(self._token_ids))
+
+    def to_dict(self) -> Dict:
+        """クライアント向けの一覧（キャッシュ用）"""
+        return {
+            "languages": list(self.codes),
+            "aliases": {
+                alias: code for alias, code in sorted(ISO_TO_NLLB.items())
+                if code in self._token_ids
+            },
+            "names": {
+                code: name for code, name in LANGUAGE_NAMES.items()
+                if code in self._token_ids
+            }
+        }
+
+
+_REGISTRY_CACHE: Dict[Tuple[Optional[str], int], LanguageRegistry] = {}
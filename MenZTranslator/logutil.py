@@ -0,0 +1,71 @@
+"""
+ログ出力モジュール
+ファイル・コンソールへの書き込みを別スレッドで行い、翻訳テキストのログを間引く
+"""
+
+import logging
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from pathlib import Path
+from typing import Optional
+
+from .config import Config
+
+
+def setup_queue_logging(config: Config) -> QueueListener:
+    """キュー経由の非同期ログを設定（書き込みはリスナースレッドで行う）"""
+    log_file = Path(config.log_file)
+    log_file.parent.mkdir(parents=True, exist_ok=True)
+    log_level = getattr(logging, config.log_level.upper(), logging.INFO)
+
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    # ファイルハンドラー（max_file_size を超えたら backup_count 世代までローテーション）
+    file_handler = RotatingFileHandler(
+        log_file,
+        maxBytes=config.log_max_file_size,
+        backupCount=config.log_backup_count,
+        encoding='utf-8'
+    )
+    file_handler.setFormatter(formatter)
+    file_handler.setLevel(log_level)
+
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(formatter)
+    console_handler.setLevel(log_level)
+
+    # 呼び出し側はキューに積むだけにする
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+    listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    listener.start()
+
+    root_logger = logging.getLogger()
+    root_logger.setLevel(log_level)
+    root_logger.addHandler(QueueHandler(log_queue))
+    return listener
+
+
+class TextLogSampler:
+    """翻訳テキストをログに出力するかの判定と切り詰め"""
+
+    def __init__(self, sample_rate: float = 1.0, max_chars: int = 200):
+        self.sample_rate = min(1.0, max(0.0, sample_rate))
+        self.max_chars = max_chars
+
+    @classmethod
+    def from_config(cls, config: Config) -> "TextLogSampler":
+        return cls(config.log_text_sample_rate, config.log_text_max_chars)
+
+    def should_log(self) -> bool:
+        """テキストを含むログを出力するか（sample_rate の割合で出力）"""
+        if self.sample_rate >= 1.0:
+            return True
+        return self.sample_rate > 0.0 and random.random() < self.sample_rate
+
+    def truncate(self, text: Optional[object]) -> str:
+        """max_chars を超える部分を省略（0で無制限）"""
+        text = str(text)
+        if self.max_chars <= 0 or len(text) <= self.max_chars:
+            return text
+        return f"{text[:self.max_chars]}…(+{len(text) - self.max_chars}文字)"
@@ -0,0 +1,214 @@
+"""
+マークアップ保護モジュール
+字幕・リッチテキストのタグやURL、絵文字をモデルに渡さず、
+自然言語の部分のみを翻訳して元の位置に戻す
+"""
+
+import re
+from typing import Dict, List, Optional, Set, Tuple
+
+
+# タグの属性値（引用符付き、または空白・引用符・<> を含まない値）
+_ATTRIBUTE_VALUE = r'(?:"[^"]*"|\'[^\']*\'|[^\s"\'<>]+)'
+
+# HTML / Unity リッチテキストのタグ <i>, <color=#fff>, <font color="red">
+# 属性は name=value 形式のみとし、"x<y and z>w" のような比較式は保護しない
+_HTML_TAG = (
+    r'<(?P<close>/)?(?P<name>[A-Za-z][\w:-]*)'
+    rf'(?P<attributes>(?:={_ATTRIBUTE_VALUE})?(?:\s+[\w:-]+={_ATTRIBUTE_VALUE})*)\s*/?>'
+)
+
+# 文の区切りとして扱うタグ（改行・ブロック要素）
+_BREAK_TAGS = frozenset({
+    'br', 'hr', 'p', 'div', 'li', 'ul', 'ol', 'dl', 'dt', 'dd', 'table', 'thead', 'tbody', 'tfoot',
+    'tr', 'td', 'th', 'blockquote', 'pre', 'section', 'article', 'header', 'footer', 'nav', 'aside',
+    'main', 'figure', 'figcaption', 'address', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+    'align', 'page',  # Unity
+})
+# 文中に現れる装飾タグ（センチネルに置き換えて文ごと翻訳する）
+_INLINE_TAGS = frozenset({
+    'a', 'abbr', 'b', 'bdi', 'bdo', 'big', 'cite', 'code', 'del', 'dfn', 'em', 'font', 'i', 'img', 'ins',
+    'kbd', 'mark', 'q', 'rp', 'rt', 'ruby', 's', 'samp', 'small', 'span', 'strike', 'strong', 'sub',
+    'sup', 'time', 'tt', 'u', 'var', 'wbr',
+    # Unity リッチテキスト / TextMesh Pro
+    'alpha', 'color', 'cspace', 'font-weight', 'gradient', 'indent', 'line-height', 'line-indent', 'link',
+    'lowercase', 'uppercase', 'smallcaps', 'margin', 'material', 'mspace', 'noparse', 'nobr', 'pos', 'quad',
+    'rotate', 'size', 'space', 'sprite', 'strikethrough', 'style', 'voffset', 'width',
+})
+
+# ASS/SSA 改行 \N（文の区切り）
+_BREAK_PATTERN = r'\\[Nn]'
+# パスのように見えるトークン（C:\new\home の \n などを改行として扱わないよう、そのままテキストに含める）
+_PATH_PATTERN = (
+    r'(?<![^\s"\'(])(?:[A-Za-z]:|\\|\.{1,2}|~|%\w+%)\\[^\s<>"]*'  # C:\dir, \\server, .\dir, %APPDATA%\dir
+    r'|(?<![^\s"\'(])[^\s<>"\\]*(?:\\[^\s<>"\\]+)+\.[A-Za-z0-9]{1,4}\b'  # dir\new\file.txt
+)
+# 文中に現れうるスパン（文中ではセンチネルに置き換えて文を分割しない）
+_INLINE_PATTERN = (
+    r'\{\\[^{}]*\}'                                        # ASS/SSA オーバーライド {\i1}
+    r'|\\h'                                                 # ASS/SSA 改行しない空白
+    r'|https?://[^\s<>"]+|www\.[^\s<>"]+'                     # URL
+    r'|[\U0001F000-\U0001FAFF\u2600-\u27BF\u2B00-\u2BFF\uFE0F\u200D]+'  # 絵文字
+)
+_SPAN_PATTERN = re.compile(
+    f'(?P<path>{_PATH_PATTERN})|(?P<break>{_BREAK_PATTERN})|(?P<tag>{_HTML_TAG})|(?P<inline>{_INLINE_PATTERN})'
+)
+
+# センチネル（モデルがそのまま出力しやすい短い記号列）
+_SENTINEL_PATTERN = re.compile(r'\[(\d+)\]')
+
+
+def first_free_sentinel(text: str) -> int:
+    """テキスト中の [N] と衝突しないセンチネルの開始番号"""
+    return max((int(match.group(1)) + 1 for match in _SENTINEL_PATTERN.finditer(text)), default=0)
+
+
+def restore_sentinels(source: str, translation: str, sentinels: Dict[str, str]) -> str:
+    """翻訳文のセンチネルを元の値に戻す
+
+    翻訳で失われたものは末尾に付け足す。sentinels にない [N]（原文にあった記号や、
+    別の仕組みで付けたセンチネル）はそのまま残す。
+    """
+    expected = [match.group(0) for match in _SENTINEL_PATTERN.finditer(source) if match.group(0) in sentinels]
+    if not expected:
+        return translation
+
+    restored = _SENTINEL_PATTERN.sub(lambda m: sentinels.get(m.group(0), m.group(0)), translation)
+    missing = [sentinel for sentinel in expected if sentinel not in translation]
+    if missing:
+        restored = ' '.join([restored] + [sentinels[sentinel] for sentinel in missing])
+    return restored
+
+
+def _is_translatable(text: str) -> bool:
+    """文字を含む（翻訳が必要な）部分か"""
+    return any(ch.isalpha() for ch in text)
+
+
+def _tag_kind(match: "re.Match", closed_later: bool) -> Optional[str]:
+    """タグの種類（'break': 文の区切り, 'inline': 文中の装飾, None: タグとみなさない）
+
+    既知のタグ名のみを対象とする。属性のない開きタグは、後に閉じタグが続くか、直前が英数字でない
+    場合のみタグとみなす（"List<String> is generic" や "if a<b>c then" は保護しない）。
+    """
+    name = match.group('name').lower()
+    if name in _BREAK_TAGS:
+        return 'break'
+    if name not in _INLINE_TAGS:
+        return None
+    if match.group('close') or match.group('attributes') or closed_later:
+        return 'inline'
+    start = match.start()
+    return None if start > 0 and match.string[start - 1].isalnum() else 'inline'
+
+
+class ProtectedText:
+    """保護スパンと自然言語部分に分割したテキスト
+
+    改行・ブロック要素のタグはその位置で文を分割し、前後の自然言語部分を別々に翻訳する。
+    文中の装飾タグ・URL・絵文字は [0] のようなセンチネルに置き換えて文ごと翻訳し、翻訳後に戻す。
+    数値は文の一部として意味を持ち、トークナイザーでも短く表現されるため保護しない。
+    """
+
+    def __init__(self, text: str):
+        # (翻訳対象か, 値) のリスト。翻訳対象の値は前後の空白を除いたもの
+        self.parts: List[Tuple[bool, str]] = []
+        self.sentinels: Dict[str, str] = {}
+        # 原文中の [N]（用語集のセンチネルなど）とは別の番号を使う
+        self._first_sentinel = first_free_sentinel(text)
+
+        # 開きタグの後に同じ名前の閉じタグがあるか（後ろから見て判定）
+        matches = list(_SPAN_PATTERN.finditer(text))
+        closed_later = [False] * len(matches)
+        closing: Set[str] = set()
+        for index in range(len(matches) - 1, -1, -1):
+            match = matches[index]
+            if match.lastgroup != 'tag':
+                continue
+            name = match.group('name').lower()
+            if match.group('close'):
+                closing.add(name)
+            else:
+                closed_later[index] = name in closing
+
+        # 文の区切りで分けた領域ごとに処理
+        region: List[Tuple[str, str]] = []
+        position = 0
+        for match, closed in zip(matches, closed_later):
+            kind = match.lastgroup
+            if kind == 'tag':
+                kind = _tag_kind(match, closed)
+            if kind is None or kind == 'path':
+                # 前後のテキストと合わせて翻訳対象にする
+                continue
+            if match.start() > position:
+                region.append(('text', text[position:match.start()]))
+            if kind == 'break':
+                self._add_region(region)
+                region = []
+                self.parts.append((False, match.group(0)))
+            else:
+                region.append(('inline', match.group(0)))
+            position = match.end()
+        if position < len(text):
+            region.append(('text', text[position:]))
+        self._add_region(region)
+
+    def _add_region(self, region: List[Tuple[str, str]]):
+        """文の区切りを含まない領域を追加（両端の装飾タグ・URL・絵文字は保護部分として残す）"""
+        translatable = [i for i, (kind, value) in enumerate(region) if kind == 'text' and _is_translatable(value)]
+        if not translatable:
+            self.parts.extend((False, value) for _, value in region)
+            return
+
+        first, last = translatable[0], translatable[-1]
+        for _, value in region[:first]:
+            self.parts.append((False, value))
+
+        merged = []
+        for kind, value in region[first:last + 1]:
+            if kind == 'inline':
+                sentinel = f"[{self._first_sentinel + len(self.sentinels)}]"
+                self.sentinels[sentinel] = value
+                value = sentinel
+            merged.append(value)
+        self._add_text(''.join(merged))
+
+        for _, value in region[last + 1:]:
+            self.parts.append((False, value))
+
+    def _add_text(self, text: str):
+        """自然言語部分を追加（前後の空白は保護部分として残す）"""
+        if not text:
+            return
+        if not _is_translatable(text):
+            self.parts.append((False, text))
+            return
+
+        stripped = text.strip()
+        leading = text[:len(text) - len(text.lstrip())]
+        trailing = text[len(text.rstrip()):]
+        if leading:
+            self.parts.append((False, leading))
+        self.parts.append((True, stripped))
+        if trailing:
+            self.parts.append((False, trailing))
+
+    @property
+    def has_spans(self) -> bool:
+        """保護スパンを含むか（含まない場合は分割せずにそのまま翻訳する）"""
+        return bool(self.sentinels) or any(not translatable and value.strip() for translatable, value in self.parts)
+
+    @property
+    def segments(self) -> List[str]:
+        """翻訳が必要な自然言語部分"""
+        return [value for translatable, value in self.parts if translatable]
+
+    def restore(self, translations: List[str]) -> str:
+        """翻訳済みの自然言語部分を元の位置に戻す"""
+        translated = iter(translations)
+        return ''.join(
+            restore_sentinels(value, next(translated), self.sentinels) if translatable else value
+            for translatable, value in self.parts
+        ).strip()
+
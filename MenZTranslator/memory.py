@@ -0,0 +1,292 @@
+"""
+翻訳メモリ・用語集モジュール
+定型文は登録済みの翻訳をそのまま返し、モデルの呼び出しを省略する
+"""
+
+import json
+import logging
+import mmap
+import os
+import re
+import threading
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from .markup import first_free_sentinel
+
+if TYPE_CHECKING:
+    from .languages import LanguageRegistry
+
+
+# マスク対象のプレースホルダー（{var}、URL、数値）
+_PLACEHOLDER_PATTERN = re.compile(
+    r'\{[A-Za-z0-9_.:]*\}'
+    r'|https?://[^\s<>"]+|www\.[^\s<>"]+'
+    r'|\d+(?:[.,:]\d+)*'
+)
+_MASK_PATTERN = re.compile(r'⟦(\d+)⟧')
+
+
+def _mask_token(index: int) -> str:
+    return f"⟦{index}⟧"
+
+
+def mask_placeholders(text: str) -> Tuple[str, List[str]]:
+    """プレースホルダーをマスクし、(マスク後テキスト, 元の値のリスト) を返す"""
+    values: List[str] = []
+
+    def replace(match):
+        values.append(match.group(0))
+        return _mask_token(len(values) - 1)
+
+    return _PLACEHOLDER_PATTERN.sub(replace, text), values
+
+
+def restore_placeholders(text: str, values: List[str]) -> str:
+    """マスクされたプレースホルダーを元の値に戻す"""
+    return _MASK_PATTERN.sub(lambda m: values[int(m.group(1))], text)
+
+
+def _normalize(text: str) -> str:
+    """検索キー用に空白を正規化"""
+    return ' '.join(text.split())
+
+
+class TranslationMemory:
+    """翻訳メモリと用語集
+
+    翻訳メモリのファイル（TSV / JSONL）はmmapで読み込み、検索キーとファイル内の
+    行位置のみをインデックスとして保持する。翻訳文はヒットした時点で行を解析して取り出す。
+
+    - 完全一致: 原文そのものをキーに検索
+    - 近似一致: 数値・URL・{var} をマスクしたテキストで検索し、翻訳文に元の値を戻す
+    - 用語集: 原文中の用語をセンチネルに置き換えてモデルに渡し、翻訳後に指定の訳語に戻す
+
+    言語コードは読み込み時・検索時とも languages で NLLB コードに揃える（en / ja などでも登録できる）。
+    """
+
+    def __init__(self, languages: Optional["LanguageRegistry"] = None):
+        self.languages = languages
+        self._exact: Dict[Tuple[str, str, str], Tuple[int, int, int]] = {}
+        self._masked: Dict[Tuple[str, str, str], Tuple[int, int, int]] = {}
+        self._files: List[Tuple[mmap.mmap, str]] = []
+        # 言語ペア → (用語, 照合パターン, 訳語) のリストと、全用語を1回で照合するパターン・訳語
+        self._glossary_terms: Dict[Tuple[str, str], List[Tuple[str, str, str]]] = {}
+        self._glossary: Dict[Tuple[str, str], Tuple[re.Pattern, List[str]]] = {}
+        self._lock = threading.Lock()
+        self.stats = {
+            'entries': 0,
+            'unknown_language_entries': 0,
+            'exact_hits': 0,
+            'masked_hits': 0,
+            'misses': 0,
+            'glossary_terms': 0,
+            'glossary_applied': 0
+        }
+
+    @classmethod
+    def from_config(cls, config, languages: Optional["LanguageRegistry"] = None) -> Optional["TranslationMemory"]:
+        """設定から翻訳メモリを構築（無効の場合はNone）"""
+        if not config.memory_enabled:
+            return None
+
+        memory = cls(languages)
+        for path in config.memory_files:
+            memory.load(path)
+        for path in config.glossary_files:
+            memory.load_glossary(path)
+        logging.info(f"翻訳メモリを読み込みました: {memory.stats['entries']}件, 用語集: {memory.stats['glossary_terms']}件")
+        return memory
+
+    def load(self, path: str):
+        """翻訳メモリファイルを読み込む（.tsv または .jsonl）"""
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            logging.warning(f"翻訳メモリファイルが見つからないか空です: {path}")
+            return
+
+        fmt = 'jsonl' if path.endswith(('.jsonl', '.json')) else 'tsv'
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        file_index = len(self._files)
+        self._files.append((mapped, fmt))
+
+        unknown: Dict[str, int] = {}
+        offset = 0
+        size = len(mapped)
+        while offset < size:
+            end = mapped.find(b'\n', offset)
+            if end == -1:
+                end = size
+            entry = self._parse_line(mapped[offset:end], fmt)
+            if entry is not None:
+                source_lang, target_lang = self._resolve_pair(entry[0], entry[1], unknown)
+                source = entry[2]
+                if source_lang is None or target_lang is None:
+                    offset = end + 1
+                    continue
+                location = (file_index, offset, end)
+                self._exact[(source_lang, target_lang, _normalize(source))] = location
+                masked, _ = mask_placeholders(_normalize(source))
+                self._masked[(source_lang, target_lang, masked)] = location
+                self.stats['entries'] += 1
+            offset = end + 1
+        self._log_unknown(path, unknown)
+
+    def load_glossary(self, path: str):
+        """用語集ファイルを読み込む（.tsv または .jsonl）"""
+        if not os.path.exists(path):
+            logging.warning(f"用語集ファイルが見つかりません: {path}")
+            return
+
+        fmt = 'jsonl' if path.endswith(('.jsonl', '.json')) else 'tsv'
+        unknown: Dict[str, int] = {}
+        with open(path, 'rb') as f:
+            for line in f:
+                entry = self._parse_line(line.rstrip(b'\r\n'), fmt)
+                if entry is None:
+                    continue
+                source_lang, target_lang = self._resolve_pair(entry[0], entry[1], unknown)
+                if source_lang is None or target_lang is None:
+                    continue
+                term, translation = entry[2], entry[3]
+                # 英字を含む用語は単語境界で大文字小文字を区別せずに照合
+                if re.search(r'[A-Za-z]', term):
+                    pattern = r'(?i:(?<!\w)' + re.escape(term) + r'(?!\w))'
+                else:
+                    pattern = re.escape(term)
+                self._glossary_terms.setdefault((source_lang, target_lang), []).append((term, pattern, translation))
+                self.stats['glossary_terms'] += 1
+
+        self._log_unknown(path, unknown)
+
+        # 同じ位置では長い用語を優先し、置き換えた部分を他の用語が再び照合しないよう1つのパターンにまとめる
+        for pair, terms in self._glossary_terms.items():
+            terms = sorted(terms, key=lambda item: len(item[0]), reverse=True)
+            combined = re.compile('|'.join(f'({pattern})' for _, pattern, _ in terms))
+            self._glossary[pair] = (combined, [translation for _, _, translation in terms])
+
+    def _resolve(self, code: Optional[str]) -> Optional[str]:
+        """言語コードを NLLB コードに変換（対応表がない場合はそのまま、未対応の場合はNone）"""
+        if not code or self.languages is None:
+            return code
+        return self.languages.resolve(code)
+
+    def _resolve_pair(self, source_lang: str, target_lang: str,
+                      unknown: Dict[str, int]) -> Tuple[Optional[str], Optional[str]]:
+        """登録する行の言語ペアを変換（未対応の言語は unknown に件数を数える）"""
+        source, target = self._resolve(source_lang), self._resolve(target_lang)
+        for code, resolved in ((source_lang, source), (target_lang, target)):
+            if resolved is None:
+                unknown[code] = unknown.get(code, 0) + 1
+        if source is None or target is None:
+            self.stats['unknown_language_entries'] += 1
+        return source, target
+
+    @staticmethod
+    def _log_unknown(path: str, unknown: Dict[str, int]):
+        if unknown:
+            codes = ', '.join(f"{code} ({count}件)" for code, count in sorted(unknown.items()))
+            logging.warning(f"未対応の言語コードの行を読み飛ばしました: {path}: {codes}")
+
+    def lookup(self, text: str, source_lang: str, target_lang: str) -> Optional[str]:
+        """翻訳メモリから翻訳を検索（見つからない場合はNone）"""
+        source_lang, target_lang = self._resolve(source_lang), self._resolve(target_lang)
+        if source_lang is None or target_lang is None:
+            return None
+        normalized = _normalize(text)
+
+        location = self._exact.get((source_lang, target_lang, normalized))
+        if location is not None:
+            self.stats['exact_hits'] += 1
+            return self._read_target(location)
+
+        masked, values = mask_placeholders(normalized)
+        if values:
+            location = self._masked.get((source_lang, target_lang, masked))
+            if location is not None:
+                target = self._read_masked_target(location, values)
+                if target is not None:
+                    self.stats['masked_hits'] += 1
+                    return target
+
+        self.stats['misses'] += 1
+        return None
+
+    def apply_glossary(self, text: str, source_lang: str, target_lang: str) -> Tuple[str, Dict[str, str]]:
+        """原文中の用語をセンチネルに置き換え、(置き換え後のテキスト, センチネル → 訳語) を返す
+
+        訳語を原文に埋め込むと複数の言語が混在した原文になり、言語判定の素通しやモデルによる
+        訳語の崩れが起きるため、用語は [N] としてモデルに渡し、翻訳後に markup.restore_sentinels で訳語に戻す。
+        """
+        glossary = self._glossary.get((self._resolve(source_lang), self._resolve(target_lang)))
+        if glossary is None:
+            return text, {}
+
+        pattern, translations = glossary
+        first = first_free_sentinel(text)
+        sentinels: Dict[str, str] = {}
+
+        def replace(match):
+            sentinel = f"[{first + len(sentinels)}]"
+            sentinels[sentinel] = translations[match.lastindex - 1]
+            return sentinel
+
+        applied = pattern.sub(replace, text)
+        if sentinels:
+            self.stats['glossary_applied'] += 1
+        return applied, sentinels
+
+    def _read_target(self, location: Tuple[int, int, int]) -> str:
+        """インデックスの位置から翻訳文を取り出す"""
+        file_index, start, end = location
+        mapped, fmt = self._files[file_index]
+        with self._lock:
+            line = mapped[start:end]
+        return self._parse_line(line, fmt)[3]
+
+    def _read_masked_target(self, location: Tuple[int, int, int], values: List[str]) -> Optional[str]:
+        """近似一致した翻訳文に入力側のプレースホルダーの値を当てはめる"""
+        file_index, start, end = location
+        mapped, fmt = self._files[file_index]
+        with self._lock:
+            line = mapped[start:end]
+        _, _, source, target = self._parse_line(line, fmt)
+
+        _, source_values = mask_placeholders(_normalize(source))
+        masked_target, target_values = mask_placeholders(target)
+
+        # 翻訳文側の各プレースホルダーが原文側の何番目かを対応付ける
+        remaining = list(source_values)
+        mapped_values = []
+        for value in target_values:
+            if value not in remaining:
+                return None
+            index = remaining.index(value)
+            remaining[index] = None
+            mapped_values.append(values[index])
+
+        return restore_placeholders(masked_target, mapped_values)
+
+    @staticmethod
+    def _parse_line(line: bytes, fmt: str) -> Optional[Tuple[str, str, str, str]]:
+        """1行を (source_lang, target_lang, source, target) に解析"""
+        text = line.decode('utf-8').strip('\r')
+        if not text.strip() or text.startswith('#'):
+            return None
+        try:
+            if fmt == 'jsonl':
+                data = json.loads(text)
+                return data['source_lang'], data['target_lang'], data['source'], data['target']
+            source_lang, target_lang, source, target = text.split('\t')
+            return source_lang, target_lang, source, target
+        except (ValueError, KeyError) as e:
+            logging.warning(f"翻訳メモリの行を解析できません: {e}")
+            return None
+
+    def close(self):
+        """mmapを閉じる"""
+        for mapped, _ in self._files:
+            mapped.close()
+        self._files.clear()
+        self._exact.clear()
+        self._masked.clear()
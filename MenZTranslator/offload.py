@@ -0,0 +1,66 @@
+"""
+モデル退避モジュール
+アイドル時にモデルの重みをディスクに退避してメモリを解放し、次のリクエストで読み戻す
+"""
+
+import logging
+import os
+import time
+from typing import List, Tuple
+
+import torch
+from safetensors import safe_open
+from safetensors.torch import save_file
+
+
+class ModelOffloader:
+    """1つのモデルの重みの退避と復元
+
+    重み（パラメータ・バッファ）を safetensors ファイルに書き出し、モデル側のテンソルは
+    空のテンソルに置き換える。モジュール構成と Parameter オブジェクトはそのまま残すため、
+    共有された重み（tie_word_embeddings など）も復元後にそのまま共有される。
+    重みは変化しないため、ファイルは最初の退避時に1回だけ書き出す。
+    """
+
+    def __init__(self, model, path: str):
+        self.model = model
+        self.path = path
+        self.offloaded = False
+        self._written = False
+        # (名前, テンソル)。同じテンソルを共有する名前は最初の1つのみ列挙される
+        self._tensors: List[Tuple[str, torch.Tensor]] = list(model.named_parameters()) + list(model.named_buffers())
+
+    def offload(self):
+        """重みをファイルに退避してメモリを解放"""
+        if self.offloaded:
+            return
+        if not self._written:
+            # 同じパスのファイルがあれば上書きする（以前のプロセスが残したファイルはサーバーの起動時に削除される）
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            start_time = time.time()
+            save_file({name: tensor.detach().cpu().contiguous() for name, tensor in self._tensors}, self.path)
+            self._written = True
+            logging.info(f"モデルの重みを書き出しました ({time.time() - start_time:.2f}秒): {self.path}")
+
+        with torch.no_grad():
+            for _, tensor in self._tensors:
+                tensor.data = torch.empty(0, dtype=tensor.dtype, device=tensor.device)
+        self.offloaded = True
+
+    def restore(self, device: torch.device):
+        """退避した重みを読み戻す（ファイルはmmapされ、ページキャッシュに残っていればディスクを読まない）"""
+        if not self.offloaded:
+            return
+        with torch.no_grad(), safe_open(self.path, framework="pt", device=str(device)) as f:
+            for name, tensor in self._tensors:
+                tensor.data = f.get_tensor(name)
+        self.offloaded = False
+
+    def cleanup(self):
+        """退避ファイルを削除"""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning(f"退避ファイルを削除できませんでした ({self.path}): {e}")
@@ -0,0 +1,153 @@
+"""
+CPU推論のスレッド・NUMA設定モジュール
+"""
+
+import logging
+import os
+import statistics
+import time
+from typing import Dict, List, Optional, Set
+
+
+# スレッド数スイープで使用するサンプル文
+SWEEP_SAMPLES = [
+    "Hello, how are you?",
+    "The quick brown fox jumps over the lazy dog.",
+    "Please make sure to save your progress before leaving the game.",
+    "We are going to start the live stream in five minutes, so stay tuned!"
+]
+
+
+def parse_cpu_list(cpu_list: str) -> Set[int]:
+    """'0-3,8,10-11' 形式のCPUリストを解析"""
+    cpus: Set[int] = set()
+    for part in cpu_list.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-')
+            cpus.update(range(int(start), int(end) + 1))
+        else:
+            cpus.add(int(part))
+    return cpus
+
+
+def format_cpu_list(cpus: Set[int]) -> str:
+    """CPUの集合を '0-3,8' 形式に変換"""
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ','.join(f"{start}-{end}" if start != end else str(start) for start, end in ranges)
+
+
+def numa_nodes() -> Dict[int, Set[int]]:
+    """NUMAノードとそのCPUの一覧（Linux以外では空）"""
+    base = "/sys/devices/system/node"
+    nodes: Dict[int, Set[int]] = {}
+    if not os.path.isdir(base):
+        return nodes
+    for name in os.listdir(base):
+        if not name.startswith("node") or not name[4:].isdigit():
+            continue
+        try:
+            with open(os.path.join(base, name, "cpulist"), encoding='utf-8') as f:
+                nodes[int(name[4:])] = parse_cpu_list(f.read())
+        except OSError:
+            continue
+    return nodes
+
+
+def current_affinity() -> Optional[Set[int]]:
+    """現在のプロセスのCPUアフィニティ（取得できない環境ではNone）"""
+    if hasattr(os, "sched_getaffinity"):
+        return set(os.sched_getaffinity(0))
+    return None
+
+
+def apply_cpu_settings(config) -> Dict:
+    """[PERFORMANCE] の設定を適用し、実際のトポロジーをログに出力"""
+    import torch
+
+    # CPUアフィニティ（NUMAノード指定が優先）
+    cpus: Optional[Set[int]] = None
+    if config.numa_node >= 0:
+        nodes = numa_nodes()
+        if config.numa_node in nodes:
+            cpus = nodes[config.numa_node]
+        else:
+            logging.warning(f"NUMAノード {config.numa_node} が見つかりません（検出: {sorted(nodes) or 'なし'}）")
+    elif config.cpu_affinity:
+        cpus = parse_cpu_list(config.cpu_affinity)
+
+    if cpus:
+        if hasattr(os, "sched_setaffinity"):
+            try:
+                os.sched_setaffinity(0, cpus)
+            except OSError as e:
+                logging.warning(f"CPUアフィニティの設定に失敗しました: {e}")
+        else:
+            logging.warning("この環境ではCPUアフィニティを設定できません")
+
+    # スレッド数（0の場合は、アフィニティを設定していればそのCPU数、それ以外はPyTorchの既定値）
+    affinity = current_affinity()
+    intra_op_threads = config.intra_op_threads or (len(cpus) if cpus and affinity else 0)
+    if intra_op_threads > 0:
+        torch.set_num_threads(intra_op_threads)
+    if config.inter_op_threads > 0:
+        try:
+            torch.set_num_interop_threads(config.inter_op_threads)
+        except RuntimeError as e:
+            # 並列処理が開始された後は変更できない
+            logging.warning(f"inter-opスレッド数を設定できません: {e}")
+
+    topology = {
+        "logical_cpus": os.cpu_count(),
+        "affinity": format_cpu_list(affinity) if affinity else "unknown",
+        "numa_nodes": {node: format_cpu_list(node_cpus) for node, node_cpus in sorted(numa_nodes().items())},
+        "intra_op_threads": torch.get_num_threads(),
+        "inter_op_threads": torch.get_num_interop_threads()
+    }
+    logging.info("CPUトポロジー:")
+    logging.info(f"  論理CPU数: {topology['logical_cpus']}")
+    logging.info(f"  CPUアフィニティ: {topology['affinity']}")
+    if topology['numa_nodes']:
+        for node, node_cpus in topology['numa_nodes'].items():
+            logging.info(f"  NUMAノード {node}: {node_cpus}")
+    logging.info(f"  intra-opスレッド数: {topology['intra_op_threads']}")
+    logging.info(f"  inter-opスレッド数: {topology['inter_op_threads']}")
+    return topology
+
+
+def sweep_threads(translator, thread_counts: Optional[List[int]] = None, repeats: int = 3,
+                  source_lang: str = "eng_Latn", target_lang: str = "jpn_Jpan") -> Dict[int, float]:
+    """スレッド数ごとの翻訳時間の中央値（ミリ秒）を計測"""
+    import torch
+
+    if thread_counts is None:
+        available = len(current_affinity() or range(os.cpu_count() or 1))
+        thread_counts = sorted({1, 2, 4, 8, 16, 32, available} & set(range(1, available + 1)))
+
+    results: Dict[int, float] = {}
+    original_threads = torch.get_num_threads()
+    try:
+        for threads in thread_counts:
+            torch.set_num_threads(threads)
+            # ウォームアップ
+            translator.translate(SWEEP_SAMPLES[0], source_lang, target_lang)
+
+            timings = []
+            for _ in range(repeats):
+                for sample in SWEEP_SAMPLES:
+                    start_time = time.perf_counter()
+                    translator.translate(sample, source_lang, target_lang)
+                    timings.append((time.perf_counter() - start_time) * 1000)
+            results[threads] = statistics.median(timings)
+            logging.info(f"  スレッド数 {threads:>3}: 中央値 {results[threads]:.1f}ms")
+    finally:
+        torch.set_num_threads(original_threads)
+
+    return results
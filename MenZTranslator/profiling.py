@@ -0,0 +1,226 @@
+"""
+プロファイリングモジュール
+管理コマンド・シグナルで指定時間だけ、推論（torch.profiler）・スレッドのスタック・イベントループの遅延を計測する
+（計測中以外はフック・スレッド・タスクを一切動かさない）
+"""
+
+import asyncio
+import json
+import logging
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+
+# スタックのサンプルから関数ごとの集計に含める件数
+TOP_FUNCTIONS = 15
+
+# この時間を超えたイベントループの遅延を停止として記録する（ミリ秒）
+LOOP_STALL_MS = 100
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})"
+
+
+class StackSampler:
+    """指定したスレッドのPythonスタックを一定間隔で採取する（別スレッドで実行）"""
+
+    def __init__(self, threads: Dict[int, str], interval: float):
+        # スレッドID → 名前
+        self.threads = threads
+        self.interval = interval
+        self.stacks: Dict[str, Counter] = {name: Counter() for name in threads.values()}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for ident, name in self.threads.items():
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                # 呼び出し元から順に並べる（flamegraph の collapsed 形式）
+                self.stacks[name][tuple(reversed(labels))] += 1
+
+    def summary(self, name: str) -> Dict[str, Any]:
+        """関数ごとの割合（self: スタックの先頭にいた割合、inclusive: スタックに含まれていた割合）"""
+        stacks = self.stacks[name]
+        total = sum(stacks.values())
+        self_counts: Counter = Counter()
+        inclusive_counts: Counter = Counter()
+        for stack, count in stacks.items():
+            # 行番号を除いた関数単位で集計
+            functions = [label.rsplit(':', 1)[0] + ')' for label in stack]
+            if functions:
+                self_counts[functions[-1]] += count
+            for function in set(functions):
+                inclusive_counts[function] += count
+
+        def ranked(counts: Counter) -> List[Dict[str, Any]]:
+            return [{"function": function, "ratio": round(count / total, 3)}
+                    for function, count in counts.most_common(TOP_FUNCTIONS)]
+
+        return {
+            "samples": total,
+            "self": ranked(self_counts) if total else [],
+            "inclusive": ranked(inclusive_counts) if total else []
+        }
+
+    def write_folded(self, name: str, path: Path):
+        """collapsed 形式で書き出す（flamegraph.pl・speedscope 等で表示できる）"""
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks[name].most_common():
+                f.write(f"{';'.join(stack)} {count}\n")
+
+
+class LoopLagMonitor:
+    """イベントループの遅延（スリープからの復帰が予定より遅れた時間）を計測"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.lags_ms: List[float] = []
+        # (計測開始からの秒数, 遅延ミリ秒)
+        self.stalls: List[List[float]] = []
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        origin = loop.time()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag_ms = max(0.0, (loop.time() - start - self.interval) * 1000)
+            self.lags_ms.append(lag_ms)
+            if lag_ms >= LOOP_STALL_MS:
+                self.stalls.append([round(start - origin, 3), round(lag_ms, 1)])
+
+    def summary(self) -> Dict[str, Any]:
+        if not self.lags_ms:
+            return {"samples": 0}
+        ordered = sorted(self.lags_ms)
+
+        def at(ratio: float) -> float:
+            return round(ordered[min(len(ordered) - 1, int(ratio * len(ordered)))], 2)
+
+        return {
+            "samples": len(ordered),
+            "p50_ms": at(0.50),
+            "p99_ms": at(0.99),
+            "max_ms": round(ordered[-1], 2),
+            "stalls": len(self.stalls)
+        }
+
+
+class ProfileSession:
+    """1回のプロファイル（出力先は output_dir/profile-<日時>/）
+
+    worker には推論スレッドで関数を実行するコルーチン関数を渡す。torch.profiler は
+    そのスレッド上で開始・停止するため、推論の演算子はすべて記録される。
+    """
+
+    def __init__(self, output_dir: str, sample_interval: float, torch_trace: bool = True):
+        self.directory = Path(output_dir) / time.strftime('profile-%Y%m%d-%H%M%S')
+        self.sample_interval = sample_interval
+        self.torch_trace = torch_trace
+
+    async def run(self, duration: float,
+                  worker: Optional[Callable[[Callable[[], Any]], Awaitable[Any]]] = None) -> Dict[str, Any]:
+        """duration 秒間計測し、結果を書き出して概要を返す"""
+        loop = asyncio.get_running_loop()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        logging.info(f"プロファイルを開始します ({duration:.0f}秒): {self.directory}")
+
+        threads = {threading.get_ident(): "event_loop"}
+        torch_profiler = None
+        if worker is not None:
+            threads[await worker(threading.get_ident)] = "inference"
+            if self.torch_trace:
+                torch_profiler = await worker(self._start_torch)
+
+        sampler = StackSampler(threads, self.sample_interval)
+        lag = LoopLagMonitor(self.sample_interval)
+        sampler.start()
+        lag_task = asyncio.create_task(lag.run())
+        start_time = time.time()
+        try:
+            await asyncio.sleep(duration)
+        finally:
+            lag_task.cancel()
+            await loop.run_in_executor(None, sampler.stop)
+            files = []
+            if torch_profiler is not None:
+                # 実行中のジョブの完了後に停止し、書き出しも推論スレッドで行う
+                files.extend(await worker(lambda: self._stop_torch(torch_profiler)))
+
+        result = {
+            "output_dir": str(self.directory),
+            "duration_s": round(time.time() - start_time, 2),
+            "sample_interval_ms": round(self.sample_interval * 1000, 1),
+            "loop_lag": lag.summary(),
+            "threads": {name: sampler.summary(name) for name in threads.values()}
+        }
+        files.extend(await loop.run_in_executor(None, self._write, sampler, lag, result))
+        result["files"] = sorted(files)
+        logging.info(f"プロファイルを保存しました: {self.directory}")
+        return result
+
+    def _start_torch(self):
+        """torch.profiler を開始（推論スレッド上で呼ばれる）"""
+        import torch
+        from torch.profiler import ProfilerActivity, profile
+
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+        profiler = profile(activities=activities, record_shapes=True)
+        profiler.start()
+        return profiler
+
+    def _stop_torch(self, profiler) -> List[str]:
+        """torch.profiler を停止し、Chrome trace と演算子ごとの集計を書き出す"""
+        profiler.stop()
+        trace_path = self.directory / "torch_trace.json"
+        ops_path = self.directory / "torch_ops.txt"
+        profiler.export_chrome_trace(str(trace_path))
+        ops_path.write_text(
+            profiler.key_averages().table(sort_by="self_cpu_time_total", row_limit=40),
+            encoding='utf-8'
+        )
+        return [trace_path.name, ops_path.name]
+
+    def _write(self, sampler: StackSampler, lag: LoopLagMonitor, result: Dict[str, Any]) -> List[str]:
+        files = []
+        for name in sampler.stacks:
+            path = self.directory / f"stacks_{name}.folded"
+            sampler.write_folded(name, path)
+            files.append(path.name)
+
+        lag_path = self.directory / "loop_lag.json"
+        lag_path.write_text(json.dumps({
+            "interval_ms": round(lag.interval * 1000, 1),
+            "stall_threshold_ms": LOOP_STALL_MS,
+            "stalls": lag.stalls,
+            "lags_ms": [round(value, 2) for value in lag.lags_ms]
+        }), encoding='utf-8')
+        files.append(lag_path.name)
+
+        summary_path = self.directory / "summary.json"
+        summary_path.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding='utf-8')
+        files.append(summary_path.name)
+        return files
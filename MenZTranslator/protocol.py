@@ -0,0 +1,60 @@
+"""
+WebSocketプロトコル定義モジュール
+サーバー・ゲートウェイ・設定ツールから共通で使用する（torch等の重いライブラリに依存しない）
+"""
+
+import hmac
+import json
+from typing import Any, Dict, Optional
+
+
+# クライアントが送信できるメッセージタイプ
+MESSAGE_TYPES = ('translation', 'ping', 'stats', 'languages', 'session', 'prefetch', 'cancel', 'reload', 'profile')
+
+# デコード方式（beam: ビームサーチ, assisted: ドラフトモデルによる投機的デコード）
+DECODING_MODES = ('beam', 'assisted')
+
+# エラーレスポンスの code（invalid_request: リクエストの内容が不正, inference_failed: 推論中の例外,
+# timeout: 推論が job_timeout を超えた, quarantined: 停止・クラッシュを繰り返した入力,
+# worker_crashed: 処理中に翻訳サーバーが停止した, unavailable: 利用可能な翻訳サーバーがない）
+ERROR_CODES = ('invalid_request', 'inference_failed', 'timeout', 'quarantined', 'worker_crashed', 'unavailable')
+
+# ゲートウェイが転送元のクライアントごとに付ける公平スケジューリングのキー（gw:<client_id>）
+GATEWAY_KEY_PREFIX = 'gw:'
+
+
+def encode(data: Dict[str, Any]) -> str:
+    """レスポンスをJSON文字列に変換"""
+    return json.dumps(data, ensure_ascii=False)
+
+
+def error_response(error_message: str, request_id: Optional[str] = None,
+                   code: Optional[str] = None) -> Dict[str, Any]:
+    """エラーレスポンスを作成"""
+    error_data = {
+        "error": error_message,
+        "status": "error"
+    }
+    if code:
+        error_data["code"] = code
+    if request_id:
+        error_data["request_id"] = request_id
+    return error_data
+
+
+def is_admin(data: Dict[str, Any], admin_token: str) -> bool:
+    """管理コマンドの認証（admin_token が未設定の場合は常に拒否）"""
+    token = data.get('admin_token')
+    return bool(admin_token) and isinstance(token, str) and \
+        hmac.compare_digest(token.encode('utf-8'), admin_token.encode('utf-8'))
+
+
+def is_cancel_message(message: Any) -> bool:
+    """取り消しメッセージかどうか（処理枠の空きを待たずに受信時に処理するため）"""
+    if not isinstance(message, str) or '"cancel"' not in message:
+        return False
+    try:
+        data = json.loads(message)
+    except ValueError:
+        return False
+    return isinstance(data, dict) and data.get('type') == 'cancel'
@@ -0,0 +1,76 @@
+"""
+翻訳結果キャッシュモジュール
+翻訳済みの結果を保持し、同じリクエストをモデルを使わずに返す（prefetch で事前に登録できる）
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional, Tuple
+
+
+class TranslationResultCache:
+    """(原文, 言語ペア, 生成設定) をキーとした翻訳結果のLRUキャッシュ（件数で上限を設定）"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        # キー → (翻訳結果, prefetch で登録されたか)
+        self._entries: "OrderedDict[Hashable, Tuple[str, bool]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'prefetched': 0,
+            'prefetch_hits': 0,
+            'evictions': 0
+        }
+
+    @staticmethod
+    def key(text: str, source_lang: str, target_lang: str, max_length: int,
+            decoding: Optional[str] = None) -> Tuple[str, str, str, int, Optional[str]]:
+        """キャッシュのキー（言語コードは検証済みのNLLBコード）"""
+        return (' '.join(text.split()), source_lang, target_lang, max_length, decoding)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key: Hashable) -> Optional[str]:
+        """キャッシュされた翻訳結果を取得"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            result, prefetched = entry
+            if prefetched:
+                # 事前翻訳が使われたのは最初のヒットのみ数える
+                self.stats['prefetch_hits'] += 1
+                self._entries[key] = (result, False)
+            return result
+
+    def put(self, key: Hashable, result: str, prefetched: bool = False):
+        """翻訳結果を登録（上限を超えた分は古いものから破棄）"""
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (result, prefetched)
+            if prefetched:
+                self.stats['prefetched'] += 1
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict:
+        lookups = self.stats['hits'] + self.stats['misses']
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hit_rate": round(self.stats['hits'] / lookups, 3) if lookups else None,
+            **self.stats
+        }
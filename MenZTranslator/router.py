@@ -0,0 +1,186 @@
+"""
+モデルルーティングモジュール
+言語ペアと入力の長さに応じて翻訳モデルを選択し、読み込んだモデルをメモリ予算内で管理する
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+
+# 入力長クラス
+LENGTH_CLASSES = ('short', 'medium', 'long')
+
+
+class RoutingRule:
+    """ルーティングルール（言語ペア・入力長クラス → モデル名）"""
+
+    def __init__(self, name: str, source_lang: str, target_lang: str, length_class: str, model_name: str):
+        self.name = name
+        self.source_lang = source_lang
+        self.target_lang = target_lang
+        self.length_class = length_class
+        self.model_name = model_name
+
+    @classmethod
+    def parse(cls, name: str, value: str) -> "RoutingRule":
+        """'eng_Latn->jpn_Jpan, short, facebook/nllb-200-distilled-600M' 形式を解析"""
+        try:
+            pair, length_class, model_name = [item.strip() for item in value.split(',')]
+            source_lang, target_lang = [lang.strip() for lang in pair.split('->')]
+        except ValueError:
+            raise ValueError(f"ルーティングルール '{name}' の形式が不正です: {value}")
+        if length_class != '*' and length_class not in LENGTH_CLASSES:
+            raise ValueError(f"ルーティングルール '{name}' の入力長クラスが不正です: {length_class}")
+        return cls(name, source_lang, target_lang, length_class, model_name)
+
+    def matches(self, source_lang: str, target_lang: str, length_class: str) -> bool:
+        return (self.source_lang in ('*', source_lang)
+                and self.target_lang in ('*', target_lang)
+                and self.length_class in ('*', length_class))
+
+
+class ModelPool:
+    """翻訳エンジンの遅延読み込みとLRU方式の解放
+
+    読み込み済みモデルの推定メモリ使用量の合計が予算を超えた場合、最も長く使われて
+    いないモデルから解放する。既定モデルは常駐させる。
+    """
+
+    def __init__(self, factory: Callable[[str], object], memory_budget_mb: int, pinned: Optional[str] = None):
+        self.factory = factory
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self.pinned = pinned
+        self._translators: "OrderedDict[str, object]" = OrderedDict()
+        self._lock = threading.RLock()
+        self.stats = {
+            'loads': 0,
+            'evictions': 0,
+            'hits': 0
+        }
+
+    def get(self, model_name: str):
+        """モデルを取得（未読み込みの場合は読み込む）"""
+        with self._lock:
+            translator = self._translators.get(model_name)
+            if translator is not None:
+                self._translators.move_to_end(model_name)
+                self.stats['hits'] += 1
+                return translator
+
+            logging.info(f"モデルプール: {model_name} を読み込みます")
+            start_time = time.time()
+            translator = self.factory(model_name)
+            self._translators[model_name] = translator
+            self.stats['loads'] += 1
+            logging.info(f"モデルプール: {model_name} の読み込みが完了しました ({time.time() - start_time:.2f}秒, "
+                         f"{translator.memory_bytes / 1024 / 1024:.0f}MB)")
+
+            self._evict(keep=model_name)
+            return translator
+
+    def _evict(self, keep: str):
+        """メモリ予算を超えている間、古いモデルから解放"""
+        for model_name in list(self._translators):
+            if self.memory_bytes <= self.memory_budget:
+                break
+            if model_name in (keep, self.pinned):
+                continue
+            translator = self._translators.pop(model_name)
+            translator.release()
+            self.stats['evictions'] += 1
+            logging.info(f"モデルプール: メモリ予算超過のため {model_name} を解放しました")
+
+    @property
+    def memory_bytes(self) -> int:
+        return sum(t.memory_bytes for t in self._translators.values())
+
+    @property
+    def translators(self) -> List[object]:
+        with self._lock:
+            return list(self._translators.values())
+
+    def get_stats(self) -> Dict:
+        return {
+            "loaded_models": list(self._translators),
+            "memory_mb": round(self.memory_bytes / 1024 / 1024, 1),
+            "memory_budget_mb": round(self.memory_budget / 1024 / 1024, 1),
+            **self.stats
+        }
+
+
+class ModelRouter:
+    """ルーティングテーブルに従って翻訳エンジンを選択するクラス"""
+
+    def __init__(self, rules: List[RoutingRule], pool: ModelPool, default_model: str,
+                 short_max_chars: int = 80, long_min_chars: int = 400, max_streams: int = 256):
+        self.rules = rules
+        self.pool = pool
+        self.default_model = default_model
+        self.short_max_chars = short_max_chars
+        self.long_min_chars = long_min_chars
+        self.routed: Dict[str, int] = {}
+        # ストリームごとに固定したモデル（ストリーム → ((翻訳元, 翻訳先), モデル名)）
+        self.max_streams = max_streams
+        self._streams: "OrderedDict[Hashable, Tuple[Tuple[str, str], str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def length_class(self, text: str) -> str:
+        """入力長クラスを判定"""
+        if len(text) <= self.short_max_chars:
+            return 'short'
+        if len(text) >= self.long_min_chars:
+            return 'long'
+        return 'medium'
+
+    def select_model(self, text: str, source_lang: str, target_lang: str) -> str:
+        """モデル名を選択（一致するルールがない場合は既定モデル）"""
+        length_class = self.length_class(text)
+        for rule in self.rules:
+            if rule.matches(source_lang, target_lang, length_class):
+                return rule.model_name
+        return self.default_model
+
+    def select(self, text: str, source_lang: str, target_lang: str, stream_key: Optional[Hashable] = None):
+        """翻訳エンジンを選択（必要に応じて読み込む）
+
+        stream_key を指定した場合は、最初に選択したモデルを release まで使い続ける。
+        発話が伸びて入力長クラスが変わってもモデルを切り替えないため、インクリメンタル翻訳の
+        確定済みの文の翻訳を引き継げる（言語ペアが変わった場合のみ選び直す）。
+        """
+        if stream_key is None:
+            model_name = self.select_model(text, source_lang, target_lang)
+        else:
+            with self._lock:
+                pinned = self._streams.get(stream_key)
+                if pinned is not None and pinned[0] == (source_lang, target_lang):
+                    model_name = pinned[1]
+                    self._streams.move_to_end(stream_key)
+                else:
+                    model_name = self.select_model(text, source_lang, target_lang)
+                    self._streams[stream_key] = ((source_lang, target_lang), model_name)
+                    self._streams.move_to_end(stream_key)
+                    while len(self._streams) > self.max_streams:
+                        self._streams.popitem(last=False)
+        self.routed[model_name] = self.routed.get(model_name, 0) + 1
+        return self.pool.get(model_name)
+
+    def release(self, stream_key: Hashable):
+        """ストリームのモデルの固定を解除（発話の終了時）"""
+        with self._lock:
+            self._streams.pop(stream_key, None)
+
+    def release_matching(self, predicate: Callable[[Hashable], bool]):
+        """条件に一致するストリームの固定を解除（クライアント切断時）"""
+        with self._lock:
+            for stream_key in [k for k in self._streams if predicate(k)]:
+                del self._streams[stream_key]
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.pool.get_stats(),
+            "routed": dict(self.routed),
+            "pinned_streams": len(self._streams)
+        }
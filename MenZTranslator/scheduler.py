@@ -0,0 +1,176 @@
+"""
+公平スケジューリングモジュール
+クライアントごとのキューから、重み付きの Deficit Round Robin で翻訳ジョブを取り出す
+"""
+
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, Optional
+
+from .protocol import GATEWAY_KEY_PREFIX
+
+
+class _Flow:
+    """1クライアント（client_id または API キー）のキュー"""
+
+    def __init__(self, weight: float):
+        self.weight = weight
+        self.jobs: Deque[Any] = deque()
+        self.deficit = 0.0
+        # 今回の巡回で quantum を加算済みか
+        self.credited = False
+        self.stats = {
+            'submitted': 0,
+            'served': 0,
+            'cost_served': 0,
+            'wait_ms_total': 0.0,
+            'max_wait_ms': 0.0
+        }
+
+
+class FairScheduler:
+    """優先度ごとに、クライアント間で推論コストを公平に配分するキュー
+
+    優先度の高い段のジョブが常に先に処理される。同じ優先度の中では、各クライアントに
+    quantum × 重み のコスト（推定トークン数）を順番に割り当て、割り当て分を使い切るまで
+    そのクライアントのジョブを処理する（Deficit Round Robin）。大量のジョブを投入した
+    クライアントがいても、他のクライアントの待ち時間は自身のジョブ数にのみ依存する。
+    """
+
+    def __init__(self, quantum: int = 64, weights: Optional[Dict[str, float]] = None, default_weight: float = 1.0,
+                 names: Optional[Dict[str, str]] = None, is_stale: Optional[Callable[[Any], bool]] = None):
+        self.quantum = quantum
+        # 置換・取り消し済みのジョブはコストを消費せずに破棄する
+        self.is_stale = is_stale or (lambda job: False)
+        self.weights = weights or {}
+        self.default_weight = default_weight
+        # 統計に表示するクライアント名（API キー → 名前）
+        self.names = names or {}
+        # 優先度 → (キー → キュー)。OrderedDict の先頭が現在処理中のクライアント
+        self._tiers: Dict[int, "OrderedDict[str, _Flow]"] = {}
+        # 空になったキューの統計（再投入時に引き継ぐ）
+        self._stats: Dict[str, Dict] = {}
+        self._size = 0
+        self._available = asyncio.Event()
+
+    def weight(self, key: str) -> float:
+        # 重みが0以下だと割り当てが増えず、そのクライアントのジョブが取り出せなくなる
+        return max(0.01, self.weights.get(key, self.default_weight))
+
+    def qsize(self) -> int:
+        return self._size
+
+    def put(self, priority: int, key: str, job):
+        """ジョブを投入（job.cost を推論コストとして使用）"""
+        tier = self._tiers.setdefault(priority, OrderedDict())
+        flow = tier.get(key)
+        if flow is None:
+            flow = _Flow(self.weight(key))
+            flow.stats = self._stats.setdefault(key, flow.stats)
+            tier[key] = flow
+        flow.jobs.append(job)
+        flow.stats['submitted'] += 1
+        self._size += 1
+        self._available.set()
+
+    async def get(self):
+        """次に処理するジョブを取り出す（空の場合は投入を待つ）"""
+        while True:
+            job = self._pop()
+            if job is not None:
+                return job
+            self._available.clear()
+            await self._available.wait()
+
+    def _pop(self):
+        for priority in sorted(self._tiers):
+            tier = self._tiers[priority]
+            while tier:
+                key, flow = next(iter(tier.items()))
+                if not flow.jobs:
+                    del tier[key]
+                    continue
+
+                if not flow.credited:
+                    flow.deficit += self.quantum * flow.weight
+                    flow.credited = True
+
+                job = flow.jobs[0]
+                if self.is_stale(job):
+                    flow.jobs.popleft()
+                    self._size -= 1
+                    if not flow.jobs:
+                        del tier[key]
+                        self._drop_idle_stats(key)
+                    continue
+
+                if flow.deficit < job.cost:
+                    # 割り当てを使い切ったので次のクライアントへ（残りは次の巡回に持ち越す）
+                    flow.credited = False
+                    tier.move_to_end(key)
+                    continue
+
+                flow.jobs.popleft()
+                flow.deficit -= job.cost
+                self._size -= 1
+                if not flow.jobs:
+                    # キューが空になったクライアントは持ち越し分を失う
+                    del tier[key]
+                    self._drop_idle_stats(key)
+
+                wait_ms = (time.time() - job.enqueued_at) * 1000
+                flow.stats['served'] += 1
+                flow.stats['cost_served'] += job.cost
+                flow.stats['wait_ms_total'] += wait_ms
+                flow.stats['max_wait_ms'] = max(flow.stats['max_wait_ms'], wait_ms)
+                return job
+        return None
+
+    def _drop_idle_stats(self, key: str):
+        """重みを設定していないクライアントの統計は、キューが空になった時点で破棄する
+
+        接続ごと・ゲートウェイのクライアントごとのキーは増え続けるため、待機中のジョブが
+        あるクライアントのみ統計に残す。
+        """
+        if key in self.weights or key in self.names:
+            return
+        if any(key in tier for tier in self._tiers.values()):
+            return
+        self._stats.pop(key, None)
+
+    def forget(self, key: str):
+        """切断されたクライアントの統計を破棄
+
+        キュー内のジョブはここでは破棄しない。呼び出し側が取り消し済みにしたジョブは、
+        is_stale によって取り出し時にコストを消費せずに破棄される。
+        """
+        self._stats.pop(key, None)
+
+    def get_stats(self) -> Dict[str, Dict]:
+        """クライアントごとのキューの状態"""
+        queued: Dict[str, int] = {}
+        for tier in self._tiers.values():
+            for key, flow in tier.items():
+                queued[key] = queued.get(key, 0) + len(flow.jobs)
+
+        return {
+            self._label(key): {
+                "weight": self.weight(key),
+                "queued": queued.get(key, 0),
+                "submitted": stats['submitted'],
+                "served": stats['served'],
+                "cost_served": stats['cost_served'],
+                "avg_wait_ms": round(stats['wait_ms_total'] / stats['served'], 1) if stats['served'] else None,
+                "max_wait_ms": round(stats['max_wait_ms'], 1)
+            }
+            for key, stats in self._stats.items()
+        }
+
+    def _label(self, key: str) -> str:
+        """統計に表示するキー（API キーそのものは表示しない）"""
+        if key in self.names:
+            return self.names[key]
+        if key.startswith(('client:', GATEWAY_KEY_PREFIX)):
+            return key
+        return f"{key[:4]}…" if len(key) > 4 else key
@@ -0,0 +1,147 @@
+"""
+クライアントセッションモジュール
+1つのWebSocket接続で複数のリクエストを並行処理し、応答の順序を制御する
+"""
+
+import asyncio
+import itertools
+import logging
+from contextvars import ContextVar
+from typing import Awaitable, Dict, Optional, Set
+
+
+# 処理中のメッセージの受信順の番号（メッセージごとのタスク内で設定される）
+current_sequence: ContextVar[Optional[int]] = ContextVar('current_sequence', default=None)
+
+
+class ClientSession:
+    """1つのWebSocket接続の状態
+
+    受信したメッセージには受信順の番号を振り、それぞれ別のタスクで処理する。
+    同時に処理中のメッセージ数は max_inflight までとし、上限に達した場合は
+    いずれかの応答が送信されるまで次のメッセージを読み込まない。
+    ordered の場合は、応答を受信順に並べ替えてから送信する。
+    """
+
+    def __init__(self, websocket, client_id: str, max_inflight: int, ordered: bool = False):
+        self.websocket = websocket
+        self.client_id = client_id
+        self.max_inflight = max(1, max_inflight)
+        self.ordered = ordered
+        # 公平スケジューリングに使用する API キー（session メッセージで設定）
+        self.api_key: Optional[str] = None
+        # 推論の開始を通知する（session メッセージで設定、ゲートウェイが使用）
+        self.notify_start = False
+        # ゲートウェイとして認証された接続（転送元のクライアントごとのキー gw: を受け付ける）
+        self.trusted_gateway = False
+        self._slots = asyncio.Semaphore(self.max_inflight)
+        # 上限を下げた分、解放時に返さない処理枠の数
+        self._withheld = 0
+        self._sequence = itertools.count()
+        self._inflight: Set[int] = set()
+        # 受信順で送信するメッセージと、送信待ちの応答（None は応答なし）
+        self._ordered: Set[int] = set()
+        self._ready: Dict[int, Optional[str]] = {}
+        # 受信順を待たずに送信済みのメッセージ（先頭の番号を進めるために記録）
+        self._sent: Set[int] = set()
+        self._next_to_send = 0
+        # 翻訳ジョブの完了時に応答するメッセージ
+        self._deferred: Set[int] = set()
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def inflight(self) -> int:
+        """応答を送信していないメッセージ数"""
+        return len(self._inflight)
+
+    async def begin(self) -> int:
+        """処理枠を確保してメッセージの番号を取得"""
+        await self._slots.acquire()
+        sequence = next(self._sequence)
+        self._inflight.add(sequence)
+        if self.ordered:
+            self._ordered.add(sequence)
+        return sequence
+
+    def set_max_inflight(self, max_inflight: int):
+        """同時に処理するメッセージ数の上限を変更（下げた場合は処理中のメッセージの完了に合わせて減らす）"""
+        max_inflight = max(1, max_inflight)
+        change = max_inflight - self.max_inflight
+        self.max_inflight = max_inflight
+        if change < 0:
+            self._withheld -= change
+            return
+        # 返さずにいた処理枠から先に打ち消す
+        restored = min(change, self._withheld)
+        self._withheld -= restored
+        for _ in range(change - restored):
+            self._slots.release()
+
+    def spawn(self, coroutine: Awaitable[None]):
+        """メッセージの処理をタスクとして開始"""
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def defer(self, sequence: int):
+        """応答を翻訳ジョブの完了時に送信する"""
+        self._deferred.add(sequence)
+
+    async def finish_message(self, sequence: int):
+        """メッセージの処理タスクの終了（応答せずに終わった場合は処理枠を解放する）"""
+        if sequence in self._inflight and sequence not in self._deferred:
+            await self.deliver(sequence, None)
+
+    async def deliver(self, sequence: int, payload: Optional[str]):
+        """応答を送信（ordered の場合は前のメッセージの応答がすべて送信されるまで待たせる）"""
+        if sequence not in self._inflight or sequence in self._ready:
+            # 1つのメッセージに対する2つ目以降の応答はそのまま送信する
+            if payload is not None:
+                await self._send(payload)
+            return
+
+        self._deferred.discard(sequence)
+        if sequence in self._ordered:
+            self._ready[sequence] = payload
+        else:
+            self._complete(sequence)
+            self._sent.add(sequence)
+            if payload is not None:
+                await self._send(payload)
+
+        # 先頭から、応答が揃った番号を受信順に送信
+        while True:
+            head = self._next_to_send
+            if head in self._ready:
+                ready = self._ready.pop(head)
+                self._complete(head)
+                if ready is not None:
+                    await self._send(ready)
+            elif head in self._sent:
+                self._sent.discard(head)
+            else:
+                break
+            self._next_to_send += 1
+
+    async def notify(self, payload: str):
+        """応答の順序・処理枠に関係なく送信する通知"""
+        await self._send(payload)
+
+    def _complete(self, sequence: int):
+        self._inflight.discard(sequence)
+        self._ordered.discard(sequence)
+        if self._withheld:
+            self._withheld -= 1
+        else:
+            self._slots.release()
+
+    async def _send(self, payload: str):
+        try:
+            await self.websocket.send(payload)
+        except Exception as e:
+            logging.error(f"レスポンス送信エラー ({self.client_id}): {e}")
+
+    def close(self):
+        """処理中のタスクを取り消す"""
+        for task in list(self._tasks):
+            task.cancel()
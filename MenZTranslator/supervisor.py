@@ -0,0 +1,209 @@
+"""
+ワーカー監視モジュール
+ゲートウェイが起動する翻訳サーバーのプロセスの再起動と、推論の停止・クラッシュを起こす入力の隔離
+（ゲートウェイ・翻訳サーバーの両方から使用する。torch等の重いライブラリに依存しない）
+"""
+
+import hashlib
+import json
+import logging
+import subprocess
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+
+# 推論が job_timeout を超えて停止したために終了した翻訳サーバーの終了コード
+EXIT_STALLED = 75
+
+# この秒数以上動作していたプロセスが終了した場合は、再起動までの待ち時間を初期値に戻す
+STABLE_SECONDS = 60
+
+# 推論の結果を決めるリクエストの項目
+_FINGERPRINT_FIELDS = ('source_lang', 'target_lang', 'target_langs', 'max_length', 'decoding')
+
+
+def input_fingerprint(data: Dict[str, Any]) -> str:
+    """翻訳リクエストの入力（原文・言語・max_length・decoding）のハッシュ
+
+    ゲートウェイは受信したリクエストを、翻訳サーバーは転送されたリクエストをそのまま渡すため、
+    同じ入力は両方で同じ値になる。
+    """
+    text = data.get('text')
+    fields = [text.strip() if isinstance(text, str) else text] + [data.get(key) for key in _FINGERPRINT_FIELDS]
+    encoded = json.dumps(fields, ensure_ascii=False, default=str).encode('utf-8')
+    return hashlib.sha1(encoded).hexdigest()[:16]
+
+
+class PoisonQuarantine:
+    """推論の停止・プロセスのクラッシュを起こした入力の隔離
+
+    停止・クラッシュの時点で実行中だった入力を1回ずつ記録し、threshold 回に達した入力は
+    ttl 秒間受け付けない（モデルに渡さずにエラーを返す）。偶然同じ時点で実行中だった
+    入力を隔離しないよう、記録も ttl 秒で失効する。
+    """
+
+    def __init__(self, threshold: int, ttl: float):
+        self.threshold = threshold
+        self.ttl = ttl
+        # ハッシュ → (記録回数, 最後に記録した時刻)
+        self._strikes: Dict[str, Tuple[int, float]] = {}
+        # ハッシュ → 隔離の期限
+        self._quarantined: Dict[str, float] = {}
+        self.stats = {
+            'strikes': 0,
+            'quarantined': 0,
+            'rejected': 0
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def strike(self, fingerprint: Optional[str]) -> bool:
+        """停止・クラッシュ時に実行中だった入力を記録し、隔離した場合は True"""
+        if not self.enabled or fingerprint is None:
+            return False
+        now = time.time()
+        self._expire(now)
+        count = self._strikes.get(fingerprint, (0, now))[0] + 1
+        self._strikes[fingerprint] = (count, now)
+        self.stats['strikes'] += 1
+        if count < self.threshold:
+            return False
+
+        del self._strikes[fingerprint]
+        self._quarantined[fingerprint] = now + self.ttl
+        self.stats['quarantined'] += 1
+        logging.warning(f"推論の停止・クラッシュを{count}回起こした入力を隔離しました ({fingerprint}, {self.ttl:.0f}秒間)")
+        return True
+
+    def is_quarantined(self, fingerprint: Optional[str]) -> bool:
+        """隔離中の入力か（隔離中の場合は拒否した件数に数える）"""
+        if not self._quarantined or fingerprint is None:
+            return False
+        until = self._quarantined.get(fingerprint)
+        if until is None:
+            return False
+        if until <= time.time():
+            del self._quarantined[fingerprint]
+            return False
+        self.stats['rejected'] += 1
+        return True
+
+    def _expire(self, now: float):
+        for fingerprint in [f for f, (_, last) in self._strikes.items() if now - last >= self.ttl]:
+            del self._strikes[fingerprint]
+        for fingerprint in [f for f, until in self._quarantined.items() if until <= now]:
+            del self._quarantined[fingerprint]
+
+    def get_stats(self) -> Dict:
+        return {
+            "threshold": self.threshold,
+            "ttl_seconds": self.ttl,
+            "suspects": len(self._strikes),
+            "active": len(self._quarantined),
+            **self.stats
+        }
+
+
+class WorkerProcess:
+    """ゲートウェイが起動する翻訳サーバーのプロセス
+
+    終了を検出すると、バックオフ（1秒から倍々に backoff_max 秒まで）を挟んで同じコマンドで再起動する。
+    """
+
+    def __init__(self, command: List[str], url: str, backoff_max: float = 30.0):
+        self.command = command
+        self.url = url
+        self.backoff_max = backoff_max
+        self.process: Optional[subprocess.Popen] = None
+        self.started_at: Optional[float] = None
+        # 起動後にゲートウェイから接続できたか（モデルの読み込み中は応答しないため、接続後のみ監視する）
+        self.connected = False
+        # 応答しなくなった時刻
+        self.unresponsive_since: Optional[float] = None
+        self._restart_at: Optional[float] = None
+        self._backoff = 0.0
+        self._killing = False
+        self.stats = {
+            'starts': 0,
+            'crashes': 0,
+            'stalls': 0,
+            'killed': 0,
+            'last_exit_code': None
+        }
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self.process.pid if self.process else None
+
+    @property
+    def running(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        """プロセスを起動"""
+        self.process = subprocess.Popen(self.command)
+        self.started_at = time.time()
+        self.connected = False
+        self.unresponsive_since = None
+        self._restart_at = None
+        self._killing = False
+        self.stats['starts'] += 1
+
+    def check(self) -> Optional[int]:
+        """終了していれば終了コードを返し、再起動を予約する（終了を検出した1回のみ）"""
+        if self.process is None or self._restart_at is not None:
+            return None
+        exit_code = self.process.poll()
+        if exit_code is None:
+            return None
+
+        self.stats['last_exit_code'] = exit_code
+        if self._killing:
+            self.stats['killed'] += 1
+        elif exit_code == EXIT_STALLED:
+            self.stats['stalls'] += 1
+        else:
+            self.stats['crashes'] += 1
+
+        uptime = time.time() - (self.started_at or 0)
+        self._backoff = 1.0 if uptime >= STABLE_SECONDS or not self._backoff else min(self._backoff * 2, self.backoff_max)
+        self._restart_at = time.time() + self._backoff
+        return exit_code
+
+    def restart_due(self) -> bool:
+        """再起動の予定時刻を過ぎたか"""
+        return self._restart_at is not None and time.time() >= self._restart_at
+
+    def kill(self):
+        """応答しないプロセスを強制終了（終了は check で検出して再起動する）"""
+        if self.running:
+            self._killing = True
+            self.process.kill()
+
+    def terminate(self):
+        """プロセスに終了を要求（再起動しない）"""
+        self._restart_at = None
+        if self.process is not None:
+            self.process.terminate()
+
+    def wait(self, timeout: float = 10):
+        """終了を待ち、終わらない場合は強制終了"""
+        if self.process is None:
+            return
+        try:
+            self.process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+    def get_stats(self) -> Dict:
+        return {
+            "url": self.url,
+            "pid": self.pid,
+            "running": self.running,
+            "uptime_seconds": round(time.time() - self.started_at, 1) if self.running and self.started_at else None,
+            "restarts": max(0, self.stats['starts'] - 1),
+            "restart_pending": self._restart_at is not None,
+            **self.stats
+        }
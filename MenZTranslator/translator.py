@@ -4,10 +4,25 @@ NLLB翻訳エンジンモジュール
 
 import torch
 from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
+from transformers.modeling_outputs import BaseModelOutput
 import logging
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Hashable, List, Tuple
+import os
 import time
-import re
+import gc
+import hashlib
+import threading
+
+from .incremental import IncrementalTranslationCache
+from .languages import LANGUAGE_NAMES, LanguageRegistry
+from .markup import ProtectedText
+from .encoder_cache import EncoderOutputCache
+from .budget import MemoryBudget, is_out_of_memory
+from .artifact import LANGUAGES_FILE, artifact_dtype, is_artifact
+from .protocol import DECODING_MODES
+from .vocab import VocabularyMap
+from .triage import InputTriage
+from .offload import ModelOffloader
 
 # 言語検出用のライブラリ（オプション）
 try:
@@ -21,91 +36,59 @@ except ImportError:
 class NLLBTranslator:
     """NLLB翻訳エンジンクラス"""
     
-    def __init__(self, model_name: str = "facebook/nllb-200-distilled-1.3B", device: str = "auto", gpu_id: int = 0, use_fp16: bool = False):
+    def __init__(self, model_name: str = "facebook/nllb-200-distilled-1.3B", device: str = "auto", gpu_id: int = 0, use_fp16: bool = False,
+                 protect_markup: bool = True, num_beams: int = 4, decoding: str = "beam",
+                 assistant_model_name: Optional[str] = None, encoder_cache_mb: int = 0,
+                 static_kv_cache: bool = False, activation_budget_mb: int = 0,
+                 vocabulary_languages: Optional[List[str]] = None, vocabulary_cache_dir: str = "cache/vocab",
+                 triage: bool = True, offload_dir: str = "cache/offload"):
         self.model_name = model_name
         self.gpu_id = gpu_id
         self.use_fp16 = use_fp16
+        self.protect_markup = protect_markup
+        self.num_beams = num_beams
+        # 既定のデコード方式（DECODING_MODES のいずれか）
+        self.decoding = decoding
+        self.assistant_model_name = assistant_model_name
+        self.assistant_model = None
+        self.static_kv_cache = static_kv_cache
+        self._generate_options: Dict[str, Any] = {}
+        self.activation_budget_mb = activation_budget_mb
+        # 語彙削減の対象言語（指定時はデコーダーの出力語彙をこれらの言語のスクリプトに絞る）
+        self.vocabulary_languages = vocabulary_languages or []
+        self.vocabulary_cache_dir = vocabulary_cache_dir
+        self.vocabulary: Optional[VocabularyMap] = None
+        self.budget: Optional[MemoryBudget] = None
+        self.encoder_cache = EncoderOutputCache(encoder_cache_mb * 1024 * 1024) if encoder_cache_mb > 0 else None
         self.device = self._get_device(device)
         self.model = None
         self.tokenizer = None
-        self._initialize_model()
-        
-        # 言語検出マッピング
-        self.lang_detect_to_nllb = {
-            'en': 'eng_Latn',
-            'ja': 'jpn_Jpan', 
-            'zh-cn': 'zho_Hans',
-            'zh-tw': 'zho_Hant',
-            'ko': 'kor_Hang',
-            'fr': 'fra_Latn',
-            'de': 'deu_Latn',
-            'es': 'spa_Latn',
-            'it': 'ita_Latn',
-            'ru': 'rus_Cyrl',
-            'ar': 'arb_Arab',
-            'hi': 'hin_Deva',
-            'th': 'tha_Thai',
-            'vi': 'vie_Latn',
-            'pt': 'por_Latn',
-            'nl': 'nld_Latn',
-            'tr': 'tur_Latn',
-            'pl': 'pol_Latn',
-            'sv': 'swe_Latn',
-            'da': 'dan_Latn',
-            'no': 'nor_Latn',
-            'fi': 'fin_Latn',
-            'he': 'heb_Hebr',
-            'cs': 'ces_Latn',
-            'hu': 'hun_Latn',
-            'ro': 'ron_Latn',
-            'bg': 'bul_Cyrl',
-            'hr': 'hrv_Latn',
-            'sk': 'slk_Latn',
-            'sl': 'slv_Latn',
-            'et': 'est_Latn',
-            'lv': 'lav_Latn',
-            'lt': 'lit_Latn',
-            'uk': 'ukr_Cyrl',
-            'el': 'ell_Grek',
-            'ca': 'cat_Latn',
-            'eu': 'eus_Latn',
-            'gl': 'glg_Latn',
-            'cy': 'cym_Latn',
-            'ga': 'gle_Latn',
-            'mt': 'mlt_Latn',
-            'is': 'isl_Latn',
-            'mk': 'mkd_Cyrl',
-            'sq': 'sqi_Latn',
-            'af': 'afr_Latn',
-            'sw': 'swh_Latn',
-            'zu': 'zul_Latn',
-            'xh': 'xho_Latn',
-            'id': 'ind_Latn',
-            'ms': 'zsm_Latn',
-            'tl': 'tgl_Latn',
-            'bn': 'ben_Beng',
-            'ur': 'urd_Arab',
-            'fa': 'pes_Arab',
-            'ta': 'tam_Taml',
-            'te': 'tel_Telu',
-            'kn': 'kan_Knda',
-            'ml': 'mal_Mlym',
-            'gu': 'guj_Gujr',
-            'pa': 'pan_Guru',
-            'ne': 'npi_Deva',
-            'si': 'sin_Sinh',
-            'my': 'mya_Mymr',
-            'km': 'khm_Khmr',
-            'lo': 'lao_Laoo',
-            'ka': 'kat_Geor',
-            'hy': 'hye_Armn',
-            'az': 'azj_Latn',
-            'kk': 'kaz_Cyrl',
-            'ky': 'kir_Cyrl',
-            'uz': 'uzn_Latn',
-            'tg': 'tgk_Cyrl',
-            'mn': 'khk_Cyrl'
+        self.languages: Optional[LanguageRegistry] = None
+        self.incremental = IncrementalTranslationCache()
+        # 数値・記号・URL・翻訳先言語のテキストなどはモデルを通さずにそのまま返す
+        self.triage = InputTriage(triage)
+        self.markup_stats = {
+            'protected_requests': 0,
+            'tokens_saved': 0
         }
+        self.decoding_stats = {
+            'assisted_requests': 0,
+            'draft_tokens': 0,
+            'accepted_tokens': 0
+        }
+        # アイドル時のモデル退避（offload() で退避し、次の翻訳で自動的に読み戻す）
+        self.offload_dir = offload_dir
+        self.offloaded = False
+        self.last_used = time.time()
+        self._offloaders: List[ModelOffloader] = []
+        self._residency_lock = threading.Lock()
+        self.idle_stats = {
+            'offloads': 0,
+            'rehydrations': 0,
+            'last_offload_at': None,
+            'last_rehydrate_ms': None
+        }
+        self._initialize_model()
     
     def _get_device(self, device_config: str) -> torch.device:
         """デバイスを自動選択または指定"""
@@ -155,27 +138,90 @@ class NLLBTranslator:
         """モデルとトークナイザーを初期化"""
         try:
             logging.info(f"モデルを読み込み中: {self.model_name}")
-            if self.use_fp16:
-                logging.info("FP16（半精度）モードで読み込みます")
             start_time = time.time()
+            # 起動フェーズごとの所要時間（秒）
+            phases: Dict[str, float] = {}
+            phase_start = start_time
             
-            self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
-            self.model = AutoModelForSeq2SeqLM.from_pretrained(self.model_name)
+            def finish_phase(name: str):
+                nonlocal phase_start
+                now = time.time()
+                phases[name] = now - phase_start
+                phase_start = now
             
-            # FP16対応
+            # FP16対応（CUDA GPUでのみ使用し、読み込み時に変換する）
             if self.use_fp16:
                 if torch.cuda.is_available() and str(self.device).startswith('cuda'):
-                    logging.info("FP16（半精度）に変換中...")
-                    self.model = self.model.half()  # FP16に変換
+                    logging.info("FP16（半精度）モードで読み込みます")
                 else:
                     logging.warning("FP16はCUDA GPUでのみサポートされています。FP32を使用します")
                     self.use_fp16 = False
+            dtype = torch.float16 if self.use_fp16 else torch.float32
+            
+            # prepare で作成した成果物（変換済みの重み・高速トークナイザー・言語コード表）
+            prepared = is_artifact(self.model_name)
+            if prepared:
+                prepared_dtype = artifact_dtype(self.model_name)
+                logging.info(f"変換済みの成果物から起動します ({prepared_dtype})")
+                if prepared_dtype is not None and prepared_dtype != dtype:
+                    logging.warning(f"成果物の精度 ({prepared_dtype}) と異なるため、読み込み時に {dtype} に変換します")
+            
+            self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+            finish_phase("トークナイザー")
+            
+            if prepared:
+                self.languages = LanguageRegistry.load(os.path.join(self.model_name, LANGUAGES_FILE))
+            else:
+                self.languages = LanguageRegistry.from_tokenizer(self.tokenizer)
+            finish_phase("言語コード表")
+            
+            # safetensors はmmapされ、low_cpu_mem_usage により初期化済みの重みへのコピーを省略する
+            self.model = AutoModelForSeq2SeqLM.from_pretrained(self.model_name, torch_dtype=dtype, low_cpu_mem_usage=True)
+            finish_phase("重み")
+            
+            # 語彙削減（デバイス転送前に行い、転送するデータ量も減らす）
+            if self.vocabulary_languages:
+                self.vocabulary_languages = [self.languages.resolve(code) or code for code in self.vocabulary_languages]
+                self.vocabulary = VocabularyMap.load_or_build(
+                    self.tokenizer, self.model_name, self.vocabulary_languages, self.vocabulary_cache_dir
+                )
+                self.vocabulary.apply(self.model)
+                logging.info(f"出力語彙を削減しました: {self.vocabulary.original_size} -> {len(self.vocabulary)} "
+                             f"({', '.join(self.vocabulary_languages)})")
+                finish_phase("語彙削減")
             
             self.model.to(self.device)
+            finish_phase("デバイス転送")
+            
+            # 静的KVキャッシュ（事前確保によりステップごとのメモリ確保を削減）
+            if self.static_kv_cache:
+                if getattr(self.model, '_supports_static_cache', False):
+                    self._generate_options['cache_implementation'] = 'static'
+                    logging.info("静的KVキャッシュを使用します")
+                else:
+                    logging.warning(f"{self.model_name} は静的KVキャッシュに対応していません。動的キャッシュを使用します")
+            
+            # 投機的デコード用のドラフトモデル（トークナイザーを共有できるモデルのみ）
+            if self.assistant_model_name and self.assistant_model_name != self.model_name:
+                logging.info(f"ドラフトモデルを読み込み中: {self.assistant_model_name}")
+                self.assistant_model = AutoModelForSeq2SeqLM.from_pretrained(
+                    self.assistant_model_name, torch_dtype=dtype, low_cpu_mem_usage=True
+                )
+                if self.vocabulary is not None:
+                    # 同じトークナイザーを共有するため、同じ対応表で削減する
+                    self.vocabulary.apply(self.assistant_model)
+                self.assistant_model.to(self.device)
+                finish_phase("ドラフトモデル")
+            
+            # 生成時のメモリ予算（モデル読み込み後の空きメモリを基準にする）
+            self.budget = MemoryBudget.for_model(self.model, self.device, self.activation_budget_mb, self.use_fp16)
+            if self.vocabulary is not None:
+                self.budget.vocab_size = len(self.vocabulary)
             
             load_time = time.time() - start_time
             precision = "FP16" if self.use_fp16 else "FP32"
             logging.info(f"モデルの読み込みが完了しました ({load_time:.2f}秒, {precision})")
+            logging.info("  起動フェーズ別の所要時間: " + ", ".join(f"{name} {seconds:.2f}秒" for name, seconds in phases.items()))
             
         except Exception as e:
             logging.error(f"モデルの初期化に失敗しました: {e}")
@@ -185,87 +231,383 @@ class NLLBTranslator:
                   text: str, 
                   source_lang: str = "eng_Latn", 
                   target_lang: str = "jpn_Jpan",
-                  max_length: int = 256) -> str:
-        """テキストを翻訳"""
-        try:
-            if not text.strip():
-                return ""
-            
-            # 言語コードの検証と自動検出
-            if source_lang.lower() == "auto":
-                logging.info("source_lang に 'auto' が指定されました。自動言語検出を実行します")
-                source_lang = self._detect_language(text)
-            
-            if target_lang.lower() == "auto":
-                logging.warning("target_lang に 'auto' が指定されました。デフォルトの 'jpn_Jpan' を使用します")
-                target_lang = "jpn_Jpan"
-            
-            # 有効な言語コードかチェック（NLLBの標準形式: xxx_Xxxx）
-            lang_pattern = r'^[a-z]{3}_[A-Z][a-z]{3}$'
-            if not re.match(lang_pattern, source_lang):
-                logging.warning(f"無効なsource_lang '{source_lang}' が指定されました。デフォルトの 'eng_Latn' を使用します")
-                source_lang = "eng_Latn"
-            
-            if not re.match(lang_pattern, target_lang):
-                logging.warning(f"無効なtarget_lang '{target_lang}' が指定されました。デフォルトの 'jpn_Jpan' を使用します")
-                target_lang = "jpn_Jpan"
-            
-            # トークナイザーの言語設定
-            self.tokenizer.src_lang = source_lang
-            
-            # 入力をトークン化
-            inputs = self.tokenizer(text, return_tensors="pt", padding=True).to(self.device)
-            
-            # FP16対応：入力もFP16に変換
-            if self.use_fp16 and torch.cuda.is_available() and str(self.device).startswith('cuda'):
-                inputs = {k: v.half() if v.dtype == torch.float32 else v for k, v in inputs.items()}
+                  max_length: int = 256,
+                  decoding: Optional[str] = None) -> str:
+        """テキストを翻訳（無効な翻訳先言語は ValueError、推論の失敗はそのまま例外を送出）"""
+        if not text.strip():
+            return ""
+        
+        source_lang, target_lang = self._resolve_languages(text, source_lang, target_lang)
+        return self._generate(text, source_lang, target_lang, max_length, decoding)
+    
+    def translate_incremental(self,
+                              stream_key: Hashable,
+                              text: str,
+                              source_lang: str = "eng_Latn",
+                              target_lang: str = "jpn_Jpan",
+                              max_length: int = 256,
+                              decoding: Optional[str] = None) -> str:
+        """先頭が共通する途中結果テキストを、確定済みの文の翻訳を再利用して翻訳"""
+        if not text.strip():
+            return ""
+        
+        source_lang, target_lang = self._resolve_languages(text, source_lang, target_lang)
+        return self.incremental.translate(
+            lambda segment: self._generate(segment, source_lang, target_lang, max_length, decoding),
+            stream_key,
+            text,
+            source_lang,
+            target_lang
+        )
+    
+    def translate_multi(self,
+                        text: str,
+                        source_lang: str = "eng_Latn",
+                        target_langs: Optional[List[str]] = None,
+                        max_length: int = 256,
+                        decoding: Optional[str] = None) -> Dict[str, str]:
+        """1つのテキストを複数の言語に翻訳（エンコーダーは1回のみ実行）"""
+        target_langs = target_langs or ["jpn_Jpan"]
+        if not text.strip():
+            return {lang: "" for lang in target_langs}
+        
+        source_lang, _ = self._resolve_languages(text, source_lang, target_langs[0])
+        # 検証後の言語コード（重複は除外）→ リクエストされた言語コード
+        resolved: Dict[str, List[str]] = {}
+        for lang in target_langs:
+            resolved.setdefault(self._resolve_target_language(lang), []).append(lang)
+        
+        translations = self._generate_multi(text, source_lang, list(resolved), max_length, decoding)
+        return {
+            requested: translations[lang]
+            for lang, requested_langs in resolved.items()
+            for requested in requested_langs
+        }
+    
+    def _resolve_languages(self, text: str, source_lang: str, target_lang: str) -> Tuple[str, str]:
+        """言語コードの検証と自動検出"""
+        if source_lang.lower() == "auto":
+            logging.info("source_lang に 'auto' が指定されました。自動言語検出を実行します")
+            source_lang = self._detect_language(text)
+        
+        # 有効な言語コードかチェック（ISO-639-1 / BCP-47 / NLLB形式）
+        resolved = self.languages.resolve(source_lang)
+        if resolved is None:
+            logging.warning(f"無効なsource_lang '{source_lang}' が指定されました。デフォルトの 'eng_Latn' を使用します")
+            resolved = "eng_Latn"
+        
+        return resolved, self._resolve_target_language(target_lang)
+    
+    def _resolve_target_language(self, target_lang: str) -> str:
+        """翻訳先言語コードの検証"""
+        if target_lang.lower() == "auto":
+            logging.warning("target_lang に 'auto' が指定されました。デフォルトの 'jpn_Jpan' を使用します")
+            return "jpn_Jpan"
+        
+        resolved = self.languages.resolve(target_lang)
+        if resolved is None:
+            logging.warning(f"無効なtarget_lang '{target_lang}' が指定されました。デフォルトの 'jpn_Jpan' を使用します")
+            return "jpn_Jpan"
+        
+        if self.vocabulary is not None and resolved not in self.vocabulary_languages:
+            raise ValueError(f"翻訳先言語 '{resolved}' は語彙削減の対象外です（対象: {', '.join(self.vocabulary_languages)}）")
+        
+        return resolved
+    
+    def _language_token(self, lang: str) -> int:
+        """翻訳先言語のトークンID（語彙削減時は削減後のID）"""
+        token_id = self.languages.token_id(lang)
+        return self.vocabulary.to_new(token_id) if self.vocabulary is not None else token_id
+    
+    def _restore_token_ids(self, token_ids: torch.Tensor) -> torch.Tensor:
+        """生成されたトークンIDを元の語彙のIDに戻す"""
+        return self.vocabulary.to_old(token_ids) if self.vocabulary is not None else token_ids
+    
+    def _generate(self, text: str, source_lang: str, target_lang: str, max_length: int,
+                  decoding: Optional[str] = None) -> str:
+        """検証済みの言語コードでモデルによる翻訳を実行"""
+        return self._generate_multi(text, source_lang, [target_lang], max_length, decoding)[target_lang]
+    
+    def _generate_multi(self, text: str, source_lang: str, target_langs: List[str], max_length: int,
+                        decoding: Optional[str] = None) -> Dict[str, str]:
+        """マークアップを保護しつつ、1つのテキストを複数の言語に翻訳"""
+        results = {lang: text for lang in target_langs if self.triage.passthrough(text, source_lang, lang)}
+        remaining = [lang for lang in target_langs if lang not in results]
+        if not remaining:
+            return results
+        
+        if self.protect_markup:
+            protected = ProtectedText(text)
+            if protected.has_spans:
+                results.update(self._generate_protected(protected, text, source_lang, remaining, max_length, decoding))
+                return results
+        
+        results.update(self._generate_batch([text], source_lang, remaining, max_length, decoding)[0])
+        return results
+    
+    def _generate_protected(self, protected: ProtectedText, text: str, source_lang: str,
+                            target_langs: List[str], max_length: int, decoding: Optional[str] = None) -> Dict[str, str]:
+        """自然言語部分のみを翻訳し、保護したスパンを元の位置に戻す"""
+        segments = protected.segments
+        rows = self._generate_batch(segments, source_lang, target_langs, max_length, decoding) if segments else []
+        
+        # 短縮できたトークン数を記録
+        self.tokenizer.src_lang = source_lang
+        original_tokens = len(self.tokenizer(text).input_ids)
+        segment_tokens = sum(len(ids) for ids in self.tokenizer(segments).input_ids) if segments else 0
+        self.markup_stats['protected_requests'] += 1
+        self.markup_stats['tokens_saved'] += max(0, original_tokens - segment_tokens)
+        
+        return {
+            lang: protected.restore([row[lang] for row in rows])
+            for lang in target_langs
+        }
+    
+    def _generate_batch(self, texts: List[str], source_lang: str, target_langs: List[str], max_length: int,
+                        decoding: Optional[str] = None) -> List[Dict[str, str]]:
+        """エンコーダー出力を共有し、テキスト×翻訳先言語のデコードを1バッチで実行"""
+        self.last_used = time.time()
+        if self.offloaded:
+            self.rehydrate()
+        
+        if (decoding or self.decoding) == "assisted" and self.assistant_model is not None:
+            return self._generate_assisted(texts, source_lang, target_langs, max_length)
+        
+        # トークナイザーの言語設定
+        self.tokenizer.src_lang = source_lang
+        
+        # 入力をトークン化
+        inputs = self.tokenizer(texts, return_tensors="pt", padding=True).to(self.device)
+        
+        # エンコーダーは1回のみ実行（キャッシュ済みのトークン列は再利用）
+        hidden_states, attention_mask = self._encode(inputs)
+        
+        num_targets = len(target_langs)
+        # テキスト×翻訳先言語の行を、メモリ予算に収まる行数ずつデコード
+        rows = [(i, lang) for i in range(len(texts)) for lang in target_langs]
+        translations: List[str] = []
+        while len(translations) < len(rows):
+            remaining = rows[len(translations):]
+            chunk_rows, chunk_max_length = self.budget.plan(len(remaining), hidden_states.shape[1], self.num_beams, max_length)
+            try:
+                translations.extend(self._decode_rows(hidden_states, attention_mask, remaining[:chunk_rows], chunk_max_length))
+            except Exception as e:
+                # メモリ不足の場合は予算を縮小して再試行
+                if not is_out_of_memory(e) or not self.budget.back_off():
+                    raise
+        
+        return [
+            {lang: translations[i * num_targets + j] for j, lang in enumerate(target_langs)}
+            for i in range(len(texts))
+        ]
+    
+    def _decode_rows(self, hidden_states: torch.Tensor, attention_mask: torch.Tensor,
+                     rows: List[Tuple[int, str]], max_length: int) -> List[str]:
+        """(テキストの位置, 翻訳先言語) の行を1バッチでデコード"""
+        indices = torch.tensor([i for i, _ in rows], device=self.device)
+        # デコーダーの先頭は [decoder_start, 言語トークン]（forced_bos_token_id と同等）
+        decoder_start = self.model.config.decoder_start_token_id
+        decoder_input_ids = torch.tensor(
+            [[decoder_start, self._language_token(lang)] for _, lang in rows],
+            device=self.device
+        )
+        
+        baseline = self.budget.start_batch()
+        with torch.no_grad():
+            # エンコーダー出力を行ごとに展開
+            encoder_outputs = BaseModelOutput(
+                last_hidden_state=hidden_states.index_select(0, indices)
+            )
             
             # 翻訳実行
+            generated_tokens = self.model.generate(
+                encoder_outputs=encoder_outputs,
+                attention_mask=attention_mask.index_select(0, indices),
+                decoder_input_ids=decoder_input_ids,
+                max_length=max_length,
+                num_beams=self.num_beams,
+                early_stopping=True,
+                do_sample=False,
+                **self._generate_options
+            )
+        self.budget.finish_batch(
+            baseline,
+            self.budget.estimate(len(rows), hidden_states.shape[1], self.num_beams, max_length)
+        )
+        
+        # デコード
+        translations = self.tokenizer.batch_decode(
+            self._restore_token_ids(generated_tokens), 
+            skip_special_tokens=True
+        )
+        return [translation.strip() for translation in translations]
+    
+    def _encode(self, inputs) -> Tuple[torch.Tensor, torch.Tensor]:
+        """エンコーダー出力と attention_mask を取得（トークン列が同じ入力はキャッシュから再利用）"""
+        if self.encoder_cache is None:
             with torch.no_grad():
-                generated_tokens = self.model.generate(
-                    **inputs,
-                    forced_bos_token_id=self.tokenizer.convert_tokens_to_ids(target_lang),
-                    max_length=max_length,
-                    num_beams=4,
-                    early_stopping=True,
-                    do_sample=False
-                )
+                hidden_states = self.model.get_encoder()(**inputs).last_hidden_state
+            return hidden_states, inputs["attention_mask"]
+        
+        masks = inputs["attention_mask"].bool()
+        keys = [tuple(ids[mask].tolist()) for ids, mask in zip(inputs["input_ids"], masks)]
+        states = [self.encoder_cache.get(key) for key in keys]
+        
+        missing = [i for i, state in enumerate(states) if state is None]
+        if missing:
+            with torch.no_grad():
+                hidden_states = self.model.get_encoder()(
+                    input_ids=inputs["input_ids"][missing],
+                    attention_mask=inputs["attention_mask"][missing]
+                ).last_hidden_state
+            for row, i in enumerate(missing):
+                # パディングを除いた位置のみを保存
+                states[i] = hidden_states[row][masks[i]]
+                self.encoder_cache.put(keys[i], states[i])
+        
+        # 右側をパディングしてバッチに戻す
+        lengths = [state.shape[0] for state in states]
+        hidden_states = states[0].new_zeros((len(states), max(lengths), states[0].shape[-1]))
+        attention_mask = torch.zeros((len(states), max(lengths)), dtype=inputs["attention_mask"].dtype, device=self.device)
+        for i, (state, length) in enumerate(zip(states, lengths)):
+            hidden_states[i, :length] = state
+            attention_mask[i, :length] = 1
+        return hidden_states, attention_mask
+    
+    def _generate_assisted(self, texts: List[str], source_lang: str, target_langs: List[str], max_length: int) -> List[Dict[str, str]]:
+        """ドラフトモデルが提案したトークンをメインモデルで検証しながら翻訳（1件ずつ貪欲法で実行）"""
+        self.tokenizer.src_lang = source_lang
+        
+        # デコーダーの呼び出し回数から受理率を算出する
+        # メインモデル1回の検証で「受理されたドラフトトークン + 1」トークンが確定する
+        calls = {'main': 0, 'draft': 0}
+        
+        def counter(name):
+            def hook(*_):
+                calls[name] += 1
+            return hook
+        
+        hooks = [
+            self.model.get_decoder().register_forward_hook(counter('main')),
+            self.assistant_model.get_decoder().register_forward_hook(counter('draft'))
+        ]
+        
+        rows = []
+        try:
+            for text in texts:
+                inputs = self.tokenizer(text, return_tensors="pt").to(self.device)
+                _, text_max_length = self.budget.plan(1, inputs["input_ids"].shape[1], 1, max_length)
+                row = {}
+                for lang in target_langs:
+                    calls['main'] = calls['draft'] = 0
+                    with torch.no_grad():
+                        generated_tokens = self.model.generate(
+                            **inputs,
+                            assistant_model=self.assistant_model,
+                            forced_bos_token_id=self._language_token(lang),
+                            max_length=text_max_length,
+                            num_beams=1,
+                            do_sample=False
+                        )
+                    # 先頭の decoder_start と言語トークンを除いた生成トークン数
+                    new_tokens = max(0, generated_tokens.shape[1] - 2)
+                    self.decoding_stats['assisted_requests'] += 1
+                    self.decoding_stats['draft_tokens'] += calls['draft']
+                    self.decoding_stats['accepted_tokens'] += max(0, new_tokens - calls['main'])
+                    row[lang] = self.tokenizer.decode(self._restore_token_ids(generated_tokens[0]), skip_special_tokens=True).strip()
+                rows.append(row)
+        finally:
+            for hook in hooks:
+                hook.remove()
+        
+        return rows
+    
+    @property
+    def acceptance_rate(self) -> Optional[float]:
+        """ドラフトトークンの受理率"""
+        drafted = self.decoding_stats['draft_tokens']
+        return round(self.decoding_stats['accepted_tokens'] / drafted, 3) if drafted else None
+    
+    def get_supported_languages(self) -> Dict[str, str]:
+        """サポートされている言語コードを取得（表示名 → NLLBコード）"""
+        return {LANGUAGE_NAMES.get(code, code): code for code in self.languages.codes}
+    
+    def is_ready(self) -> bool:
+        """翻訳エンジンが準備完了かチェック"""
+        return self.model is not None and self.tokenizer is not None 
+    
+    @property
+    def memory_bytes(self) -> int:
+        """モデルの重みが使用するメモリ量（推定）"""
+        if self.model is None:
+            return 0
+        models = [self.model] + ([self.assistant_model] if self.assistant_model is not None else [])
+        return sum(p.numel() * p.element_size() for model in models for p in model.parameters())
+    
+    def offload(self):
+        """モデルの重みをディスクに退避してメモリを解放（トークナイザー等は残す）"""
+        with self._residency_lock:
+            if self.offloaded or self.model is None:
+                return
+            start_time = time.time()
+            if not self._offloaders:
+                # ファイル名のプロセスIDで、サーバーの起動時に以前のプロセスが残したファイルを判別する
+                prefix = f"{hashlib.sha1(self.model_name.encode('utf-8')).hexdigest()[:12]}_{os.getpid()}"
+                models = [('model', self.model)] + ([('assistant', self.assistant_model)] if self.assistant_model else [])
+                self._offloaders = [
+                    ModelOffloader(model, os.path.join(self.offload_dir, f"{prefix}_{role}.safetensors"))
+                    for role, model in models
+                ]
             
-            # デコード
-            translation = self.tokenizer.batch_decode(
-                generated_tokens, 
-                skip_special_tokens=True
-            )[0]
+            freed = self.memory_bytes
+            for offloader in self._offloaders:
+                offloader.offload()
+            if self.encoder_cache is not None:
+                self.encoder_cache.clear()
+            gc.collect()
+            if torch.cuda.is_available() and str(self.device).startswith('cuda'):
+                torch.cuda.empty_cache()
             
-            return translation.strip()
+            self.offloaded = True
+            self.idle_stats['offloads'] += 1
+            self.idle_stats['last_offload_at'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+            logging.info(f"アイドルのためモデルを退避しました: {self.model_name} "
+                         f"({freed / 1024 / 1024:.0f}MB, {time.time() - start_time:.2f}秒)")
+    
+    def rehydrate(self):
+        """退避したモデルの重みを読み戻す"""
+        with self._residency_lock:
+            if not self.offloaded:
+                return
+            start_time = time.time()
+            for offloader in self._offloaders:
+                offloader.restore(self.device)
+            self.offloaded = False
             
-        except Exception as e:
-            logging.error(f"翻訳エラー: {e}")
-            return f"翻訳エラー: {str(e)}"
+            elapsed_ms = round((time.time() - start_time) * 1000, 1)
+            self.idle_stats['rehydrations'] += 1
+            self.idle_stats['last_rehydrate_ms'] = elapsed_ms
+            logging.info(f"退避したモデルを読み戻しました: {self.model_name} ({elapsed_ms / 1000:.2f}秒)")
     
-    def get_supported_languages(self) -> Dict[str, str]:
-        """サポートされている言語コードを取得"""
-        # 主要な言語コードのマッピング
+    def get_idle_stats(self) -> Dict:
         return {
-            "日本語": "jpn_Jpan",
-            "英語": "eng_Latn", 
-            "中国語（簡体字）": "zho_Hans",
-            "中国語（繁体字）": "zho_Hant",
-            "韓国語": "kor_Hang",
-            "フランス語": "fra_Latn",
-            "ドイツ語": "deu_Latn",
-            "スペイン語": "spa_Latn",
-            "イタリア語": "ita_Latn",
-            "ロシア語": "rus_Cyrl",
-            "アラビア語": "arb_Arab",
-            "ヒンディー語": "hin_Deva",
-            "タイ語": "tha_Thai",
-            "ベトナム語": "vie_Latn"
+            "state": "offloaded" if self.offloaded else "resident",
+            "idle_seconds": round(time.time() - self.last_used, 1),
+            **self.idle_stats
         }
     
-    def is_ready(self) -> bool:
-        """翻訳エンジンが準備完了かチェック"""
-        return self.model is not None and self.tokenizer is not None 
+    def release(self):
+        """モデルを解放"""
+        for offloader in self._offloaders:
+            offloader.cleanup()
+        self._offloaders = []
+        self.model = None
+        self.assistant_model = None
+        if self.encoder_cache is not None:
+            self.encoder_cache.clear()
+        gc.collect()
+        if torch.cuda.is_available() and str(self.device).startswith('cuda'):
+            torch.cuda.empty_cache()
 
     def _detect_language(self, text: str) -> str:
         """テキストの言語を自動検出してNLLB言語コードを返す"""
@@ -278,7 +620,7 @@ class NLLBTranslator:
             logging.info(f"検出された言語: {detected_lang}")
             
             # NLLBコードに変換
-            nllb_code = self.lang_detect_to_nllb.get(detected_lang, 'eng_Latn')
+            nllb_code = self.languages.resolve(detected_lang) or 'eng_Latn'
             logging.info(f"NLLBコード変換: {detected_lang} → {nllb_code}")
             
             return nllb_code
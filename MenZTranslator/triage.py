@@ -0,0 +1,97 @@
+"""
+入力振り分けモジュール
+数値・記号・絵文字・URL・翻訳先言語で書かれたテキストなど、モデルに渡す必要のない入力を判定する
+"""
+
+import re
+import unicodedata
+from typing import Dict, Optional
+
+
+# 単独のURL・メールアドレス
+_URL_PATTERN = re.compile(r'^(?:https?://|www\.)\S+$|^[\w.+-]+@[\w-]+(?:\.[\w-]+)+$', re.IGNORECASE)
+
+# 文字種だけで言語が決まる翻訳先言語 → (その言語の文字の Unicode 名に含まれる語, 1文字以上必要な語)
+# ラテン文字・漢字のみのテキストは言語を特定できないため対象外
+_SCRIPT_LANGUAGES = {
+    'jpn_Jpan': (('CJK', 'HIRAGANA', 'KATAKANA', 'IDEOGRAPHIC'), ('HIRAGANA', 'KATAKANA')),
+    'kor_Hang': (('HANGUL',), ('HANGUL',)),
+    'tha_Thai': (('THAI',), ('THAI',)),
+    'ell_Grek': (('GREEK',), ('GREEK',)),
+    'heb_Hebr': (('HEBREW',), ('HEBREW',)),
+    'kat_Geor': (('GEORGIAN',), ('GEORGIAN',)),
+    'hye_Armn': (('ARMENIAN',), ('ARMENIAN',))
+}
+
+CATEGORIES = ('numeric', 'punctuation', 'emoji', 'url', 'same_language')
+
+
+def _is_letter(ch: str) -> bool:
+    return unicodedata.category(ch).startswith('L')
+
+
+def _written_in(text: str, target_lang: str) -> bool:
+    """テキストの文字がすべて翻訳先言語の文字種か"""
+    if target_lang not in _SCRIPT_LANGUAGES:
+        return False
+    words, required = _SCRIPT_LANGUAGES[target_lang]
+    found = False
+    for ch in text:
+        if not _is_letter(ch):
+            continue
+        name = unicodedata.name(ch, '')
+        if not any(word in name for word in words):
+            return False
+        found = found or any(word in name for word in required)
+    return found
+
+
+def classify(text: str, source_lang: str, target_lang: str) -> Optional[str]:
+    """モデルを通さずにそのまま返せる入力の分類（翻訳が必要な場合は None）"""
+    stripped = text.strip()
+    if _URL_PATTERN.match(stripped):
+        return 'url'
+
+    if not any(_is_letter(ch) for ch in stripped):
+        if any(unicodedata.category(ch) == 'Nd' for ch in stripped):
+            # 数値・時刻・日付など
+            return 'numeric'
+        if any(unicodedata.category(ch) == 'So' for ch in stripped):
+            return 'emoji'
+        return 'punctuation'
+
+    if source_lang == target_lang or _written_in(stripped, target_lang):
+        return 'same_language'
+    return None
+
+
+class InputTriage:
+    """翻訳前の入力振り分けと分類ごとの件数"""
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.stats = {'checked': 0, **{category: 0 for category in CATEGORIES}}
+
+    def passthrough(self, text: str, source_lang: str, target_lang: str) -> Optional[str]:
+        """そのまま返せる入力の場合は分類を返す"""
+        if not self.enabled:
+            return None
+        self.stats['checked'] += 1
+        category = classify(text, source_lang, target_lang)
+        if category is not None:
+            self.stats[category] += 1
+        return category
+
+    def get_stats(self) -> Dict:
+        return triage_stats(self.stats, self.enabled)
+
+
+def triage_stats(stats: Dict[str, int], enabled: bool) -> Dict:
+    """分類ごとの件数に、そのまま返した件数と割合を加える（複数モデルの合計にも使用）"""
+    passed = sum(stats.get(category, 0) for category in CATEGORIES)
+    return {
+        "enabled": enabled,
+        "passthrough": passed,
+        "passthrough_rate": round(passed / stats['checked'], 3) if stats.get('checked') else None,
+        **stats
+    }
@@ -0,0 +1,150 @@
+"""
+語彙削減モジュール
+翻訳先の言語が限られる環境向けに、デコーダーの出力語彙を対象スクリプトのトークンのみに絞る
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import torch
+from torch import nn
+
+
+# NLLBのスクリプトコード → そのスクリプトの文字の Unicode 名に含まれる語
+SCRIPT_NAMES = {
+    'Latn': ('LATIN',),
+    'Jpan': ('CJK', 'HIRAGANA', 'KATAKANA', 'IDEOGRAPHIC'),
+    'Hans': ('CJK', 'IDEOGRAPHIC'),
+    'Hant': ('CJK', 'IDEOGRAPHIC'),
+    'Hang': ('HANGUL',),
+    'Cyrl': ('CYRILLIC',),
+    'Grek': ('GREEK',),
+    'Arab': ('ARABIC',),
+    'Hebr': ('HEBREW',),
+    'Thai': ('THAI',),
+    'Deva': ('DEVANAGARI',),
+    'Beng': ('BENGALI',),
+    'Taml': ('TAMIL',),
+    'Geor': ('GEORGIAN',),
+    'Armn': ('ARMENIAN',),
+    'Ethi': ('ETHIOPIC',),
+    'Khmr': ('KHMER',),
+    'Laoo': ('LAO',),
+    'Mymr': ('MYANMAR',)
+}
+
+# SentencePiece の単語境界記号
+_WORD_BOUNDARY = '▁'
+
+
+def _char_allowed(ch: str, words: Sequence[str]) -> bool:
+    """文字（文字種が文字以外のものは常に許可）が対象スクリプトに含まれるか"""
+    if not unicodedata.category(ch).startswith('L'):
+        return True
+    name = unicodedata.name(ch, '')
+    return any(word in name for word in words)
+
+
+class VocabularyMap:
+    """削減後の語彙と元の語彙のトークンIDの対応"""
+
+    def __init__(self, keep_ids: Sequence[int], original_size: int):
+        # 削減後のID → 元のID（昇順のため特殊トークンなどの小さいIDはそのまま）
+        self.keep_ids = list(keep_ids)
+        self.original_size = original_size
+        self._to_new = {old: new for new, old in enumerate(self.keep_ids)}
+        self._to_old = torch.tensor(self.keep_ids, dtype=torch.long)
+
+    def __len__(self) -> int:
+        return len(self.keep_ids)
+
+    def to_new(self, token_id: int) -> int:
+        """元のIDを削減後のIDに変換"""
+        return self._to_new[token_id]
+
+    def to_old(self, token_ids: torch.Tensor) -> torch.Tensor:
+        """削減後のIDのテンソルを元のIDに戻す"""
+        return self._to_old.to(token_ids.device)[token_ids]
+
+    @classmethod
+    def build(cls, tokenizer, language_codes: Iterable[str]) -> "VocabularyMap":
+        """対象言語のスクリプトの文字のみで構成されるトークンと特殊トークンを残す"""
+        words: List[str] = []
+        for code in language_codes:
+            script = code.split('_')[-1]
+            if script not in SCRIPT_NAMES:
+                raise ValueError(f"語彙削減に対応していないスクリプトです: {code}")
+            words.extend(SCRIPT_NAMES[script])
+
+        keep = set(tokenizer.all_special_ids)
+        tokens = tokenizer.convert_ids_to_tokens(list(range(len(tokenizer))))
+        for token_id, token in enumerate(tokens):
+            if token is None:
+                continue
+            text = token.replace(_WORD_BOUNDARY, '')
+            if all(_char_allowed(ch, words) for ch in text):
+                keep.add(token_id)
+        return cls(sorted(keep), len(tokenizer))
+
+    @classmethod
+    def load_or_build(cls, tokenizer, model_name: str, language_codes: Sequence[str], cache_dir: str) -> "VocabularyMap":
+        """ディスクにキャッシュした対応表を読み込む（ない場合は作成して保存）"""
+        languages = sorted(language_codes)
+        digest = hashlib.sha1(f"{model_name}|{len(tokenizer)}|{','.join(languages)}".encode('utf-8')).hexdigest()[:16]
+        cache_file = os.path.join(cache_dir, f"vocab_{digest}.json")
+
+        if os.path.exists(cache_file):
+            with open(cache_file, encoding='utf-8') as f:
+                data = json.load(f)
+            logging.info(f"語彙削減の対応表を読み込みました: {cache_file}")
+            return cls(data["keep_ids"], data["original_size"])
+
+        start_time = time.time()
+        vocabulary = cls.build(tokenizer, languages)
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_file, 'w', encoding='utf-8') as f:
+            json.dump({
+                "model": model_name,
+                "languages": languages,
+                "original_size": vocabulary.original_size,
+                "keep_ids": vocabulary.keep_ids
+            }, f)
+        logging.info(f"語彙削減の対応表を作成しました ({time.time() - start_time:.2f}秒): {cache_file}")
+        return vocabulary
+
+    def apply(self, model):
+        """デコーダーの入力埋め込みと出力層を削減後の語彙に置き換える（エンコーダーは元の語彙のまま）"""
+        index = torch.tensor(self.keep_ids, dtype=torch.long, device=model.lm_head.weight.device)
+        with torch.no_grad():
+            # 共有埋め込みとは別のモジュールにして、デコーダー側のみ削減する
+            embeddings = model.get_decoder().embed_tokens
+            options = {'embed_scale': embeddings.embed_scale} if hasattr(embeddings, 'embed_scale') else {}
+            padding_idx = self.to_new(embeddings.padding_idx) if embeddings.padding_idx is not None else None
+            decoder_embeddings = type(embeddings)(len(self), embeddings.embedding_dim, padding_idx, **options)
+            decoder_embeddings.weight = nn.Parameter(embeddings.weight.index_select(0, index).clone())
+            model.get_decoder().embed_tokens = decoder_embeddings
+
+            lm_head = nn.Linear(model.lm_head.in_features, len(self), bias=False)
+            lm_head.weight = nn.Parameter(model.lm_head.weight.index_select(0, index).clone())
+            model.lm_head = lm_head
+        model.config.tie_word_embeddings = False
+
+        # 生成設定の特殊トークンIDを変換
+        for config in (model.config, model.generation_config):
+            for name in ('decoder_start_token_id', 'bos_token_id', 'eos_token_id', 'pad_token_id', 'forced_eos_token_id'):
+                token_id = getattr(config, name, None)
+                if isinstance(token_id, int):
+                    setattr(config, name, self.to_new(token_id))
+
+    def get_stats(self, language_codes: Optional[Sequence[str]] = None) -> Dict:
+        return {
+            "size": len(self),
+            "original_size": self.original_size,
+            "ratio": round(len(self) / self.original_size, 3),
+            **({"languages": list(language_codes)} if language_codes else {})
+        }
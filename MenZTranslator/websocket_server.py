@@ -6,14 +6,61 @@ import asyncio
 import websockets
 import json
 import logging
+import os
 import uuid
 import sys
-from typing import Dict, Set, Optional, Any
+from typing import TYPE_CHECKING, Dict, Hashable, List, Set, Optional, Any
 import time
 from websockets.exceptions import ConnectionClosed
 
-from .translator import NLLBTranslator
 from .config import Config
+from .protocol import DECODING_MODES, GATEWAY_KEY_PREFIX, encode, error_response, is_admin, is_cancel_message
+from .dispatcher import TranslationDispatcher, TranslationJob
+from .markup import restore_sentinels
+from .memory import TranslationMemory
+from .result_cache import TranslationResultCache
+from .router import ModelPool, ModelRouter, RoutingRule
+from .logutil import TextLogSampler
+from .capture import CAPTURED_TYPES, TrafficRecorder
+from .profiling import ProfileSession
+from .supervisor import EXIT_STALLED, PoisonQuarantine, input_fingerprint
+from .session import ClientSession, current_sequence
+from .triage import triage_stats
+
+if TYPE_CHECKING:
+    from .translator import NLLBTranslator
+
+
+def _sum_stats(stats_list: List[Dict[str, int]]) -> Dict[str, int]:
+    """読み込み済みの各モデルの件数を合計"""
+    total: Dict[str, int] = {}
+    for stats in stats_list:
+        for key, value in stats.items():
+            total[key] = total.get(key, 0) + value
+    return total
+
+
+def _sweep_offload_dir(path: str) -> int:
+    """以前のプロセスが残した退避ファイルを削除し、削除した数を返す
+
+    退避ファイルはポートごとのディレクトリに <モデルのハッシュ>_<プロセスID>_<役割>.safetensors で
+    書き出されるため、ポートを確保した後は自プロセス以外のファイルはすべて終了したプロセスのものになる。
+    """
+    try:
+        names = os.listdir(path)
+    except FileNotFoundError:
+        return 0
+    own = f"_{os.getpid()}_"
+    removed = 0
+    for name in names:
+        if not name.endswith('.safetensors') or own in name:
+            continue
+        try:
+            os.remove(os.path.join(path, name))
+            removed += 1
+        except OSError as e:
+            logging.warning(f"退避ファイルを削除できませんでした ({name}): {e}")
+    return removed
 
 
 class TranslationWebSocketServer:
@@ -22,9 +69,44 @@ class TranslationWebSocketServer:
     def __init__(self, config: Config):
         self.config = config
         self.translator = None
+        self.dispatcher = None
+        self.router: Optional[ModelRouter] = None
+        self.memory: Optional[TranslationMemory] = None
+        self.result_cache: Optional[TranslationResultCache] = None
+        # 待機中の事前翻訳ジョブ（キャッシュのキー → ジョブ）
+        self.prefetching: Dict[Hashable, TranslationJob] = {}
+        self.prefetch_stats = {
+            'requested': 0,
+            'queued': 0,
+            'already_cached': 0,
+            'dropped': 0,
+            'completed': 0,
+            'cancelled': 0
+        }
         self.connected_clients: Set[websockets.WebSocketServerProtocol] = set()
+        self.sessions: Dict[Any, ClientSession] = {}
         self.active_requests: Dict[str, Dict] = {}
         self.server = None
+        self.text_log = TextLogSampler.from_config(config)
+        # 翻訳リクエストの到着パターンの記録（設定で有効な場合のみ）
+        self.capture = TrafficRecorder.from_config(config)
+        self._reload_lock = asyncio.Lock()
+        self.reload_stats = {
+            'reloads': 0,
+            'failures': 0,
+            'last_reload_at': None,
+            'last_duration_ms': None
+        }
+        # 推論を停止させた入力の隔離
+        self.quarantine = PoisonQuarantine(config.quarantine_after, config.quarantine_ttl)
+        # 推論の停止によりプロセスを終了する場合の終了コード（main.py が参照する）
+        self.exit_code: Optional[int] = None
+        self._stop_event: Optional[asyncio.Event] = None
+        self._profile_lock = asyncio.Lock()
+        self.profile_stats = {
+            'profiles': 0,
+            'last_output_dir': None
+        }
         self._initialize_components()
     
     def _initialize_components(self):
@@ -32,11 +114,32 @@ class TranslationWebSocketServer:
         try:
             # 翻訳エンジン初期化
             logging.info("翻訳エンジンを初期化中...")
-            self.translator = NLLBTranslator(
-                model_name=self.config.model_name,
-                device=self.config.device,
-                gpu_id=self.config.gpu_id,
-                use_fp16=self.config.use_fp16
+            self.translator, self.router = self._create_engine(self.config)
+            
+            # 翻訳メモリ・用語集（設定で有効な場合のみ）
+            self.memory = TranslationMemory.from_config(self.config, self.translator.languages)
+            
+            # 翻訳結果キャッシュ（prefetch で事前に登録できる）
+            if self.config.result_cache_entries > 0:
+                self.result_cache = TranslationResultCache(self.config.result_cache_entries)
+            
+            # ディスパッチャー初期化（ワーカーはサーバー起動時に開始）
+            clients = self.config.scheduling_clients
+            # 公平スケジューリングで個別に扱う API キー（登録済みのキーのみ）
+            self.scheduling_keys = frozenset(clients)
+            self.dispatcher = TranslationDispatcher(
+                self.translator,
+                self.handle_job_finished,
+                router=self.router,
+                quantum=self.config.scheduling_quantum,
+                weights={api_key: weight for api_key, (_, weight) in clients.items()},
+                default_weight=self.config.scheduling_default_weight,
+                names={api_key: name for api_key, (name, _) in clients.items()},
+                idle_timeout=self.config.idle_timeout,
+                idle_check_interval=self.config.idle_check_interval,
+                job_timeout=self.config.watchdog_job_timeout,
+                on_started=self.handle_job_started,
+                on_stalled=self.handle_job_stalled
             )
             
             logging.info("サーバーコンポーネントの初期化が完了しました")
@@ -45,9 +148,145 @@ class TranslationWebSocketServer:
             logging.error(f"コンポーネント初期化エラー: {e}")
             raise
     
+    def _create_engine(self, config: Config):
+        """設定に従って (既定の翻訳エンジン, モデルルーター) を生成（ルーティング無効の場合はルーターなし）"""
+        if not config.routing_enabled:
+            return self._create_translator(config.model_name, config), None
+        
+        # 言語ペア・入力長に応じて複数のモデルを使い分ける（既定モデルは常駐）
+        pool = ModelPool(lambda model_name: self._create_translator(model_name, config),
+                         config.routing_memory_budget_mb, pinned=config.model_name)
+        translator = pool.get(config.model_name)
+        router = ModelRouter(
+            [RoutingRule.parse(name, value) for name, value in config.routing_rules],
+            pool,
+            config.model_name,
+            short_max_chars=config.routing_short_max_chars,
+            long_min_chars=config.routing_long_min_chars
+        )
+        return translator, router
+    
+    def _create_translator(self, model_name: str, config: Config) -> "NLLBTranslator":
+        """設定に従って翻訳エンジンを生成"""
+        # torch / transformers の読み込みはモデルが必要になるまで遅延する
+        from .translator import NLLBTranslator
+        
+        return NLLBTranslator(
+            model_name=model_name,
+            device=config.device,
+            gpu_id=config.gpu_id,
+            use_fp16=config.use_fp16,
+            protect_markup=config.protect_markup,
+            num_beams=config.num_beams,
+            decoding=config.decoding,
+            assistant_model_name=config.assistant_model,
+            encoder_cache_mb=config.encoder_cache_mb,
+            static_kv_cache=config.static_kv_cache,
+            activation_budget_mb=config.activation_budget_mb,
+            vocabulary_languages=config.vocabulary_languages if config.vocabulary_prune else None,
+            vocabulary_cache_dir=config.vocabulary_cache_dir,
+            triage=config.triage,
+            offload_dir=self._offload_dir(config)
+        )
+    
+    @staticmethod
+    def _offload_dir(config: Config) -> str:
+        """退避ファイルの保存先（同じホストの翻訳サーバーで衝突しないようポートごとに分ける）"""
+        return os.path.join(config.idle_offload_dir, str(config.server_port))
+    
+    def _prepare_engine(self, config: Config):
+        """新しい翻訳エンジンを読み込んでウォームアップ（リロード時に別スレッドで実行）"""
+        translator, router = self._create_engine(config)
+        try:
+            # 最初のリクエストで発生する初期化（カーネルの選択・メモリ確保など）を済ませておく
+            targets = [lang for lang in translator.vocabulary_languages if lang != 'eng_Latn'] or ['jpn_Jpan']
+            start_time = time.time()
+            translator.translate("Hello, this is a warm-up request.", "eng_Latn", targets[0], 32)
+            logging.info(f"リロード: ウォームアップが完了しました ({time.time() - start_time:.2f}秒)")
+        except Exception:
+            self._release_engine(translator, router)
+            raise
+        return translator, router
+    
+    @staticmethod
+    def _release_engine(translator, router):
+        """翻訳エンジン（ルーティング時はプール内のすべてのモデル）を解放"""
+        for loaded in (router.pool.translators if router else [translator]):
+            loaded.release()
+    
+    async def reload(self) -> Dict:
+        """設定ファイルを再読み込みし、接続を維持したまま翻訳エンジンを入れ替える
+
+        新しいエンジンは別スレッドで読み込み・ウォームアップし、ディスパッチャーを切り替えた後、
+        旧エンジンで実行中のジョブの完了を待ってから解放する。失敗した場合は旧エンジンのまま処理を続ける。
+        """
+        if self._reload_lock.locked():
+            raise RuntimeError("リロードを実行中です")
+        
+        async with self._reload_lock:
+            start_time = time.time()
+            loop = asyncio.get_running_loop()
+            try:
+                config = self.config.reloaded()
+                if (config.server_host, config.server_port) != (self.config.server_host, self.config.server_port):
+                    logging.warning("リロード: host / port の変更はサーバーの再起動後に反映されます")
+                logging.info(f"リロード: 新しい翻訳エンジンを読み込み中 ({config.model_name})")
+                translator, router = await loop.run_in_executor(None, self._prepare_engine, config)
+                memory = await loop.run_in_executor(None, TranslationMemory.from_config, config, translator.languages)
+            except Exception as e:
+                self.reload_stats['failures'] += 1
+                logging.error(f"リロードに失敗しました。現在の翻訳エンジンで処理を続けます: {e}")
+                raise
+            
+            # 次のジョブから新しいエンジンを使用（実行中のジョブは旧エンジンで完了する）
+            old_translator, old_router = await self.dispatcher.swap_translator(translator, router)
+            old_memory = self.memory
+            self.config, self.translator, self.router, self.memory = config, translator, router, memory
+            # 旧モデルの翻訳結果は破棄する
+            entries = config.result_cache_entries
+            self.result_cache = TranslationResultCache(entries) if entries > 0 else None
+            
+            await loop.run_in_executor(None, self._release_engine, old_translator, old_router)
+            if old_memory:
+                old_memory.close()
+            
+            duration_ms = round((time.time() - start_time) * 1000, 1)
+            self.reload_stats['reloads'] += 1
+            self.reload_stats['last_reload_at'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+            self.reload_stats['last_duration_ms'] = duration_ms
+            logging.info(f"リロードが完了しました: {old_translator.model_name} -> {translator.model_name} ({duration_ms / 1000:.2f}秒)")
+            return {
+                "model": translator.model_name,
+                "previous_model": old_translator.model_name,
+                "duration_ms": duration_ms
+            }
+    
+    async def profile(self, duration: Optional[float] = None, torch_trace: Optional[bool] = None) -> Dict:
+        """指定時間だけ推論・イベントループを計測し、結果を [PROFILING] output_dir に保存する"""
+        if self._profile_lock.locked():
+            raise RuntimeError("プロファイルを実行中です")
+        
+        async with self._profile_lock:
+            if duration is None:
+                duration = self.config.profiling_default_duration
+            duration = min(duration, self.config.profiling_max_duration)
+            session = ProfileSession(
+                self.config.profiling_output_dir,
+                self.config.profiling_sample_interval_ms / 1000,
+                self.config.profiling_torch_trace if torch_trace is None else torch_trace
+            )
+            result = await session.run(duration, self.dispatcher.run_in_worker if self.dispatcher else None)
+            self.profile_stats['profiles'] += 1
+            self.profile_stats['last_output_dir'] = result['output_dir']
+            return result
+    
     async def start_server(self, stop_event: asyncio.Event):
         """サーバーを開始"""
+        self._stop_event = stop_event
         try:
+            # 翻訳ワーカー起動
+            self.dispatcher.start()
+            
             # サーバー起動
             self.server = await websockets.serve(
                 lambda websocket: self.handle_client(websocket, stop_event),
@@ -60,6 +299,11 @@ class TranslationWebSocketServer:
             
             logging.info(f"WebSocketサーバーが起動しました: ws://{self.config.server_host}:{self.config.server_port}")
             
+            # ポートを確保できたため、同じポートで動いていたプロセスの退避ファイルは不要になっている
+            removed = _sweep_offload_dir(self._offload_dir(self.config))
+            if removed:
+                logging.info(f"以前のプロセスが残した退避ファイルを削除しました: {removed}個")
+            
             # 停止イベントを待機
             await stop_event.wait()
             
@@ -81,6 +325,10 @@ class TranslationWebSocketServer:
             client_info = f"{websocket.remote_address[0]}:{websocket.remote_address[1]}"
             logging.info(f"クライアント接続: {client_id} ({client_info})")
             
+            # アイドル時に退避したモデルは最初のリクエストを待たずに読み戻す
+            if self.dispatcher:
+                self.dispatcher.wake()
+            
             # 接続情報を送信
             await self.send_response(websocket, {
                 "type": "connection",
@@ -92,9 +340,19 @@ class TranslationWebSocketServer:
                 }
             })
             
-            # メッセージ処理ループ
+            # メッセージ処理ループ（メッセージごとに別タスクで処理し、同時処理数の上限で受信を待たせる）
+            session = ClientSession(websocket, client_id, self.config.max_inflight_per_connection,
+                                    ordered=self.config.ordered_delivery)
+            self.sessions[websocket] = session
             async for message in websocket:
-                await self.handle_message(websocket, message, client_id)
+                if is_cancel_message(message):
+                    # 取り消しは処理枠の空きを待たずに処理する（処理枠が埋まるまで転送するゲートウェイからも届くように）
+                    # 先に受信したメッセージのタスクを一巡させ、取り消し対象のジョブを投入させてから処理する
+                    await asyncio.sleep(0)
+                    await self.handle_message(websocket, message, client_id)
+                    continue
+                sequence = await session.begin()
+                session.spawn(self._run_message(session, message, sequence))
                 
         except ConnectionClosed:
             logging.info(f"クライアント切断: {client_id}")
@@ -102,17 +360,33 @@ class TranslationWebSocketServer:
             logging.error(f"クライアント処理エラー ({client_id}): {e}")
         finally:
             self.connected_clients.discard(websocket)
+            session = self.sessions.pop(websocket, None)
+            if session:
+                session.close()
+            # このクライアントのキュー内ジョブを取り消し
+            if self.dispatcher:
+                await self.dispatcher.cancel_client(client_id)
             # このクライアントのアクティブリクエストをクリーンアップ
             to_remove = [req_id for req_id, req_data in self.active_requests.items() 
                         if req_data.get('client_id') == client_id]
             for req_id in to_remove:
                 self.active_requests.pop(req_id, None)
     
+    async def _run_message(self, session: ClientSession, message: str, sequence: int):
+        """1つのメッセージを処理（応答はメッセージの番号に従って送信される）"""
+        current_sequence.set(sequence)
+        try:
+            await self.handle_message(session.websocket, message, session.client_id)
+        finally:
+            await session.finish_message(sequence)
+    
     async def handle_message(self, websocket, message: str, client_id: str):
         """メッセージの処理"""
         try:
             data = json.loads(message)
             message_type = data.get('type', 'translation')
+            if self.capture and message_type in CAPTURED_TYPES:
+                self.capture.record(message_type, data, client_id)
             
             if message_type == 'translation':
                 await self.handle_translation_request(websocket, data, client_id)
@@ -120,6 +394,18 @@ class TranslationWebSocketServer:
                 await self.handle_ping(websocket, data)
             elif message_type == 'stats':
                 await self.handle_stats_request(websocket, data)
+            elif message_type == 'languages':
+                await self.handle_languages_request(websocket, data)
+            elif message_type == 'session':
+                await self.handle_session_request(websocket, data)
+            elif message_type == 'prefetch':
+                await self.handle_prefetch_request(websocket, data, client_id)
+            elif message_type == 'cancel':
+                await self.handle_cancel_request(websocket, data, client_id)
+            elif message_type == 'reload':
+                await self.handle_reload_request(websocket, data)
+            elif message_type == 'profile':
+                await self.handle_profile_request(websocket, data)
             else:
                 await self.send_error(websocket, f"不明なメッセージタイプ: {message_type}")
                 
@@ -130,7 +416,8 @@ class TranslationWebSocketServer:
             await self.send_error(websocket, str(e))
     
     async def handle_translation_request(self, websocket, data: Dict, client_id: str):
-        """翻訳リクエストの処理"""
+        """翻訳リクエストの処理（キューに投入し、結果は完了時に送信）"""
+        request_id = None
         try:
             # 必須パラメータの確認
             request_id = data.get('request_id')
@@ -149,11 +436,35 @@ class TranslationWebSocketServer:
                 })
                 return
             
+            # 推論の停止を繰り返した入力はモデルに渡さない
+            fingerprint = input_fingerprint(data)
+            if self.quarantine.is_quarantined(fingerprint):
+                await self.send_error(websocket, "この入力は推論の停止を繰り返したため受け付けられません",
+                                      request_id, code='quarantined')
+                return
+            
             # パラメータ取得
             priority = data.get('priority', 'normal')
             source_lang = data.get('source_lang', 'eng_Latn')
             target_lang = data.get('target_lang', 'jpn_Jpan')
             max_length = data.get('max_length', self.config.max_length)
+            stream_key = data.get('stream_key')
+            target_langs = data.get('target_langs')
+            decoding = data.get('decoding')
+            
+            max_length = await self._validate_max_length(websocket, max_length, request_id, client_id)
+            if max_length is None:
+                return
+            
+            if decoding is not None and decoding not in DECODING_MODES:
+                await self.send_error(websocket, f"decoding は {', '.join(DECODING_MODES)} のいずれかを指定してください", request_id)
+                return
+            
+            if target_langs is not None:
+                if not isinstance(target_langs, list) or not target_langs or \
+                        not all(isinstance(lang, str) for lang in target_langs):
+                    await self.send_error(websocket, "target_langs は言語コードの配列で指定してください", request_id)
+                    return
             
             # 言語コードの検証と自動検出
             if source_lang.lower() == "auto":
@@ -164,6 +475,47 @@ class TranslationWebSocketServer:
                 logging.warning(f"クライアント {client_id}: target_lang に 'auto' が指定されました。デフォルトの 'jpn_Jpan' を使用します")
                 target_lang = 'jpn_Jpan'
             
+            # 結果キャッシュのキーは用語集を適用する前の原文から作る
+            cache_keys = self._cache_keys(text, source_lang, target_langs or [target_lang], max_length, decoding) \
+                if not stream_key else None
+            
+            # 翻訳メモリ・用語集（単一言語への通常の翻訳のみ対象）
+            glossary = None
+            if self.memory and not target_langs and not stream_key:
+                start_time = time.time()
+                languages = self.translator.languages
+                src, tgt = languages.resolve(source_lang), languages.resolve(target_lang)
+                if src and tgt:
+                    memory_hit = self.memory.lookup(text, src, tgt)
+                    if memory_hit is not None:
+                        await self.send_response(websocket, {
+                            "request_id": request_id,
+                            "translated": memory_hit,
+                            "processing_time_ms": round((time.time() - start_time) * 1000, 2),
+                            "status": "completed",
+                            "source": "memory"
+                        })
+                        return
+                    text, glossary = self.memory.apply_glossary(text, src, tgt)
+            
+            # 翻訳結果キャッシュ（すべての翻訳先言語がキャッシュ済みならそのまま返す）
+            if cache_keys:
+                start_time = time.time()
+                cached = {lang: self.result_cache.get(key) for lang, key in cache_keys.items()}
+                if all(result is not None for result in cached.values()):
+                    response = {"request_id": request_id}
+                    if target_langs:
+                        response["translations"] = cached
+                    else:
+                        response["translated"] = cached[target_lang]
+                    response["processing_time_ms"] = round((time.time() - start_time) * 1000, 2)
+                    response["status"] = "completed"
+                    response["source"] = "cache"
+                    await self.send_response(websocket, response)
+                    return
+                # 同じ内容の事前翻訳が待機中であれば、このリクエストの結果で置き換える
+                self._cancel_prefetch(cache_keys.values())
+            
             # リクエスト記録
             self.active_requests[request_id] = {
                 'client_id': client_id,
@@ -172,53 +524,352 @@ class TranslationWebSocketServer:
                 'websocket': websocket
             }
             
-            # 翻訳実行
-            start_time = time.time()
-            
-            translated_text = self.translator.translate(
-                text,
-                source_lang,
-                target_lang,
-                max_length
+            # 翻訳キューに投入（同じstream_keyの古いジョブは置き換えられる）
+            session = self.sessions.get(websocket)
+            job = TranslationJob(
+                request_id=request_id,
+                client_id=client_id,
+                text=text,
+                source_lang=source_lang,
+                target_lang=target_lang,
+                max_length=max_length,
+                priority=priority,
+                stream_key=str(stream_key) if stream_key else None,
+                incremental=bool(data.get('incremental', False)),
+                final=bool(data.get('final', False)),
+                target_langs=target_langs,
+                decoding=decoding,
+                websocket=websocket,
+                sequence=current_sequence.get(),
+                api_key=self._scheduling_key(data, session),
+                cache_keys=cache_keys,
+                fingerprint=fingerprint,
+                glossary=glossary or None
             )
+            # 応答はジョブの完了時に送信する
+            if session and job.sequence is not None:
+                session.defer(job.sequence)
+            await self.dispatcher.submit(job)
+            
+        except Exception as e:
+            logging.error(f"翻訳処理エラー: {e}")
+            await self.send_error(websocket, str(e), request_id)
+            self.active_requests.pop(request_id, None)
+    
+    async def handle_prefetch_request(self, websocket, data: Dict, client_id: str):
+        """事前翻訳リクエストの処理（最低優先度でキューに投入し、結果はキャッシュに登録する）"""
+        request_id = data.get('request_id')
+        if self.result_cache is None:
+            await self.send_error(websocket, "結果キャッシュが無効なため prefetch は使用できません", request_id)
+            return
+        
+        texts = data.get('texts')
+        if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+            await self.send_error(websocket, "texts はテキストの配列で指定してください", request_id)
+            return
+        if len(texts) > self.config.prefetch_max_texts:
+            await self.send_error(websocket, f"texts は {self.config.prefetch_max_texts} 件以下で指定してください", request_id)
+            return
+        
+        source_lang = data.get('source_lang', 'eng_Latn')
+        target_lang = data.get('target_lang', 'jpn_Jpan')
+        target_langs = data.get('target_langs')
+        decoding = data.get('decoding')
+        max_length = await self._validate_max_length(websocket, data.get('max_length', self.config.max_length),
+                                                     request_id, client_id)
+        if max_length is None:
+            return
+        if decoding is not None and decoding not in DECODING_MODES:
+            await self.send_error(websocket, f"decoding は {', '.join(DECODING_MODES)} のいずれかを指定してください", request_id)
+            return
+        if target_langs is not None and (not isinstance(target_langs, list) or not target_langs or
+                                         not all(isinstance(lang, str) for lang in target_langs)):
+            await self.send_error(websocket, "target_langs は言語コードの配列で指定してください", request_id)
+            return
+        
+        counts = {'queued': 0, 'already_cached': 0, 'dropped': 0}
+        session = self.sessions.get(websocket)
+        languages = self.translator.languages
+        for index, text in enumerate(texts):
+            text = text.strip()
+            if not text:
+                continue
+            cache_keys = self._cache_keys(text, source_lang, target_langs or [target_lang], max_length, decoding)
+            if not cache_keys:
+                # 原文言語の自動検出（auto）や無効な言語コードはキャッシュのキーを決められない
+                await self.send_error(websocket, "prefetch には有効な source_lang / target_lang を指定してください", request_id)
+                return
             
-            processing_time = (time.time() - start_time) * 1000  # ミリ秒
+            missing = {lang: key for lang, key in cache_keys.items()
+                       if key not in self.result_cache and key not in self.prefetching}
+            if not missing:
+                counts['already_cached'] += 1
+                continue
+            if len(self.prefetching) >= self.config.prefetch_max_queued:
+                counts['dropped'] += len(texts) - index
+                break
+            fingerprint = input_fingerprint({**data, 'text': text})
+            if self.quarantine.is_quarantined(fingerprint):
+                counts['dropped'] += 1
+                continue
             
-            # レスポンス送信
-            response = {
-                "request_id": request_id,
-                "translated": translated_text,
-                "processing_time_ms": round(processing_time, 2),
-                "status": "completed"
-            }
+            glossary = None
+            if self.memory and not target_langs:
+                # 通常のリクエストと同じく用語集を適用してから翻訳する
+                text, glossary = self.memory.apply_glossary(text, languages.resolve(source_lang),
+                                                            languages.resolve(target_lang))
             
-            await self.send_response(websocket, response)
+            job = TranslationJob(
+                request_id=f"{request_id or 'prefetch'}#{index}",
+                client_id=client_id,
+                text=text,
+                source_lang=source_lang,
+                target_lang=target_lang,
+                max_length=max_length,
+                target_langs=list(missing) if target_langs else None,
+                decoding=decoding,
+                websocket=websocket,
+                api_key=self._scheduling_key(data, session),
+                cache_keys=missing,
+                prefetch=True,
+                fingerprint=fingerprint,
+                glossary=glossary or None
+            )
+            for key in missing.values():
+                self.prefetching[key] = job
+            await self.dispatcher.submit(job)
+            counts['queued'] += 1
+        
+        self.prefetch_stats['requested'] += len(texts)
+        for name, count in counts.items():
+            self.prefetch_stats[name] += count
+        
+        response = {"type": "prefetch", **counts, "status": "queued"}
+        if request_id:
+            response["request_id"] = request_id
+        await self.send_response(websocket, response)
+    
+    def _scheduling_key(self, data: Dict, session: Optional[ClientSession]) -> Optional[str]:
+        """公平スケジューリングに使う API キー（None の場合は接続ごと）
+
+        未登録のキーを受け付けると、リクエストごとにキーを変えて割り当てを増やせるため、
+        登録済みのキーと、認証済みのゲートウェイが付けたクライアントごとのキーのみ使用する。
+        """
+        api_key = data.get('api_key') or (session.api_key if session else None)
+        if not isinstance(api_key, str):
+            return None
+        if api_key in self.scheduling_keys:
+            return api_key
+        if session is not None and session.trusted_gateway and api_key.startswith(GATEWAY_KEY_PREFIX):
+            return api_key
+        return None
+    
+    async def _validate_max_length(self, websocket, max_length: Any, request_id: Optional[str],
+                                   client_id: str) -> Optional[int]:
+        """max_length を検証して上限に制限（無効な場合はエラーを送信して None）"""
+        if isinstance(max_length, bool) or not isinstance(max_length, int) or max_length <= 0:
+            await self.send_error(websocket, "max_length は正の整数で指定してください", request_id)
+            return None
+        if max_length > self.config.max_length_limit:
+            logging.warning(f"クライアント {client_id}: max_length {max_length} を上限 {self.config.max_length_limit} に制限します")
+            return self.config.max_length_limit
+        return max_length
+    
+    def _cache_keys(self, text: str, source_lang: str, target_langs: List[str], max_length: int,
+                    decoding: Optional[str]) -> Optional[Dict[str, Hashable]]:
+        """翻訳先言語ごとの結果キャッシュのキー（キャッシュが無効・言語コードが未確定の場合は None）"""
+        if self.result_cache is None or not self.translator:
+            return None
+        languages = self.translator.languages
+        source = languages.resolve(source_lang)
+        if source is None:
+            return None
+        keys = {}
+        for lang in target_langs:
+            target = languages.resolve(lang)
+            if target is None:
+                return None
+            keys[lang] = TranslationResultCache.key(text, source, target, max_length, decoding)
+        return keys
+    
+    def _cancel_prefetch(self, keys):
+        """通常のリクエストが同じ翻訳を行うため、待機中の事前翻訳を取り消す"""
+        keys = set(keys)
+        for key in keys:
+            job = self.prefetching.get(key)
+            if job is not None and job.status == 'pending' and set(job.cache_keys.values()) <= keys:
+                job.status = 'cancelled'
+                self.prefetch_stats['cancelled'] += 1
+                for job_key in job.cache_keys.values():
+                    self.prefetching.pop(job_key, None)
+    
+    def _store_result(self, job: TranslationJob):
+        """完了したジョブの結果をキャッシュに登録"""
+        if self.result_cache is None:
+            return
+        for lang, key in job.cache_keys.items():
+            result = job.result.get(lang) if isinstance(job.result, dict) else job.result
+            if isinstance(result, str):
+                self.result_cache.put(key, result, prefetched=job.prefetch)
+    
+    async def handle_job_started(self, job: TranslationJob):
+        """推論の開始を通知（session で notify_start を指定した接続のみ。ゲートウェイが隔離の判定に使用）"""
+        session = self.sessions.get(job.websocket)
+        if job.prefetch or session is None or not session.notify_start:
+            return
+        await session.notify(encode({"request_id": job.request_id, "status": "running"}))
+    
+    async def handle_job_stalled(self, job: TranslationJob):
+        """推論が job_timeout を超えた（入力を記録し、exit_on_stall の場合はプロセスを終了する）"""
+        self.quarantine.strike(job.fingerprint)
+        if not self.config.watchdog_exit_on_stall:
+            logging.error("推論スレッドが戻るまで後続の翻訳ジョブは待機します")
+            return
+        logging.critical("推論が停止したため翻訳サーバーを終了します（ゲートウェイが再起動します）")
+        self.exit_code = EXIT_STALLED
+        if self._stop_event is not None:
+            self._stop_event.set()
+    
+    async def handle_job_finished(self, job: TranslationJob):
+        """翻訳ジョブ完了時の処理"""
+        if job.glossary and job.status == 'completed':
+            # 用語集のセンチネルを訳語に戻す
+            job.result = restore_sentinels(job.text, job.result, job.glossary)
+        if job.cache_keys and job.status == 'completed':
+            self._store_result(job)
+        if job.prefetch:
+            for key in job.cache_keys.values():
+                if self.prefetching.get(key) is job:
+                    del self.prefetching[key]
+            if job.status == 'completed':
+                self.prefetch_stats['completed'] += 1
+            elif job.status == 'error':
+                logging.warning(f"事前翻訳エラー [{job.client_id}]: {job.error}")
+            return
+        
+        try:
+            if job.status == 'completed':
+                # レスポンス送信（複数言語の場合は言語ごとの結果マップ）
+                response = {"request_id": job.request_id}
+                if job.target_langs:
+                    response["translations"] = job.result
+                else:
+                    response["translated"] = job.result
+                response["processing_time_ms"] = round(job.processing_time_ms, 2)
+                response["status"] = "completed"
+                if job.stream_key:
+                    response["stream_key"] = job.stream_key
+                
+                await self.send_response(job.websocket, response, job.sequence)
+                
+                # ログ出力（テキストは設定に従って間引き・切り詰める）
+                if self.text_log.should_log():
+                    logging.info(f"翻訳完了 [{job.client_id}]: 元テキスト='{self.text_log.truncate(job.text)}' "
+                                 f"-> 翻訳結果='{self.text_log.truncate(job.result)}' ({job.processing_time_ms:.1f}ms)")
+                else:
+                    logging.debug("翻訳完了 [%s]: %d文字 (%.1fms)", job.client_id, len(job.text), job.processing_time_ms)
             
-            # ログ出力（完全なテキストを表示）
-            logging.info(f"翻訳完了 [{client_id}]: 元テキスト='{text}' -> 翻訳結果='{translated_text}' ({processing_time:.1f}ms)")
+            elif job.status == 'superseded':
+                # 新しいリクエストに置き換えられたため翻訳結果は送信しない
+                await self.send_response(job.websocket, {
+                    "request_id": job.request_id,
+                    "stream_key": job.stream_key,
+                    "superseded_by": job.superseded_by,
+                    "status": "superseded"
+                }, job.sequence)
             
-        except Exception as e:
-            logging.error(f"翻訳処理エラー: {e}")
-            await self.send_error(websocket, str(e), request_id)
+            elif job.status == 'cancelled':
+                # 切断済みのクライアントには送信しない（cancel メッセージによる取り消しのみ通知）
+                if job.websocket in self.connected_clients:
+                    await self.send_response(job.websocket, {
+                        "request_id": job.request_id,
+                        "status": "cancelled"
+                    }, job.sequence)
+            
+            elif job.status == 'error':
+                logging.error(f"翻訳処理エラー ({job.error_code}): {job.error}")
+                await self.send_error(job.websocket, job.error, job.request_id, job.sequence, code=job.error_code)
         finally:
             # リクエスト記録をクリーンアップ
-            self.active_requests.pop(request_id, None)
+            self.active_requests.pop(job.request_id, None)
+    
+    async def handle_cancel_request(self, websocket, data: Dict, client_id: str):
+        """取り消しリクエストの処理（この接続が送信した未完了の翻訳リクエストを取り消す）"""
+        request_ids = data.get('request_ids')
+        if not isinstance(request_ids, list) or not all(isinstance(r, str) for r in request_ids):
+            await self.send_error(websocket, "request_ids には request_id の配列を指定してください",
+                                  code='invalid_request')
+            return
+        
+        cancelled = await self.dispatcher.cancel(client_id, request_ids)
+        if cancelled:
+            logging.info(f"翻訳リクエストを取り消しました [{client_id}]: {cancelled}件")
+        await self.send_response(websocket, {
+            "type": "cancel",
+            "cancelled": cancelled,
+            "status": "completed"
+        })
     
     async def handle_ping(self, websocket, data: Dict):
         """Pingの処理"""
         await self.send_response(websocket, {
             "type": "pong",
             "timestamp": time.time(),
-            "server_status": "running"
+            "server_status": "stalled" if self.dispatcher and self.dispatcher.stalled else "running"
         })
     
     async def handle_stats_request(self, websocket, data: Dict):
         """統計情報リクエストの処理"""
         try:
+            # ルーティング時は読み込み済みのすべてのモデルの件数を合計する
+            translators = (self.router.pool.translators if self.router else [self.translator]) if self.translator else []
+            decoding_stats = _sum_stats([t.decoding_stats for t in translators])
+            drafted = decoding_stats.get('draft_tokens', 0)
             stats = {
                 "type": "stats",
+                "model": self.translator.model_name if self.translator else None,
+                "reload": dict(self.reload_stats),
+                "profiling": {"running": self._profile_lock.locked(), **self.profile_stats},
+                "watchdog": {
+                    "job_timeout_seconds": self.config.watchdog_job_timeout,
+                    "stalled": self.dispatcher.stalled if self.dispatcher else False,
+                    "timeouts": self.dispatcher.stats['timeouts'] if self.dispatcher else 0,
+                    "quarantine": self.quarantine.get_stats()
+                },
+                "idle": {
+                    "timeout_seconds": self.config.idle_timeout,
+                    "models": {translator.model_name: translator.get_idle_stats() for translator in translators}
+                } if self.translator else None,
                 "connected_clients": len(self.connected_clients),
                 "active_requests": len(self.active_requests),
+                "queued_requests": self.dispatcher.queued if self.dispatcher else 0,
+                "inflight_messages": sum(session.inflight for session in self.sessions.values()),
+                "dispatcher": dict(self.dispatcher.stats) if self.dispatcher else {},
+                "clients": self.dispatcher.client_stats() if self.dispatcher else {},
+                "incremental": {
+                    "active_streams": sum(t.incremental.active_streams for t in translators),
+                    **_sum_stats([t.incremental.stats for t in translators])
+                } if self.translator else {},
+                "encoder_cache": self.translator.encoder_cache.get_stats()
+                    if self.translator and self.translator.encoder_cache else None,
+                "markup": _sum_stats([t.markup_stats for t in translators]),
+                "triage": triage_stats(_sum_stats([t.triage.stats for t in translators]), self.translator.triage.enabled)
+                    if self.translator else {},
+                "memory": dict(self.memory.stats) if self.memory else None,
+                "result_cache": self.result_cache.get_stats() if self.result_cache else None,
+                "capture": self.capture.get_stats() if self.capture else None,
+                "prefetch": {"pending": len(self.prefetching), **self.prefetch_stats} if self.result_cache else None,
+                "routing": self.router.get_stats() if self.router else None,
+                "memory_budget": self.translator.budget.get_stats()
+                    if self.translator and self.translator.budget else None,
+                "vocabulary": self.translator.vocabulary.get_stats(self.translator.vocabulary_languages)
+                    if self.translator and self.translator.vocabulary else None,
+                "decoding": {
+                    "default": self.translator.decoding,
+                    "assistant_model": self.translator.assistant_model_name,
+                    "acceptance_rate": round(decoding_stats['accepted_tokens'] / drafted, 3) if drafted else None,
+                    **decoding_stats
+                } if self.translator else {},
                 "translator_ready": self.translator.is_ready() if self.translator else False
             }
             
@@ -227,32 +878,140 @@ class TranslationWebSocketServer:
         except Exception as e:
             await self.send_error(websocket, f"統計情報取得エラー: {e}")
     
-    async def send_response(self, websocket, data: Dict):
-        """レスポンス送信"""
+    async def handle_session_request(self, websocket, data: Dict):
+        """接続の設定（応答の順序）の変更"""
+        session = self.sessions.get(websocket)
+        if session is None:
+            await self.send_error(websocket, "セッションが見つかりません")
+            return
+        
+        api_key = data.get('api_key')
+        if api_key is not None:
+            if not isinstance(api_key, str):
+                await self.send_error(websocket, "api_key は文字列で指定してください")
+                return
+            if api_key and api_key not in self.scheduling_keys:
+                await self.send_error(websocket, "登録されていない api_key です（[SCHEDULING] client.<名前> に登録してください）")
+                return
+            # 以降の翻訳リクエストは API キーの重みで公平スケジューリングされる
+            session.api_key = api_key or None
+        
+        ordered = data.get('ordered')
+        if ordered is not None:
+            if not isinstance(ordered, bool):
+                await self.send_error(websocket, "ordered は true / false で指定してください")
+                return
+            # 以降に受信したメッセージから適用
+            session.ordered = ordered
+        
+        notify_start = data.get('notify_start')
+        if notify_start is not None:
+            if not isinstance(notify_start, bool):
+                await self.send_error(websocket, "notify_start は true / false で指定してください")
+                return
+            session.notify_start = notify_start
+            # ゲートウェイの接続（admin_token が設定されている場合は認証できた場合のみ）は
+            # 転送元のクライアントごとのキーで公平スケジューリングする
+            session.trusted_gateway = notify_start and (not self.config.admin_token
+                                                        or is_admin(data, self.config.admin_token))
+            # ゲートウェイは全クライアントのリクエストを1接続で転送するため、専用の上限を適用する
+            # （上限で受信が止まるとヘルスチェックの ping にも応答できなくなる）
+            session.set_max_inflight(self.config.max_inflight_per_gateway if notify_start
+                                     else self.config.max_inflight_per_connection)
+        
+        await self.send_response(websocket, {
+            "type": "session",
+            "client_id": session.client_id,
+            "ordered": session.ordered,
+            "notify_start": session.notify_start,
+            "max_inflight": session.max_inflight,
+            "weight": self.dispatcher.weight_for(session.api_key or f"client:{session.client_id}")
+        })
+    
+    async def handle_reload_request(self, websocket, data: Dict):
+        """設定の再読み込みと翻訳エンジンの入れ替え（管理コマンド）"""
+        if not is_admin(data, self.config.admin_token):
+            await self.send_error(websocket, "管理コマンドの認証に失敗しました")
+            return
         try:
-            await websocket.send(json.dumps(data, ensure_ascii=False))
+            result = await self.reload()
         except Exception as e:
-            logging.error(f"レスポンス送信エラー: {e}")
+            await self.send_error(websocket, f"リロードエラー: {e}")
+            return
+        await self.send_response(websocket, {"type": "reload", **result, "status": "completed"})
     
-    async def send_error(self, websocket, error_message: str, request_id: Optional[str] = None):
-        """エラーレスポンス送信"""
-        error_data = {
-            "error": error_message,
-            "status": "error"
-        }
+    async def handle_profile_request(self, websocket, data: Dict):
+        """推論・イベントループのプロファイル（管理コマンド、計測が終わってから応答する）"""
+        if not is_admin(data, self.config.admin_token):
+            await self.send_error(websocket, "管理コマンドの認証に失敗しました")
+            return
         
-        if request_id:
-            error_data["request_id"] = request_id
+        duration = data.get('duration')
+        if duration is not None and (isinstance(duration, bool) or not isinstance(duration, (int, float)) or duration <= 0):
+            await self.send_error(websocket, "duration は正の秒数で指定してください")
+            return
+        torch_trace = data.get('torch')
+        if torch_trace is not None and not isinstance(torch_trace, bool):
+            await self.send_error(websocket, "torch は true / false で指定してください")
+            return
         
-        await self.send_response(websocket, error_data)
+        try:
+            result = await self.profile(duration, torch_trace)
+        except Exception as e:
+            await self.send_error(websocket, f"プロファイルエラー: {e}")
+            return
+        await self.send_response(websocket, {"type": "profile", **result, "status": "completed"})
+    
+    async def handle_languages_request(self, websocket, data: Dict):
+        """対応言語一覧リクエストの処理"""
+        try:
+            await self.send_response(websocket, {
+                "type": "languages",
+                "model": self.translator.model_name,
+                **self.translator.languages.to_dict()
+            })
+            
+        except Exception as e:
+            await self.send_error(websocket, f"言語一覧取得エラー: {e}")
+    
+    async def send_response(self, websocket, data: Dict, sequence: Optional[int] = None):
+        """レスポンス送信（メッセージの番号がある場合はセッションの順序制御に従う）"""
+        if sequence is None:
+            sequence = current_sequence.get()
+        session = self.sessions.get(websocket)
+        try:
+            if session is not None and sequence is not None:
+                await session.deliver(sequence, encode(data))
+            else:
+                await websocket.send(encode(data))
+        except Exception as e:
+            logging.error(f"レスポンス送信エラー: {e}")
+    
+    async def send_error(self, websocket, error_message: str, request_id: Optional[str] = None,
+                         sequence: Optional[int] = None, code: Optional[str] = None):
+        """エラーレスポンス送信"""
+        await self.send_response(websocket, error_response(error_message, request_id, code), sequence)
     
     async def shutdown(self):
         """サーバーのシャットダウン"""
         try:
+            # 翻訳ワーカーを停止
+            if self.dispatcher:
+                await self.dispatcher.stop()
+            
+            # モデルを解放し、退避ファイルを削除
+            if self.translator:
+                self._release_engine(self.translator, self.router)
+            
+            if self.memory:
+                self.memory.close()
+            
+            if self.capture:
+                self.capture.close()
+            
             # 全てのクライアント接続を閉じる
             if self.connected_clients:
                 logging.info(f"{len(self.connected_clients)}個の接続を終了中...")
-                disconnect_tasks = []
                 for client in self.connected_clients.copy():
                     try:
                         await client.close()
@@ -4,22 +4,46 @@ MenZ翻訳サーバー メインエントリーポイント
 """
 
 import asyncio
+import atexit
 import logging
 import signal
 import sys
 import os
 import threading
+import time
+import argparse
+import importlib.util
+import json
+import subprocess
 from pathlib import Path
 
 # プロジェクトルートをパスに追加
 project_root = Path(__file__).parent
 sys.path.insert(0, str(project_root))
 
-from MenZTranslator import Config, TranslationWebSocketServer
+# サーバー・翻訳エンジン（torch / transformers）は使用時に読み込む
+import MenZTranslator
+from MenZTranslator import Config
+from MenZTranslator.performance import apply_cpu_settings, sweep_threads
+from MenZTranslator.logutil import setup_queue_logging
+
+# 設定ツールやヘルスチェックから使われる、重いライブラリを読み込まずに import できるべきモジュール
+LIGHTWEIGHT_MODULES = [
+    "MenZTranslator",
+    "MenZTranslator.config",
+    "MenZTranslator.protocol",
+    "MenZTranslator.languages",
+    "MenZTranslator.performance",
+    "MenZTranslator.gateway",
+    "MenZTranslator.supervisor"
+]
+HEAVY_MODULES = ["torch", "transformers"]
 
 # Windows用のグローバル停止フラグ
 _stop_event = None
 _server_instance = None
+# 非同期ログのリスナー（os._exit で終了する前に書き出す）
+_log_listener = None
 
 def windows_signal_handler(signum, frame):
     """Windowsでのシグナルハンドラー（同期版）"""
@@ -31,36 +55,15 @@ def windows_signal_handler(signum, frame):
 
 
 def setup_logging(config: Config):
-    """ログ設定を初期化"""
-    # ログディレクトリ作成
-    log_file = Path(config.log_file)
-    log_file.parent.mkdir(exist_ok=True)
-    
-    # ログレベル設定
-    log_level = getattr(logging, config.log_level.upper(), logging.INFO)
-    
-    # ログフォーマット
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
-    
-    # ファイルハンドラー
-    file_handler = logging.FileHandler(log_file, encoding='utf-8')
-    file_handler.setFormatter(formatter)
-    file_handler.setLevel(log_level)
-    
-    # コンソールハンドラー
-    console_handler = logging.StreamHandler()
-    console_handler.setFormatter(formatter)
-    console_handler.setLevel(log_level)
-    
-    # ルートロガー設定
-    root_logger = logging.getLogger()
-    root_logger.setLevel(log_level)
-    root_logger.addHandler(file_handler)
-    root_logger.addHandler(console_handler)
+    """ログ設定を初期化（ファイル・コンソールへの書き込みは別スレッドで行う）"""
+    global _log_listener
+    listener = setup_queue_logging(config)
+    _log_listener = listener
+    # 終了時にキューに残ったログを書き出す
+    atexit.register(listener.stop)
     
-    logging.info(f"ログ設定完了: レベル={config.log_level}, ファイル={config.log_file}")
+    logging.info(f"ログ設定完了: レベル={config.log_level}, ファイル={config.log_file}, "
+                 f"ローテーション={config.log_max_file_size}バイト×{config.log_backup_count}世代")
 
 
 def print_banner():
@@ -74,7 +77,81 @@ def print_banner():
     print(banner)
 
 
-async def main():
+def load_config(args) -> Config:
+    """設定ファイルを読み込み、コマンドライン引数で上書き"""
+    config = Config(args.config)
+    if args.host:
+        config.override('SERVER', 'host', args.host)
+    if args.port:
+        config.override('SERVER', 'port', args.port)
+    if args.cpu_affinity:
+        config.override('PERFORMANCE', 'cpu_affinity', args.cpu_affinity)
+    if args.numa_node is not None:
+        config.override('PERFORMANCE', 'numa_node', args.numa_node)
+    if args.no_capture:
+        config.override('CAPTURE', 'enabled', 'false')
+    if args.exit_on_stall:
+        config.override('WATCHDOG', 'exit_on_stall', 'true')
+    return config
+
+
+def run_thread_sweep(args):
+    """スレッド数スイープを実行して結果を表示"""
+    config = load_config(args)
+    setup_logging(config)
+    apply_cpu_settings(config)
+
+    server = MenZTranslator.TranslationWebSocketServer(config)
+    logging.info("スレッド数ごとの翻訳時間を計測中...")
+    results = sweep_threads(server.translator)
+    best = min(results, key=results.get)
+
+    print("\nスレッド数  中央値(ms)")
+    for threads, median_ms in results.items():
+        marker = "  <- 最速" if threads == best else ""
+        print(f"{threads:>10}  {median_ms:>10.1f}{marker}")
+    print(f"\n推奨設定: [PERFORMANCE] intra_op_threads = {best}")
+
+
+def run_prepare(args):
+    """起動用の成果物を作成"""
+    config = load_config(args)
+    setup_logging(config)
+    dtype = args.dtype or ("float16" if config.use_fp16 else "float32")
+    from MenZTranslator.artifact import prepare_artifact
+    prepare_artifact(config.model_name, args.prepare, dtype)
+    print(f"\n成果物を作成しました: {args.prepare}")
+    print(f"設定ファイルの [TRANSLATION] model_name = {args.prepare} で使用できます")
+
+
+def parse_args():
+    """コマンドライン引数を解析"""
+    parser = argparse.ArgumentParser(description="MenZ翻訳サーバー")
+    parser.add_argument("--mode", choices=["server", "gateway"], default="server",
+                        help="server: 翻訳サーバー（モデルを読み込む）, gateway: 複数の翻訳サーバーへの振り分けのみ")
+    parser.add_argument("--config", default="config/translator.ini", help="設定ファイルのパス")
+    parser.add_argument("--host", help="待ち受けホスト（設定ファイルの値を上書き）")
+    parser.add_argument("--port", type=int, help="待ち受けポート（設定ファイルの値を上書き）")
+    parser.add_argument("--cpu-affinity", help="使用するCPU（例: 0-7,16-23、設定ファイルの値を上書き）")
+    parser.add_argument("--numa-node", type=int, help="使用するNUMAノード（設定ファイルの値を上書き）")
+    parser.add_argument("--no-capture", action="store_true",
+                        help="トラフィックの記録を無効にする（設定ファイルの値を上書き）")
+    parser.add_argument("--exit-on-stall", action="store_true",
+                        help="推論が job_timeout を超えた場合にプロセスを終了する（ゲートウェイが起動する翻訳サーバー用）")
+    parser.add_argument("--sweep-threads", action="store_true",
+                        help="スレッド数ごとの翻訳時間を計測して最適な intra_op_threads を表示する")
+    parser.add_argument("--prepare", metavar="OUTPUT_DIR",
+                        help="起動用の変換済み成果物を OUTPUT_DIR に作成する（model_name にこのディレクトリを指定して使用）")
+    parser.add_argument("--check-imports", action="store_true",
+                        help="設定・プロトコル用のモジュールが torch 等を読み込まずに import できるか確認する")
+    parser.add_argument("--import-budget-ms", type=float, default=300.0,
+                        help="--check-imports で許容する import 時間（ミリ秒）")
+    parser.add_argument("--dtype", choices=["float32", "float16", "bfloat16"],
+                        help="--prepare で保存する重みの精度（省略時は use_fp16 に従う）")
+    return parser.parse_args()
+
+
+async def main(args):
     """メイン処理"""
     global _stop_event, _server_instance
     server = None
@@ -86,7 +163,7 @@ async def main():
         
         # 設定読み込み
         print("設定ファイルを読み込み中...")
-        config = Config()
+        config = load_config(args)
         
         # ログ設定
         setup_logging(config)
@@ -94,16 +171,25 @@ async def main():
         
         # サーバー設定表示
         logging.info(f"サーバー設定:")
+        logging.info(f"  モード: {args.mode}")
         logging.info(f"  ホスト: {config.server_host}")
         logging.info(f"  ポート: {config.server_port}")
         logging.info(f"  翻訳モデル: {config.model_name}")
         logging.info(f"  デバイス: {config.device}")
 
+        # スレッド数・CPUアフィニティ（モデル読み込み前に設定する）
+        if args.mode == "server":
+            apply_cpu_settings(config)
         
         # サーバー初期化
         logging.info("サーバーを初期化中...")
-        server = TranslationWebSocketServer(config)
+        init_start = time.time()
+        if args.mode == "gateway":
+            server = MenZTranslator.TranslationGateway(config)
+        else:
+            server = MenZTranslator.TranslationWebSocketServer(config)
         _server_instance = server
+        logging.info(f"サーバーの初期化が完了しました ({time.time() - init_start:.2f}秒)")
         
         # 停止イベント作成
         stop_event = asyncio.Event()
@@ -126,10 +212,21 @@ async def main():
                 logging.info("停止シグナルを受信しました。サーバーを停止します...")
                 stop_event.set()
             
+            def reload_signal_handler():
+                logging.info("SIGHUPを受信しました。設定を再読み込みします...")
+                asyncio.ensure_future(reload_server(server))
+            
+            def profile_signal_handler():
+                logging.info("SIGUSR1を受信しました。プロファイルを開始します...")
+                asyncio.ensure_future(profile_server(server))
+            
             try:
                 loop = asyncio.get_running_loop()
                 for sig in [signal.SIGINT, signal.SIGTERM]:
                     loop.add_signal_handler(sig, unix_signal_handler)
+                loop.add_signal_handler(signal.SIGHUP, reload_signal_handler)
+                if hasattr(server, 'profile'):
+                    loop.add_signal_handler(signal.SIGUSR1, profile_signal_handler)
                 signal_handler_installed = True
                 logging.info("Unix系シグナルハンドラーを設定しました")
             except Exception as e:
@@ -214,9 +311,28 @@ async def main():
         
         if server:
             await shutdown(server)
+    
+    # 推論の停止で終了する場合の終了コード
+    return getattr(server, 'exit_code', None)
+
+
+async def reload_server(server):
+    """設定の再読み込みと翻訳エンジンの入れ替え（SIGHUP）"""
+    try:
+        await server.reload()
+    except Exception as e:
+        logging.error(f"リロードエラー: {e}")
+
+
+async def profile_server(server):
+    """推論・イベントループのプロファイル（SIGUSR1、計測時間は [PROFILING] default_duration）"""
+    try:
+        await server.profile()
+    except Exception as e:
+        logging.error(f"プロファイルエラー: {e}")
 
 
-async def shutdown(server: TranslationWebSocketServer):
+async def shutdown(server):
     """サーバー終了処理"""
     try:
         logging.info("サーバーの終了処理を開始します...")
@@ -226,17 +342,24 @@ async def shutdown(server: TranslationWebSocketServer):
         logging.error(f"終了処理エラー: {e}")
 
 
-def check_dependencies():
-    """依存関係チェック"""
-    try:
-        import torch
-        import transformers
-        import websockets
-        
-        logging.info("必要なライブラリが確認できました")
-        
-        # 追加の環境情報（特にWindows）
-        if sys.platform == "win32":
+def check_dependencies(mode: str = "server"):
+    """依存関係チェック（ライブラリは読み込まずに存在のみ確認する）"""
+    required = ["websockets"]
+    if mode == "server":
+        required += ["torch", "transformers"]
+    
+    missing = [name for name in required if importlib.util.find_spec(name) is None]
+    if missing:
+        print(f"エラー: 必要なライブラリが不足しています: {', '.join(missing)}")
+        print("pip install -r requirements.txt を実行してください")
+        return False
+    
+    logging.info("必要なライブラリが確認できました")
+    
+    # 追加の環境情報（特にWindows、モデルを読み込むサーバーモードのみ）
+    if sys.platform == "win32" and mode == "server":
+        try:
+            import torch
             logging.info(f"Windows環境での実行: Python {sys.version}")
             logging.info(f"PyTorch バージョン: {torch.__version__}")
             logging.info(f"CUDA利用可能: {torch.cuda.is_available()}")
@@ -244,22 +367,65 @@ def check_dependencies():
                 logging.info(f"CUDA デバイス数: {torch.cuda.device_count()}")
                 for i in range(torch.cuda.device_count()):
                     logging.info(f"  GPU {i}: {torch.cuda.get_device_name(i)}")
-        
-        return True
-    except ImportError as e:
-        print(f"エラー: 必要なライブラリが不足しています: {e}")
-        print("pip install -r requirements.txt を実行してください")
-        return False
-    except Exception as e:
-        logging.error(f"依存関係チェックエラー: {e}")
-        return False
+        except Exception as e:
+            logging.error(f"依存関係チェックエラー: {e}")
+            return False
+    
+    return True
+
+
+def run_import_check(max_ms: float) -> bool:
+    """軽量モジュールが重いライブラリを読み込まず、max_ms 以内に import できるかを確認"""
+    probe = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        "import importlib; importlib.import_module(sys.argv[1])\n"
+        "elapsed = (time.perf_counter() - start) * 1000\n"
+        f"print(json.dumps({{'ms': elapsed, 'heavy': [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))"
+    )
+    ok = True
+    print(f"{'モジュール':<32} {'時間(ms)':>10}  結果")
+    for module in LIGHTWEIGHT_MODULES:
+        # 他のモジュールの読み込み状態に影響されないよう、モジュールごとに別プロセスで計測
+        completed = subprocess.run([sys.executable, "-c", probe, module], cwd=str(project_root),
+                                   capture_output=True, text=True)
+        if completed.returncode != 0:
+            error = (completed.stderr.strip().splitlines() or ["不明なエラー"])[-1]
+            print(f"{module:<32} {'-':>10}  NG（import に失敗: {error}）")
+            ok = False
+            continue
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        problems = []
+        if result["heavy"]:
+            problems.append(f"{', '.join(result['heavy'])} を読み込んでいます")
+        if result["ms"] > max_ms:
+            problems.append(f"{max_ms:.0f}ms を超えています")
+        print(f"{module:<32} {result['ms']:>10.1f}  {'NG（' + '、'.join(problems) + '）' if problems else 'OK'}")
+        ok = ok and not problems
+    return ok
 
 
 if __name__ == "__main__":
+    args = parse_args()
+    
+    # import 時間のチェック（依存ライブラリは不要）
+    if args.check_imports:
+        sys.exit(0 if run_import_check(args.import_budget_ms) else 1)
+    
     # 依存関係チェック
-    if not check_dependencies():
+    if not check_dependencies(args.mode):
         sys.exit(1)
     
+    # 成果物の作成（サーバーは起動しない）
+    if args.prepare:
+        run_prepare(args)
+        sys.exit(0)
+    
+    # スレッド数スイープ（サーバーは起動しない）
+    if args.sweep_threads:
+        run_thread_sweep(args)
+        sys.exit(0)
+    
     # Windowsでのイベントループポリシー設定（改善版）
     if sys.platform == "win32":
         # Windows 10以降でのProactorEventLoopを避けてSelectorEventLoopを使用
@@ -270,13 +436,14 @@ if __name__ == "__main__":
             logging.warning(f"イベントループポリシー設定エラー: {e}")
     
     # サーバー実行（Windows対応改善）
+    exit_code = None
     try:
         if sys.platform == "win32":
             # Windowsでの実行時にKeyboardInterruptをより確実にキャッチ
             loop = asyncio.new_event_loop()
             asyncio.set_event_loop(loop)
             try:
-                loop.run_until_complete(main())
+                exit_code = loop.run_until_complete(main(args))
             except KeyboardInterrupt:
                 print("\nCtrl+Cが検出されました。プログラムを終了します...")
                 logging.info("KeyboardInterrupt による終了")
@@ -295,12 +462,19 @@ if __name__ == "__main__":
                     logging.error(f"ループクリーンアップエラー: {e}")
         else:
             # Unix系では従来通り
-            asyncio.run(main())
+            exit_code = asyncio.run(main(args))
     
     except Exception as e:
         print(f"致命的エラー: {e}")
         logging.error(f"致命的エラー: {e}")
         sys.exit(1)
     
+    if exit_code is not None:
+        # 停止した推論スレッドは終了を待てないため、ログを書き出してから直ちに終了する
+        print(f"推論が停止したため終了します（終了コード {exit_code}）")
+        if _log_listener:
+            _log_listener.stop()
+        os._exit(exit_code)
+    
     print("プログラムが正常に終了しました")
 
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+トラフィック再生ツール
+[CAPTURE] で記録した翻訳リクエストを同じ到着パターンで翻訳サーバーに送信し、レイテンシを計測・比較します
+
+    python replay.py run logs/traffic.jsonl --url ws://127.0.0.1:55001 --speed 4 --output results/a.jsonl
+    python replay.py compare results/a.jsonl results/b.jsonl
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import websockets
+from websockets.exceptions import ConnectionClosed
+
+# プロジェクトルートをパスに追加
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from MenZTranslator.protocol import encode
+
+# 原文を記録していない場合に、同じ文字数のテキストを組み立てる単語
+FILLER_WORDS = (
+    "the", "quick", "answer", "is", "not", "always", "right", "we", "should", "go", "back",
+    "to", "the", "station", "before", "it", "gets", "dark", "where", "did", "you", "put",
+    "my", "keys", "this", "time", "I", "will", "wait", "for", "them", "outside", "please",
+    "tell", "me", "what", "happened", "yesterday", "at", "school", "nothing", "is", "ready", "yet"
+)
+
+
+def load_capture(path: str) -> List[Dict]:
+    """記録ファイルを読み込み、到着時刻順に並べる（ヘッダー行は除く）"""
+    records = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            data = json.loads(line)
+            if 'capture' in data:
+                continue
+            records.append(data)
+    records.sort(key=lambda record: record['ts'])
+    return records
+
+
+def synthesize_text(fields: Dict) -> str:
+    """記録された原文、または文字数とハッシュから決まるテキスト（同じハッシュは同じテキストになる）"""
+    if 'text' in fields:
+        return fields['text']
+    chars = fields.get('chars', 0)
+    if chars <= 0:
+        return ""
+    rng = random.Random(fields.get('text_hash', ''))
+    words: List[str] = []
+    length = 0
+    while length < chars:
+        word = rng.choice(FILLER_WORDS)
+        words.append(word)
+        length += len(word) + 1
+    text = ' '.join(words)[:chars].rstrip()
+    return text[0].upper() + text[1:] + '.' if len(text) > 1 else text
+
+
+def build_message(record: Dict, request_id: str) -> Dict:
+    """記録から送信するメッセージを作成"""
+    message: Dict[str, Any] = {"type": record.get('type', 'translation'), "request_id": request_id}
+    for key in ('source_lang', 'target_lang', 'target_langs', 'priority', 'max_length', 'decoding'):
+        if key in record:
+            message[key] = record[key]
+    if message['type'] == 'prefetch':
+        message['texts'] = [synthesize_text(fields) for fields in record.get('texts', [])]
+    else:
+        message['text'] = synthesize_text(record)
+        if 'stream' in record:
+            message['stream_key'] = record['stream']
+            message['incremental'] = record.get('incremental', False)
+            message['final'] = record.get('final', False)
+    return message
+
+
+class ReplayClient:
+    """記録上の1クライアントに対応する接続"""
+
+    def __init__(self, url: str, results: Dict[str, Dict]):
+        self.url = url
+        self.results = results
+        self.websocket = None
+        self._reader_task: Optional[asyncio.Task] = None
+
+    async def connect(self):
+        self.websocket = await websockets.connect(self.url, max_size=1024*1024)
+        self._reader_task = asyncio.create_task(self._reader())
+
+    async def send(self, request_id: str, message: Dict):
+        self.results[request_id]['sent'] = time.perf_counter()
+        await self.websocket.send(encode(message))
+
+    async def _reader(self):
+        try:
+            async for raw in self.websocket:
+                data = json.loads(raw)
+                result = self.results.get(data.get('request_id'))
+                if result is None or 'latency_ms' in result:
+                    continue
+                result['latency_ms'] = round((time.perf_counter() - result['sent']) * 1000, 2)
+                result['status'] = data.get('status', 'completed')
+                if 'source' in data:
+                    result['source'] = data['source']
+        except ConnectionClosed:
+            pass
+
+    async def close(self):
+        if self.websocket is not None:
+            await self.websocket.close()
+        if self._reader_task is not None:
+            await asyncio.gather(self._reader_task, return_exceptions=True)
+
+
+async def replay(records: List[Dict], url: str, speed: float, drain_timeout: float) -> List[Dict]:
+    """記録と同じ間隔（speed 倍速）でリクエストを送信し、応答までの時間を計測"""
+    results: Dict[str, Dict] = {}
+    clients: Dict[str, ReplayClient] = {}
+    origin = records[0]['ts']
+    start = time.perf_counter()
+
+    for index, record in enumerate(records):
+        request_id = f"replay-{index}"
+        results[request_id] = {
+            "index": index,
+            "offset_s": round(record['ts'] - origin, 3),
+            "type": record.get('type', 'translation'),
+            "client": record.get('client'),
+            "priority": record.get('priority', 'normal'),
+            "chars": record.get('chars', sum(fields.get('chars', 0) for fields in record.get('texts', []))),
+            "targets": len(record.get('target_langs') or [record.get('target_lang')])
+        }
+
+        delay = start + (record['ts'] - origin) / speed - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        client = clients.get(record.get('client'))
+        if client is None:
+            client = ReplayClient(url, results)
+            await client.connect()
+            clients[record.get('client')] = client
+        await client.send(request_id, build_message(record, request_id))
+
+    # 残りの応答を待つ
+    deadline = time.perf_counter() + drain_timeout
+    while time.perf_counter() < deadline and any('latency_ms' not in r for r in results.values()):
+        await asyncio.sleep(0.1)
+    for client in clients.values():
+        await client.close()
+
+    for result in results.values():
+        result.pop('sent', None)
+        result.setdefault('status', 'timeout')
+    return sorted(results.values(), key=lambda result: result['index'])
+
+
+def percentile(values: List[float], ratio: float) -> float:
+    """最近傍順位法によるパーセンタイル"""
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered), math.ceil(ratio * len(ordered))) - 1)]
+
+
+def summarize(results: List[Dict]) -> Dict[str, Dict]:
+    """全体・メッセージタイプ別・優先度別のレイテンシ分布"""
+    groups: Dict[str, List[Dict]] = defaultdict(list)
+    for result in results:
+        groups['all'].append(result)
+        groups[f"type={result['type']}"].append(result)
+        groups[f"priority={result['priority']}"].append(result)
+
+    summary = {}
+    for name, members in groups.items():
+        latencies = [m['latency_ms'] for m in members if m['status'] in ('completed', 'queued')]
+        summary[name] = {
+            "count": len(members),
+            "errors": sum(1 for m in members if m['status'] == 'error'),
+            "timeouts": sum(1 for m in members if m['status'] == 'timeout'),
+            "superseded": sum(1 for m in members if m['status'] == 'superseded'),
+            **({
+                "p50_ms": percentile(latencies, 0.50),
+                "p90_ms": percentile(latencies, 0.90),
+                "p99_ms": percentile(latencies, 0.99),
+                "max_ms": max(latencies)
+            } if latencies else {})
+        }
+    return summary
+
+
+def print_summary(summary: Dict[str, Dict]):
+    print(f"{'グループ':<24}{'件数':>8}{'p50(ms)':>10}{'p90(ms)':>10}{'p99(ms)':>10}{'最大(ms)':>10}{'エラー':>8}{'タイムアウト':>10}")
+    for name, stats in summary.items():
+        print(f"{name:<24}{stats['count']:>8}"
+              + ''.join(f"{stats.get(key, float('nan')):>10.1f}" for key in ('p50_ms', 'p90_ms', 'p99_ms', 'max_ms'))
+              + f"{stats['errors']:>8}{stats['timeouts']:>10}")
+
+
+def load_results(path: str) -> List[Dict]:
+    with open(path, encoding='utf-8') as f:
+        return [data for data in (json.loads(line) for line in f if line.strip()) if 'replay' not in data]
+
+
+def run_command(args) -> int:
+    records = load_capture(args.capture)
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        print("再生するリクエストがありません")
+        return 1
+
+    span = records[-1]['ts'] - records[0]['ts']
+    print(f"{len(records)}件のリクエストを再生します（記録上 {span:.1f}秒、{args.speed}倍速）: {args.url}")
+    results = asyncio.run(replay(records, args.url, args.speed, args.drain_timeout))
+    print_summary(summarize(results))
+
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({"replay": args.capture, "url": args.url, "speed": args.speed,
+                                "started_at": time.strftime('%Y-%m-%dT%H:%M:%S')}, ensure_ascii=False) + '\n')
+            for result in results:
+                f.write(json.dumps(result, ensure_ascii=False) + '\n')
+        print(f"\n結果を保存しました: {args.output}")
+    return 0
+
+
+def compare_command(args) -> int:
+    baseline = summarize(load_results(args.baseline))
+    candidate = summarize(load_results(args.candidate))
+
+    print(f"基準: {args.baseline}\n比較: {args.candidate}\n")
+    print(f"{'グループ':<24}{'指標':<8}{'基準':>10}{'比較':>10}{'変化':>10}")
+    for name in baseline:
+        if name not in candidate:
+            continue
+        for key in ('p50_ms', 'p90_ms', 'p99_ms', 'max_ms'):
+            before, after = baseline[name].get(key), candidate[name].get(key)
+            if before is None or after is None:
+                continue
+            change = f"{(after - before) / before * 100:+.1f}%" if before else "-"
+            print(f"{name:<24}{key[:-3]:<8}{before:>10.1f}{after:>10.1f}{change:>10}")
+        for key in ('errors', 'timeouts'):
+            if baseline[name][key] or candidate[name][key]:
+                print(f"{name:<24}{key:<8}{baseline[name][key]:>10}{candidate[name][key]:>10}")
+    return 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="MenZ翻訳サーバー トラフィック再生ツール")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run = subparsers.add_parser("run", help="記録したトラフィックを再生してレイテンシを計測する")
+    run.add_argument("capture", help="[CAPTURE] で記録したファイル")
+    run.add_argument("--url", default="ws://127.0.0.1:55001", help="翻訳サーバー（またはゲートウェイ）のURL")
+    run.add_argument("--speed", type=float, default=1.0, help="再生速度（2 で到着間隔を半分にする）")
+    run.add_argument("--limit", type=int, default=0, help="再生するリクエスト数の上限（0で全件）")
+    run.add_argument("--drain-timeout", type=float, default=60.0, help="送信完了後に応答を待つ秒数")
+    run.add_argument("--output", help="リクエストごとの結果を保存するファイル（compare で使用）")
+
+    compare = subparsers.add_parser("compare", help="2つの再生結果のレイテンシ分布を比較する")
+    compare.add_argument("baseline", help="基準となる再生結果")
+    compare.add_argument("candidate", help="比較する再生結果")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    sys.exit(run_command(args) if args.command == "run" else compare_command(args))
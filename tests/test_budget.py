@@ -0,0 +1,60 @@
+from types import SimpleNamespace
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from MenZTranslator.budget import MIN_SCALE, RECOVERY_STREAK, MemoryBudget, is_out_of_memory
+
+MODEL_CONFIG = SimpleNamespace(d_model=1024, decoder_layers=12, encoder_ffn_dim=4096,
+                               decoder_ffn_dim=4096, vocab_size=256206)
+
+
+def _budget(rows_that_fit: int, input_tokens=32, num_beams=4, max_length=128) -> MemoryBudget:
+    budget = MemoryBudget(MODEL_CONFIG, torch.device('cpu'), 1)
+    budget.budget_bytes = budget.estimate(rows_that_fit, input_tokens, num_beams, max_length)
+    return budget
+
+
+def test_estimate_grows_with_rows_and_length():
+    budget = MemoryBudget(MODEL_CONFIG, torch.device('cpu'), 1 << 30)
+    assert budget.estimate(2, 32, 4, 128) > budget.estimate(1, 32, 4, 128)
+    assert budget.estimate(1, 32, 4, 256) > budget.estimate(1, 32, 4, 128)
+
+
+def test_plan_splits_rows_to_fit_the_budget():
+    budget = _budget(rows_that_fit=3)
+
+    assert budget.plan(10, 32, 4, 128) == (3, 128)
+    assert budget.plan(2, 32, 4, 128) == (2, 128)
+    assert budget.stats['split_batches'] == 1
+
+
+def test_plan_clamps_max_length_when_one_row_does_not_fit():
+    budget = _budget(rows_that_fit=1, max_length=64)
+
+    rows, max_length = budget.plan(4, 32, 4, 512)
+    assert rows == 1
+    assert 32 <= max_length <= 64
+    assert budget.stats['clamped_max_length'] == 1
+
+
+def test_back_off_and_recovery():
+    budget = _budget(rows_that_fit=8)
+    full = budget.effective_budget
+
+    assert budget.back_off()
+    assert budget.effective_budget < full
+    for _ in range(RECOVERY_STREAK):
+        budget.finish_batch(0, 0)
+    assert budget.scale > 0.5
+
+    while budget.scale > MIN_SCALE:
+        budget.back_off()
+    assert not budget.back_off()
+
+
+def test_is_out_of_memory():
+    assert is_out_of_memory(MemoryError())
+    assert is_out_of_memory(RuntimeError("CUDA out of memory. Tried to allocate 2.00 GiB"))
+    assert not is_out_of_memory(RuntimeError("shape mismatch"))
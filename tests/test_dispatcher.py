@@ -0,0 +1,133 @@
+import asyncio
+import threading
+
+from MenZTranslator.dispatcher import TranslationDispatcher, TranslationJob
+
+
+class _Incremental:
+    def discard(self, key):
+        pass
+
+    def discard_matching(self, predicate):
+        pass
+
+
+class BlockingTranslator:
+    """release が呼ばれるまで最初の翻訳で止まる翻訳エンジン"""
+
+    def __init__(self):
+        self.incremental = _Incremental()
+        self.started = threading.Event()
+        self.released = threading.Event()
+        self.translated = []
+
+    def translate(self, text, source_lang, target_lang, max_length, decoding=None):
+        self.started.set()
+        self.released.wait(5)
+        self.translated.append(text)
+        return text.upper()
+
+
+def _job(request_id, client_id, text="hello", **kwargs):
+    return TranslationJob(request_id, client_id, text, "eng_Latn", "jpn_Jpan", 64, **kwargs)
+
+
+async def _wait_for(event: threading.Event):
+    while not event.is_set():
+        await asyncio.sleep(0.01)
+
+
+def test_cancel_client_cancels_and_notifies_queued_jobs():
+    async def scenario():
+        translator = BlockingTranslator()
+        finished = []
+
+        async def on_finished(job):
+            finished.append((job.request_id, job.status))
+
+        dispatcher = TranslationDispatcher(translator, on_finished)
+        dispatcher.start()
+        try:
+            await dispatcher.submit(_job("a0", "A"))
+            await _wait_for(translator.started)
+            for i in range(1, 4):
+                await dispatcher.submit(_job(f"a{i}", "A", prefetch=True))
+            await dispatcher.submit(_job("b0", "B"))
+
+            await dispatcher.cancel_client("A")
+            translator.released.set()
+            while not any(request_id == "b0" for request_id, _ in finished):
+                await asyncio.sleep(0.01)
+        finally:
+            translator.released.set()
+            await dispatcher.stop()
+        return translator, finished, dispatcher
+
+    translator, finished, dispatcher = asyncio.run(scenario())
+    assert sorted(finished) == [("a0", "cancelled"), ("a1", "cancelled"), ("a2", "cancelled"),
+                                ("a3", "cancelled"), ("b0", "completed")]
+    # 実行中だった a0 以外の取り消したジョブはモデルに渡らない
+    assert translator.translated == ["hello", "hello"]
+    assert dispatcher.stats['cancelled'] == 4
+    assert dispatcher._client_jobs == {}
+
+
+def test_stream_key_supersedes_queued_job():
+    async def scenario():
+        translator = BlockingTranslator()
+        finished = []
+
+        async def on_finished(job):
+            finished.append((job.request_id, job.status))
+
+        dispatcher = TranslationDispatcher(translator, on_finished)
+        dispatcher.start()
+        try:
+            await dispatcher.submit(_job("x", "A"))
+            await _wait_for(translator.started)
+            await dispatcher.submit(_job("s1", "A", text="one", stream_key="k"))
+            await dispatcher.submit(_job("s2", "A", text="two", stream_key="k"))
+            translator.released.set()
+            while len(finished) < 3:
+                await asyncio.sleep(0.01)
+        finally:
+            translator.released.set()
+            await dispatcher.stop()
+        return translator, finished
+
+    translator, finished = asyncio.run(scenario())
+    assert ("s1", "superseded") in finished
+    assert ("s2", "completed") in finished
+    assert "one" not in translator.translated
+
+
+def test_cancel_only_cancels_named_requests_of_the_client():
+    async def scenario():
+        translator = BlockingTranslator()
+        finished = []
+
+        async def on_finished(job):
+            finished.append((job.request_id, job.status))
+
+        dispatcher = TranslationDispatcher(translator, on_finished)
+        dispatcher.start()
+        try:
+            await dispatcher.submit(_job("a0", "A", text="first"))
+            await _wait_for(translator.started)
+            await dispatcher.submit(_job("a1", "A", text="second"))
+            await dispatcher.submit(_job("b1", "B", text="third"))
+
+            # 他のクライアントの同じ request_id は取り消さない
+            assert await dispatcher.cancel("A", ["a1", "b1"]) == 1
+            assert await dispatcher.cancel("A", ["a1"]) == 0
+            translator.released.set()
+            while len(finished) < 3:
+                await asyncio.sleep(0.01)
+        finally:
+            translator.released.set()
+            await dispatcher.stop()
+        return translator, finished
+
+    translator, finished = asyncio.run(scenario())
+    assert sorted(finished) == [("a0", "completed"), ("a1", "cancelled"), ("b1", "completed")]
+    assert "second" not in translator.translated
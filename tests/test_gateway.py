@@ -0,0 +1,70 @@
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip("websockets")
+
+from MenZTranslator.config import Config
+from MenZTranslator.gateway import TranslationGateway, _PendingRequest
+
+
+class RecordingWebSocket:
+    """送信したメッセージを記録する接続"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, payload):
+        self.sent.append(json.loads(payload))
+
+
+@pytest.fixture
+def gateway(tmp_path):
+    config = Config(str(tmp_path / "translator.ini"))
+    config.override('GATEWAY', 'backends', 'ws://127.0.0.1:1')
+    config.override('GATEWAY', 'backend_max_inflight', '1')
+    gateway = TranslationGateway(config)
+    backend = gateway.backends['ws://127.0.0.1:1']
+    backend.websocket = RecordingWebSocket()
+    backend.healthy = True
+    return gateway
+
+
+def _pending(websocket, client_id, request_id):
+    request = {"request_id": request_id, "text": "hello", "source_lang": "eng_Latn", "target_lang": "jpn_Jpan"}
+    return _PendingRequest(websocket, client_id, request, TranslationGateway._route_key(request))
+
+
+def test_disconnect_cancels_forwarded_requests_on_the_backend(gateway):
+    async def scenario():
+        client = RecordingWebSocket()
+        for request_id in ("r1", "r2"):
+            await gateway.route(_pending(client, "c1", request_id))
+        await gateway.route(_pending(client, "c2", "r1"))
+        return await gateway.cancel_requests("c1", abandon=True)
+
+    cancelled = asyncio.run(scenario())
+    backend = gateway.backends['ws://127.0.0.1:1']
+    # r1 は転送済み、r2 と c2 の r1 は上限のため待機中
+    assert cancelled == 2
+    assert backend.websocket.sent[-1] == {"type": "cancel", "request_ids": ["c1:r1:1"]}
+    assert all(pending.abandoned for pending in backend.pending.values())
+    assert [pending.client_id for _, pending, _ in backend.waiting] == ["c2"]
+
+
+def test_client_cancel_answers_waiting_requests_immediately(gateway):
+    async def scenario():
+        client = RecordingWebSocket()
+        for request_id in ("r1", "r2"):
+            await gateway.route(_pending(client, "c1", request_id))
+        cancelled = await gateway.cancel_requests("c1", {"r2"})
+        return client, cancelled
+
+    client, cancelled = asyncio.run(scenario())
+    backend = gateway.backends['ws://127.0.0.1:1']
+    assert cancelled == 1
+    assert client.sent == [{"request_id": "r2", "status": "cancelled"}]
+    assert not backend.waiting
+    # 転送済みの r1 は取り消していない
+    assert not any(message.get('type') == 'cancel' for message in backend.websocket.sent)
@@ -0,0 +1,62 @@
+from MenZTranslator.incremental import IncrementalTranslationCache, join_translations, split_sentences
+
+
+class RecordingTranslator:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, segment):
+        self.calls.append(segment)
+        return segment.upper()
+
+
+def test_split_sentences():
+    assert split_sentences("Hello. How are you? Fine") == ["Hello. ", "How are you? ", "Fine"]
+    assert split_sentences("こんにちは。元気？") == ["こんにちは。", "元気？"]
+    assert split_sentences("Version 1.5 is out") == ["Version 1.5 is out"]
+    assert split_sentences("   ") == []
+
+
+def test_join_translations_uses_spaces_only_where_needed():
+    assert join_translations(["A", "", "B"], 'eng_Latn') == "A B"
+    assert join_translations(["あ", "い"], 'jpn_Jpan') == "あい"
+
+
+def test_stable_sentences_are_reused():
+    cache = IncrementalTranslationCache()
+    translate = RecordingTranslator()
+
+    assert cache.translate(translate, "s", "Hello. How", 'eng_Latn', 'fra_Latn') == "HELLO. HOW"
+    assert cache.translate(translate, "s", "Hello. How are you", 'eng_Latn', 'fra_Latn') == "HELLO. HOW ARE YOU"
+
+    # 確定済みの "Hello." は2回目に翻訳しない
+    assert translate.calls == ["Hello.", "How", "How are you"]
+    assert cache.stats == {'reused_segments': 1, 'translated_segments': 3}
+
+
+def test_unchanged_tail_is_reused_once_it_becomes_stable():
+    cache = IncrementalTranslationCache()
+    translate = RecordingTranslator()
+
+    cache.translate(translate, "s", "Hello.", 'eng_Latn', 'fra_Latn')
+    cache.translate(translate, "s", "Hello. Bye", 'eng_Latn', 'fra_Latn')
+
+    assert translate.calls == ["Hello.", "Bye"]
+
+
+def test_language_change_and_discard_reset_the_stream():
+    cache = IncrementalTranslationCache(max_streams=2)
+    translate = RecordingTranslator()
+
+    cache.translate(translate, ("c1", "a"), "Hello. Hi", 'eng_Latn', 'fra_Latn')
+    cache.translate(translate, ("c1", "a"), "Hello. Hi", 'eng_Latn', 'deu_Latn')
+    assert translate.calls.count("Hello.") == 2
+
+    cache.translate(translate, ("c2", "b"), "One", 'eng_Latn', 'fra_Latn')
+    cache.translate(translate, ("c3", "c"), "Two", 'eng_Latn', 'fra_Latn')
+    # 上限を超えた古いストリームから破棄される
+    assert cache.active_streams == 2
+
+    cache.discard_matching(lambda key: key[0] == "c2")
+    cache.discard(("c3", "c"))
+    assert cache.active_streams == 0
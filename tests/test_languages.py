@@ -0,0 +1,40 @@
+from MenZTranslator.languages import LanguageRegistry
+
+REGISTRY = LanguageRegistry({'eng_Latn': 10, 'jpn_Jpan': 11, 'zho_Hans': 12, 'zho_Hant': 13, 'srp_Cyrl': 14})
+
+
+def test_resolves_nllb_iso_and_bcp47_codes():
+    assert REGISTRY.resolve('jpn_Jpan') == 'jpn_Jpan'
+    assert REGISTRY.resolve('JPN-jpan') == 'jpn_Jpan'
+    assert REGISTRY.resolve('ja') == 'jpn_Jpan'
+    assert REGISTRY.resolve('en-US') == 'eng_Latn'
+    assert REGISTRY.resolve('zh-TW') == 'zho_Hant'
+    assert REGISTRY.resolve('zh-Hant-HK') == 'zho_Hant'
+
+
+def test_unknown_codes_resolve_to_none():
+    assert REGISTRY.resolve('xx') is None
+    assert REGISTRY.resolve('kor_Hang') is None
+    # トークナイザーにない言語は ISO コードでも解決しない
+    assert 'ko' not in REGISTRY
+
+
+def test_token_id_and_listing():
+    assert REGISTRY.token_id('ja') == 11
+    assert REGISTRY.token_id('xx') is None
+    assert len(REGISTRY) == 5
+    assert REGISTRY.codes == ('eng_Latn', 'jpn_Jpan', 'srp_Cyrl', 'zho_Hans', 'zho_Hant')
+
+    listing = REGISTRY.to_dict()
+    assert listing['aliases']['ja'] == 'jpn_Jpan'
+    assert 'ko' not in listing['aliases']
+    assert listing['names']['jpn_Jpan'] == '日本語'
+
+
+def test_save_and_load_round_trip(tmp_path):
+    path = tmp_path / "languages.json"
+    REGISTRY.save(str(path))
+
+    loaded = LanguageRegistry.load(str(path))
+    assert loaded.codes == REGISTRY.codes
+    assert loaded.token_id('zh-Hans') == 12
@@ -0,0 +1,74 @@
+import pytest
+
+from MenZTranslator.markup import ProtectedText
+
+
+def test_inline_tags_are_translated_with_the_sentence():
+    protected = ProtectedText("<i>Hello</i> world")
+
+    # 1回の翻訳で済むよう、文中の閉じタグはセンチネルに置き換える
+    assert protected.segments == ["Hello[0] world"]
+    assert protected.restore(["こんにちは[0]世界"]) == "<i>こんにちは</i>世界"
+
+
+def test_break_tags_split_sentences():
+    protected = ProtectedText("Line one<br>Line two <b>bold</b> end")
+
+    assert protected.segments == ["Line one", "Line two [0]bold[1] end"]
+    assert protected.restore(["一行目", "二行目 [0]太字[1] 終わり"]) == "一行目<br>二行目 <b>太字</b> 終わり"
+
+
+def test_ass_line_breaks_and_overrides():
+    protected = ProtectedText("{\\an8}Hello\\N{\\i1}World{\\i0} again")
+
+    assert protected.segments == ["Hello", "World[0] again"]
+    assert protected.restore(["こんにちは", "世界[0]再び"]) == "{\\an8}こんにちは\\N{\\i1}世界{\\i0}再び"
+
+
+@pytest.mark.parametrize("text", [
+    "List<String> is generic",
+    "if a<b>c then",
+    "x<y and z>w",
+    "Copy C:\\new\\home\\notes.txt now",
+])
+def test_non_markup_is_left_in_the_text(text):
+    protected = ProtectedText(text)
+
+    assert not protected.has_spans
+    assert protected.segments == [text]
+
+
+def test_unpaired_tags_at_line_edges_are_protected():
+    # 字幕の行をまたぐ装飾タグ
+    assert ProtectedText("<i>Hello").segments == ["Hello"]
+    assert ProtectedText("world</i>").restore(["世界"]) == "世界</i>"
+
+
+def test_tags_with_attributes_are_protected():
+    protected = ProtectedText('<color=#ff0000>Warning</color>: <font color="red">low</font> HP')
+
+    assert protected.segments == ["Warning[0]: [1]low[2] HP"]
+    assert protected.restore(["警告[0]: [1]低い[2] HP"]) == \
+        '<color=#ff0000>警告</color>: <font color="red">低い</font> HP'
+
+
+def test_urls_and_emoji_are_restored():
+    protected = ProtectedText("Visit https://example.com/a now 😀")
+
+    assert protected.segments == ["Visit [0] now"]
+    assert protected.restore(["[0] に今すぐアクセス"]) == "https://example.com/a に今すぐアクセス 😀"
+
+
+def test_lost_sentinels_are_appended():
+    protected = ProtectedText("See https://example.com for details")
+
+    assert protected.restore(["詳細はこちら"]) == "詳細はこちら https://example.com"
+
+
+def test_sentinels_do_not_collide_with_existing_brackets():
+    protected = ProtectedText("[1] <i>Hello</i> world [0]")
+
+    assert protected.sentinels == {"[2]": "</i>"}
+    assert protected.segments == ["Hello[2] world [0]"]
+    # 原文にあった [0] はそのまま残す
+    assert protected.restore(["こんにちは[2]世界 [0]"]) == "[1] <i>こんにちは</i>世界 [0]"
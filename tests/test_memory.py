@@ -0,0 +1,76 @@
+from MenZTranslator.languages import LanguageRegistry
+from MenZTranslator.markup import restore_sentinels
+from MenZTranslator.memory import TranslationMemory
+
+
+def _memory(tmp_path, glossary_lines):
+    path = tmp_path / "glossary.tsv"
+    path.write_text(''.join(f"{line}\n" for line in glossary_lines), encoding='utf-8')
+    memory = TranslationMemory(LanguageRegistry({'eng_Latn': 1, 'jpn_Jpan': 2}))
+    memory.load_glossary(str(path))
+    return memory
+
+
+def test_glossary_terms_are_replaced_with_sentinels(tmp_path):
+    memory = _memory(tmp_path, ["en\tja\tMenZ\tメンツ", "en\tja\tMenZ Translator\tメンツ翻訳機"])
+
+    text, glossary = memory.apply_glossary("menz translator beats MenZ.", "eng_Latn", "jpn_Jpan")
+
+    # 原文に訳語を混ぜない（長い用語を優先し、大文字小文字は区別しない）
+    assert text == "[0] beats [1]."
+    assert glossary == {"[0]": "メンツ翻訳機", "[1]": "メンツ"}
+    assert restore_sentinels(text, "[0]は[1]に勝つ。", glossary) == "メンツ翻訳機はメンツに勝つ。"
+    assert memory.stats['glossary_applied'] == 1
+
+
+def test_glossary_matches_whole_words_only(tmp_path):
+    memory = _memory(tmp_path, ["eng_Latn\tjpn_Jpan\tcat\t猫"])
+
+    assert memory.apply_glossary("concatenate the cat", "en", "ja") == ("concatenate the [0]", {"[0]": "猫"})
+    assert memory.apply_glossary("no match here", "en", "ja") == ("no match here", {})
+    assert memory.apply_glossary("the cat", "ja", "en") == ("the cat", {})
+
+
+def test_glossary_sentinels_skip_existing_brackets(tmp_path):
+    memory = _memory(tmp_path, ["en\tja\tcat\t猫"])
+
+    text, glossary = memory.apply_glossary("[0] the cat", "en", "ja")
+
+    assert text == "[0] the [1]"
+    # 翻訳で失われた用語は末尾に付け足す
+    assert restore_sentinels(text, "[0] それ", glossary) == "[0] それ 猫"
+
+
+def test_lookup_exact_and_masked_entries(tmp_path):
+    path = tmp_path / "memory.tsv"
+    path.write_text(
+        "# コメント行\n"
+        "en\tja\tGood  morning\tおはようございます\n"
+        "eng_Latn\tjpn_Jpan\tYou have 3 new messages\t新着メッセージが3件あります\n"
+        "en\txx\tIgnored\t無視\n",
+        encoding='utf-8')
+    memory = TranslationMemory(LanguageRegistry({'eng_Latn': 1, 'jpn_Jpan': 2}))
+    memory.load(str(path))
+
+    assert memory.stats['entries'] == 2
+    assert memory.stats['unknown_language_entries'] == 1
+    # 空白の違いは無視し、言語コードはどの形式でも検索できる
+    assert memory.lookup("Good morning", "en", "ja") == "おはようございます"
+    # 数値が異なる文は翻訳文に入力側の値を当てはめる
+    assert memory.lookup("You have 12 new messages", "eng_Latn", "jpn_Jpan") == "新着メッセージが12件あります"
+    assert memory.lookup("Good night", "en", "ja") is None
+    assert memory.stats['exact_hits'] == 1
+    assert memory.stats['masked_hits'] == 1
+    assert memory.stats['misses'] == 1
+    memory.close()
+
+
+def test_lookup_jsonl(tmp_path):
+    path = tmp_path / "memory.jsonl"
+    path.write_text('{"source_lang": "en", "target_lang": "ja", "source": "Open {menu}", "target": "{menu}を開く"}\n',
+                    encoding='utf-8')
+    memory = TranslationMemory(LanguageRegistry({'eng_Latn': 1, 'jpn_Jpan': 2}))
+    memory.load(str(path))
+
+    assert memory.lookup("Open {settings}", "en", "ja") == "{settings}を開く"
+    memory.close()
@@ -0,0 +1,89 @@
+import asyncio
+import time
+
+from MenZTranslator.scheduler import FairScheduler
+
+
+class Job:
+    def __init__(self, name, cost=10):
+        self.name = name
+        self.cost = cost
+        self.status = 'pending'
+        self.enqueued_at = time.time()
+
+
+def _drain(scheduler):
+    async def run():
+        names = []
+        while scheduler.qsize():
+            job = scheduler._pop()
+            if job is None:
+                break
+            names.append(job.name)
+        return names
+    return asyncio.run(run())
+
+
+def _scheduler(**kwargs):
+    async def create():
+        return FairScheduler(is_stale=lambda job: job.status != 'pending', **kwargs)
+    return asyncio.run(create())
+
+
+def test_interleaves_clients_regardless_of_submission_count():
+    scheduler = _scheduler(quantum=10)
+    for i in range(5):
+        scheduler.put(1, 'client:bulk', Job(f"bulk{i}"))
+    scheduler.put(1, 'client:chat', Job("chat0"))
+
+    order = _drain(scheduler)
+    # 大量に投入したクライアントがいても、もう一方のジョブは2番目に処理される
+    assert order.index("chat0") == 1
+
+
+def test_weights_share_cost_proportionally():
+    scheduler = _scheduler(quantum=10, weights={'heavy': 3.0})
+    for i in range(6):
+        scheduler.put(1, 'heavy', Job(f"h{i}"))
+        scheduler.put(1, 'client:light', Job(f"l{i}"))
+
+    order = _drain(scheduler)[:8]
+    assert sum(name.startswith('h') for name in order) == 6
+    assert sum(name.startswith('l') for name in order) == 2
+
+
+def test_higher_priority_tier_first():
+    scheduler = _scheduler()
+    scheduler.put(2, 'client:a', Job("low"))
+    scheduler.put(0, 'client:b', Job("high"))
+    assert _drain(scheduler) == ["high", "low"]
+
+
+def test_stale_jobs_are_dropped_without_cost():
+    scheduler = _scheduler(quantum=10)
+    cancelled = Job("cancelled")
+    cancelled.status = 'cancelled'
+    scheduler.put(1, 'client:a', cancelled)
+    scheduler.put(1, 'client:a', Job("next"))
+    assert _drain(scheduler) == ["next"]
+    assert scheduler.qsize() == 0
+
+
+def test_stats_of_unconfigured_keys_are_dropped_when_idle():
+    scheduler = _scheduler(weights={'known': 2.0})
+    for key in ['known', 'client:1', 'gw:abc', 'made-up-key']:
+        scheduler.put(1, key, Job(key))
+    assert len(scheduler.get_stats()) == 4
+
+    _drain(scheduler)
+    stats = scheduler.get_stats()
+    # 登録済みのキーのみ残り、接続ごと・ゲートウェイ・未登録のキーは増え続けない
+    assert list(stats) == ['know…']
+    assert stats['know…']['served'] == 1
+
+
+def test_labels_hide_api_keys():
+    scheduler = _scheduler(names={'secret-key': 'unity'}, weights={'secret-key': 1.0, 'other-key': 1.0})
+    for key in ['secret-key', 'other-key', 'client:1', 'gw:abc']:
+        scheduler.put(1, key, Job(key))
+    assert set(scheduler.get_stats()) == {'unity', 'othe…', 'client:1', 'gw:abc'}
@@ -0,0 +1,43 @@
+import pytest
+
+from MenZTranslator.triage import InputTriage, classify, triage_stats
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("https://example.com/page", 'url'),
+    ("user@example.com", 'url'),
+    ("12:30", 'numeric'),
+    ("3.14", 'numeric'),
+    ("😀👍", 'emoji'),
+    ("...!?", 'punctuation'),
+    ("こんにちは、世界", 'same_language'),
+    ("Hello world", None),
+    # 漢字のみでは日本語か中国語か判定できない
+    ("東京", None),
+])
+def test_classify_to_japanese(text, expected):
+    assert classify(text, 'eng_Latn', 'jpn_Jpan') == expected
+
+
+def test_same_source_and_target_is_passed_through():
+    assert classify("Hello world", 'eng_Latn', 'eng_Latn') == 'same_language'
+    assert classify("안녕하세요", 'eng_Latn', 'kor_Hang') == 'same_language'
+    assert classify("안녕하세요", 'eng_Latn', 'jpn_Jpan') is None
+
+
+def test_input_triage_counts_categories():
+    triage = InputTriage()
+    assert triage.passthrough("42", 'eng_Latn', 'jpn_Jpan') == 'numeric'
+    assert triage.passthrough("Hello", 'eng_Latn', 'jpn_Jpan') is None
+
+    stats = triage.get_stats()
+    assert stats['checked'] == 2
+    assert stats['numeric'] == 1
+    assert stats['passthrough'] == 1
+    assert stats['passthrough_rate'] == 0.5
+
+
+def test_disabled_triage_translates_everything():
+    triage = InputTriage(enabled=False)
+    assert triage.passthrough("42", 'eng_Latn', 'jpn_Jpan') is None
+    assert triage_stats(triage.stats, False)['passthrough_rate'] is None
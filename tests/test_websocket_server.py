@@ -0,0 +1,189 @@
+import asyncio
+import json
+import os
+import threading
+
+import pytest
+
+pytest.importorskip("websockets")
+
+from MenZTranslator.config import Config
+from MenZTranslator.languages import LanguageRegistry
+from MenZTranslator.session import ClientSession
+from MenZTranslator.websocket_server import TranslationWebSocketServer, _sweep_offload_dir
+
+
+class _Incremental:
+    def discard(self, key):
+        pass
+
+    def discard_matching(self, predicate):
+        pass
+
+
+class FakeTranslator:
+    """モデルを読み込まない翻訳エンジン（最初の翻訳は release まで止まる）"""
+
+    model_name = "fake"
+    device = "cpu"
+    offloaded = False
+
+    def __init__(self):
+        self.languages = LanguageRegistry({'eng_Latn': 1, 'jpn_Jpan': 2})
+        self.incremental = _Incremental()
+        self.started = threading.Event()
+        self.released = threading.Event()
+
+    def translate(self, text, source_lang, target_lang, max_length, decoding=None):
+        self.started.set()
+        self.released.wait(5)
+        return text.upper()
+
+
+class FakeWebSocket:
+    """メッセージを送信し、until に一致する応答を受け取ってから切断するクライアント（既定は prefetch の応答）"""
+
+    remote_address = ("127.0.0.1", 50000)
+
+    def __init__(self, messages, until=lambda data: data.get('type') == 'prefetch'):
+        self.messages = list(messages)
+        self.until = until
+        self.sent = []
+        self.acknowledged = asyncio.Event()
+
+    async def send(self, payload):
+        data = json.loads(payload)
+        self.sent.append(data)
+        if self.until(data):
+            self.acknowledged.set()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.messages:
+            return self.messages.pop(0)
+        await self.acknowledged.wait()
+        raise StopAsyncIteration
+
+
+@pytest.fixture
+def make_server(tmp_path, monkeypatch):
+    def make(overrides=None):
+        translator = FakeTranslator()
+        monkeypatch.setattr(TranslationWebSocketServer, '_create_engine', lambda self, config: (translator, None))
+        config = Config(str(tmp_path / "translator.ini"))
+        for (section, key), value in (overrides or {}).items():
+            config.override(section, key, value)
+        return TranslationWebSocketServer(config)
+    return make
+
+
+@pytest.fixture
+def server(make_server):
+    return make_server()
+
+
+def test_disconnect_with_queued_prefetches_clears_prefetching(server):
+    async def scenario():
+        server.dispatcher.start()
+        try:
+            websocket = FakeWebSocket([json.dumps({
+                "type": "prefetch",
+                "texts": ["one", "two", "three"],
+                "source_lang": "eng_Latn",
+                "target_lang": "jpn_Jpan"
+            })])
+            await server.handle_client(websocket, asyncio.Event())
+        finally:
+            server.translator.released.set()
+            await server.dispatcher.stop()
+        return websocket
+
+    websocket = asyncio.run(scenario())
+    assert any(data.get('type') == 'prefetch' and data['queued'] == 3 for data in websocket.sent)
+    assert server.prefetching == {}
+    assert server.dispatcher.stats['cancelled'] == 3
+
+
+def test_only_registered_api_keys_get_their_own_flow(make_server):
+    server = make_server({('SCHEDULING', 'client.unity'): 'registered-key, 2'})
+    session = ClientSession(FakeWebSocket([]), "c1", 16)
+
+    assert server._scheduling_key({'api_key': 'registered-key'}, session) == 'registered-key'
+    # 未登録のキーを変えながら送っても接続ごとの扱いになる
+    assert server._scheduling_key({'api_key': 'made-up-1'}, session) is None
+    assert server._scheduling_key({'api_key': 'gw:other'}, session) is None
+
+    session.trusted_gateway = True
+    assert server._scheduling_key({'api_key': 'gw:other'}, session) == 'gw:other'
+    assert server._scheduling_key({'api_key': 'made-up-2'}, session) is None
+
+
+def test_cancel_is_handled_while_all_slots_are_busy(make_server):
+    server = make_server({('SERVER', 'max_inflight_per_connection'): '2'})
+
+    def translation(request_id, text):
+        return json.dumps({"request_id": request_id, "text": text,
+                           "source_lang": "eng_Latn", "target_lang": "jpn_Jpan"})
+
+    async def scenario():
+        server.dispatcher.start()
+        websocket = FakeWebSocket(
+            [translation("t1", "first"), translation("t2", "second"),
+             json.dumps({"type": "cancel", "request_ids": ["t2", "unknown"]})],
+            until=lambda data: data.get('request_id') == 't1')
+
+        async def cancelled():
+            while not any(data.get('status') == 'cancelled' for data in websocket.sent):
+                await asyncio.sleep(0.01)
+
+        try:
+            client = asyncio.create_task(server.handle_client(websocket, asyncio.Event()))
+            # t1 の推論中で処理枠が埋まっていても cancel は処理される
+            await asyncio.wait_for(cancelled(), 5)
+            server.translator.released.set()
+            await asyncio.wait_for(client, 5)
+        finally:
+            server.translator.released.set()
+            await server.dispatcher.stop()
+        return websocket
+
+    websocket = asyncio.run(scenario())
+    assert {"type": "cancel", "cancelled": 1, "status": "completed"} in websocket.sent
+    assert {"request_id": "t2", "status": "cancelled"} in websocket.sent
+    assert any(data.get('request_id') == 't1' and data.get('translated') == 'FIRST' for data in websocket.sent)
+
+
+def test_sweep_offload_dir_removes_files_of_previous_processes(tmp_path):
+    own = f"0123456789ab_{os.getpid()}_model.safetensors"
+    stale = ["0123456789ab_1_model.safetensors", "0123456789ab_1_assistant.safetensors"]
+    for name in [own, "notes.txt"] + stale:
+        (tmp_path / name).write_bytes(b"")
+
+    assert _sweep_offload_dir(str(tmp_path)) == 2
+    assert sorted(os.listdir(tmp_path)) == sorted([own, "notes.txt"])
+    assert _sweep_offload_dir(str(tmp_path / "missing")) == 0
+
+
+def test_glossary_terms_are_restored_after_translation(make_server, tmp_path):
+    glossary = tmp_path / "glossary.tsv"
+    glossary.write_text("en\tja\tMenZ\tメンツ\n", encoding='utf-8')
+    server = make_server({('MEMORY', 'enabled'): 'true', ('MEMORY', 'glossary_files'): str(glossary)})
+    server.translator.released.set()
+
+    async def scenario():
+        server.dispatcher.start()
+        websocket = FakeWebSocket(
+            [json.dumps({"request_id": "g1", "text": "MenZ is fast",
+                         "source_lang": "eng_Latn", "target_lang": "jpn_Jpan"})],
+            until=lambda data: data.get('request_id') == 'g1')
+        try:
+            await asyncio.wait_for(server.handle_client(websocket, asyncio.Event()), 5)
+        finally:
+            await server.dispatcher.stop()
+        return websocket
+
+    websocket = asyncio.run(scenario())
+    # モデル（入力を大文字にする）には訳語ではなくセンチネルが渡る
+    assert any(data.get('request_id') == 'g1' and data.get('translated') == 'メンツ IS FAST' for data in websocket.sent)